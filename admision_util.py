@@ -0,0 +1,177 @@
+# admision_util.py
+"""
+Control de admisión de POST /generar: rechaza rápido (413/429/503 con
+Retry-After) en vez de dejar que los requests se apilen detrás del timeout.
+
+Se evalúa en este orden, antes de leer el cuerpo del request:
+  1. Tamaño: Content-Length > GENERAR_MAX_BYTES -> 413. Sin Content-Length
+     (chunked) rige el tope general MAX_CONTENT_LENGTH de app.py.
+  2. Token bucket por IP (ADMISION_IP_POR_MIN, ráfaga ADMISION_IP_RAFAGA) y
+     global (ADMISION_GLOBAL_POR_MIN / ADMISION_GLOBAL_RAFAGA) -> 429. El
+     Retry-After es lo que falta para el próximo token.
+  3. Trabajos en curso en la cola (pendientes + en proceso, compartida por
+     todos los workers) >= ADMISION_MAX_EN_CURSO -> 503.
+Conversiones: cada conversión a PDF (app._etapa_pdf) toma un lugar del
+semáforo (ADMISION_CONCURRENCIA, por defecto PDF_POOL_SIZE); los hilos de la
+cola esperan hasta PDF_QUEUE_WAIT y si no, la etapa se reintenta. Con
+JOBS_WORKERS=0 la conversión corre dentro de /generar: el request toma el
+lugar antes de registrar el trabajo y si no se libera uno en ADMISION_ESPERA
+seg. -> 503.
+
+Los buckets y el semáforo son por proceso: con N workers de Gunicorn los
+límites efectivos de la instancia son N veces los configurados.
+"""
+import os
+import math
+import time
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+import metricas_util
+import pdf_util
+from firma_util import FIRMA_MAX_BYTES
+
+# ==============================
+# Config desde variables de entorno
+# ==============================
+GENERAR_MAX_BYTES       = int(os.getenv("GENERAR_MAX_BYTES", str(FIRMA_MAX_BYTES * 4 // 3 + 64 * 1024)))
+ADMISION_IP_POR_MIN     = float(os.getenv("ADMISION_IP_POR_MIN", "10"))
+ADMISION_IP_RAFAGA      = float(os.getenv("ADMISION_IP_RAFAGA", "5"))
+ADMISION_GLOBAL_POR_MIN = float(os.getenv("ADMISION_GLOBAL_POR_MIN", "120"))
+ADMISION_GLOBAL_RAFAGA  = float(os.getenv("ADMISION_GLOBAL_RAFAGA", "20"))
+ADMISION_MAX_EN_CURSO   = int(os.getenv("ADMISION_MAX_EN_CURSO", str(10 * max(1, pdf_util.PDF_POOL_SIZE))))
+ADMISION_CONCURRENCIA   = int(os.getenv("ADMISION_CONCURRENCIA", str(max(1, pdf_util.PDF_POOL_SIZE))))
+ADMISION_ESPERA         = float(os.getenv("ADMISION_ESPERA", "2"))        # seg. esperando lugar
+ADMISION_RETRY_AFTER    = int(os.getenv("ADMISION_RETRY_AFTER", "10"))    # seg. sugeridos en los 503
+ADMISION_PROXIES        = int(os.getenv("ADMISION_PROXIES", "1"))         # proxies de confianza (X-Forwarded-For)
+ADMISION_MAX_IPS        = 10000                                           # buckets por IP en memoria
+
+# Respuesta de rechazo: código HTTP, motivo (etiqueta de la métrica) y Retry-After en seg.
+Rechazo = namedtuple("Rechazo", "codigo motivo retry_after")
+
+
+class CuboTokens:
+    """Token bucket: `tasa` tokens por segundo, hasta `rafaga` acumulados. Thread-safe."""
+
+    def __init__(self, tasa: float, rafaga: float):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self._tokens = rafaga
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tomar(self) -> float:
+        """Consume un token. Devuelve 0 si había, o los segundos hasta el próximo (sin consumir)."""
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.rafaga, self._tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.tasa if self.tasa > 0 else float(ADMISION_RETRY_AFTER)
+
+
+class CubosPorClave:
+    """Un CuboTokens por clave (IP), acotado a `maximo` claves (LRU)."""
+
+    def __init__(self, tasa: float, rafaga: float, maximo: int = ADMISION_MAX_IPS):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.maximo = maximo
+        self._cubos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def tomar(self, clave: str) -> float:
+        with self._lock:
+            cubo = self._cubos.get(clave)
+            if cubo is None:
+                cubo = self._cubos[clave] = CuboTokens(self.tasa, self.rafaga)
+                while len(self._cubos) > self.maximo:
+                    self._cubos.popitem(last=False)
+            else:
+                self._cubos.move_to_end(clave)
+        return cubo.tomar()
+
+
+def ip_cliente(request) -> str:
+    """IP del cliente: la agregada por el último de los ADMISION_PROXIES proxies de confianza."""
+    if ADMISION_PROXIES > 0:
+        saltos = [x.strip() for x in request.headers.get("X-Forwarded-For", "").split(",") if x.strip()]
+        if len(saltos) >= ADMISION_PROXIES:
+            return saltos[-ADMISION_PROXIES]
+    return request.remote_addr or "-"
+
+
+class Admision:
+    def __init__(self, max_bytes: int = GENERAR_MAX_BYTES, max_en_curso: int = ADMISION_MAX_EN_CURSO,
+                 concurrencia: int = ADMISION_CONCURRENCIA, espera: float = ADMISION_ESPERA):
+        self.max_bytes = max_bytes
+        self.max_en_curso = max_en_curso
+        self.espera = espera
+        self.por_ip = CubosPorClave(ADMISION_IP_POR_MIN / 60, ADMISION_IP_RAFAGA)
+        self.total = CuboTokens(ADMISION_GLOBAL_POR_MIN / 60, ADMISION_GLOBAL_RAFAGA)
+        self._cupos = threading.BoundedSemaphore(max(1, concurrencia))
+        self._local = threading.local()
+
+    def verificar(self, ip: str, largo, en_curso) -> Rechazo:
+        """
+        Chequeos previos a leer el cuerpo. Devuelve un Rechazo o None si se admite.
+          - largo: Content-Length (None si no vino)
+          - en_curso(): cantidad de trabajos pendientes/en proceso (solo se consulta
+            si pasaron los buckets)
+        """
+        rechazo = self._verificar(ip, largo, en_curso)
+        if rechazo is not None:
+            metricas_util.ADMISION_RECHAZOS.inc(motivo=rechazo.motivo)
+        return rechazo
+
+    def _verificar(self, ip, largo, en_curso):
+        if largo is not None and largo > self.max_bytes:
+            return Rechazo(413, "tamano", None)
+        espera = self.por_ip.tomar(ip)
+        if espera:
+            return Rechazo(429, "ip", math.ceil(espera))
+        espera = self.total.tomar()
+        if espera:
+            return Rechazo(429, "global", math.ceil(espera))
+        if self.max_en_curso > 0 and en_curso() >= self.max_en_curso:
+            return Rechazo(503, "cola", ADMISION_RETRY_AFTER)
+        return None
+
+    @contextmanager
+    def conversion(self, espera: float = None):
+        """
+        `with adm.conversion() as ok:` reserva un lugar para convertir a PDF.
+        ok=False si no se liberó ninguno en `espera` seg. (por defecto ADMISION_ESPERA).
+        Reentrante en el mismo hilo: /generar con JOBS_WORKERS=0 toma el lugar y
+        la etapa pdf, que corre en ese mismo hilo, lo reusa.
+        """
+        if getattr(self._local, "tomado", False):
+            yield True
+            return
+        ok = self._cupos.acquire(blocking=False)
+        if not ok:
+            metricas_util.ADMISION_EN_ESPERA.inc()
+            ok = self._cupos.acquire(timeout=self.espera if espera is None else espera)
+        self._local.tomado = ok
+        try:
+            yield ok
+        finally:
+            if ok:
+                self._local.tomado = False
+                self._cupos.release()
+
+
+_ADMISION = None
+_ADMISION_LOCK = threading.Lock()
+
+
+def get_admision() -> Admision:
+    global _ADMISION
+    if _ADMISION is None:
+        with _ADMISION_LOCK:
+            if _ADMISION is None:
+                _ADMISION = Admision()
+    return _ADMISION
@@ -1,52 +1,78 @@
+import drive_util
 from drive_util import upload_path_to_drive
-from flask import Flask, render_template, request, send_file, session
+from flask import (Flask, Response, abort, g, jsonify, render_template, request, send_file,
+                   stream_with_context, url_for)
 from uuid import uuid4
 import os
 import re
+import sys
+import time
+import shutil
+import hmac
+import json
+import hashlib
 import unicodedata
 from datetime import datetime
 from io import BytesIO
+from contextlib import nullcontext
 import base64
-import html
-
-from docx import Document
-from docx.shared import Inches, Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.table import WD_ALIGN_VERTICAL
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
-from PIL import Image
+from typing import TYPE_CHECKING
 
 from dotenv import load_dotenv
+import click
 
-# Email helper (debe existir correo_util.py con enviar_email(to, asunto, cuerpo, adjunto_path))
+# Módulos del proyecto
+import admision_util
+import artefactos_util
 import correo_util
-
-# (Opcional/Windows) Para docx2pdf con Word
-try:
-    import pythoncom
-    HAS_PYTHONCOM = True
-except Exception:
-    HAS_PYTHONCOM = False
+import exportar_util
+import firma_util
+import indice_util
+import lote_util
+import metricas_util
+import pdf_util
+import plantilla_util
+import trabajos_util
+import vista_previa_util
+
+# python-docx, Pillow, reportlab (pdf_nativo_util), googleapiclient y requests se
+# importan al primer uso: GET / sale de la vista previa cacheada sin cargarlos
+if TYPE_CHECKING:
+    from docx.document import Document
 
 # =========================================================
 # App / Config
 # =========================================================
 load_dotenv()
+metricas_util.configurar_logging()
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET", os.urandom(24))
+# Tope de cualquier request (los lotes van como archivo); /generar tiene uno propio, ver admision_util
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_CONTENT_LENGTH_MB", "16")) * 1024 * 1024
+# Tope por campo de formulario multipart en memoria (firmaBase64 incluida; Flask >= 3.1)
+app.config["MAX_FORM_MEMORY_SIZE"] = admision_util.GENERAR_MAX_BYTES
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 TEMPLATE_DOCX = os.path.join(BASE_DIR, "Contrato_Plantilla.docx")
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "data"))
+LOTES_DIR = os.getenv("LOTES_DIR", os.path.join(DATA_DIR, "lotes"))   # salida por defecto de `flask lote`
+
+# Endpoints administrativos (lotes): deshabilitados si no hay token
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
-# Asegurar carpeta de salida también en Gunicorn (Render)
+# static/ solo guarda recursos públicos (firma de la empresa, logo); los contratos
+# van al almacén privado de artefactos_util
 os.makedirs(STATIC_DIR, exist_ok=True)
+# Contratos que versiones anteriores dejaban en static/ (<slug>.docx/.pdf, firma_<slug>.png)
+_LEGADO_STATIC_RE = r"^.+_\d{8}_\d{6}_[0-9a-f]{6}\.(docx|pdf|png)$"
 
 # Datos empresa (ajustables)
 RESPONSABLE_EMPRESA = "Alan Arndt, Dueño de la Empresa"
 FIRMA_EMPRESA_PATH = os.path.join(STATIC_DIR, "firma_empresa.png")
+# Misma firma recortada y escalada al ancho impreso (se genera una vez, ver _firma_empresa_impresion)
+FIRMA_EMPRESA_IMPRESION = os.path.join(DATA_DIR, "firma_empresa_impresion.png")
 EMAIL_EMPRESA = os.getenv("EMAIL_EMPRESA", "")
 CONTACTO_TELEFONO = os.getenv("CONTACTO_TELEFONO", "")
 
@@ -54,6 +80,16 @@ CONTACTO_TELEFONO = os.getenv("CONTACTO_TELEFONO", "")
 SIGNATURE_IMAGE_WIDTH_IN = 2.8
 SIGNATURE_LABEL_FONT_PT = 12
 
+# Doble envío: mismo formulario (huella) dentro de la ventana -> mismo trabajo
+IDEMPOTENCIA_VENTANA = int(os.getenv("IDEMPOTENCIA_VENTANA", "900"))   # seg.
+_ENVIOS_RECIENTES = trabajos_util.CacheTTL(IDEMPOTENCIA_VENTANA, int(os.getenv("IDEMPOTENCIA_CACHE", "4096")))
+
+# Asunto del correo con el contrato (envío y reenvío)
+ASUNTO_CONTRATO = "Contrato firmado - Seguridad Ituzaingó"
+
+# Backend PDF: "libreoffice" (DOCX -> PDF con soffice) o "nativo" (reportlab, sin LibreOffice)
+PDF_BACKEND = os.getenv("PDF_BACKEND", "libreoffice").strip().lower()
+
 # =========================================================
 # Helpers
 # =========================================================
@@ -65,66 +101,39 @@ def _slug(s: str) -> str:
     s = re.sub(r"[^a-zA-Z0-9]+", "_", s).strip("_").lower()
     return s or f"cliente_{uuid4().hex[:6]}"
 
-def _docx_to_html_paragraphs(path_docx: str) -> str:
-    """Convierte el DOCX a párrafos HTML simples para previsualizarlo."""
-    doc = Document(path_docx)
-    parts = []
-    for p in doc.paragraphs:
-        text = html.escape(p.text).strip()
-        parts.append(f"<p>{text or '&nbsp;'}</p>")
-    return "\n".join(parts)
-
-def _b64_to_pil_image(b64data: str) -> Image.Image:
-    """Convierte base64 (data:image/png;base64,...) a PIL Image RGBA."""
-    if "," in b64data:
-        b64data = b64data.split(",", 1)[1]
-    raw = base64.b64decode(b64data)
-    return Image.open(BytesIO(raw)).convert("RGBA")
-
-def _insert_text_placeholders(doc: Document, mapping: dict):
-    """
-    Reemplazo robusto a nivel de párrafo/celda.
-    - Normaliza NBSP/zero-width en el texto del DOCX.
-    - Hace reemplazos literales (mapping).
-    - Aplica un regex tolerante para {{ ubicacion_monitoreo }} por si quedó cortado/espaciado.
-    """
-    import re
-
-    def _norm(s: str) -> str:
-        # NBSP -> espacio, elimina zero-width
-        return (s or "").replace("\xa0", " ").replace("\u200b", "")
-
-    # regex tolerante: {{ u b i c a c i o n _? m o n i t o r e o }}
-    ubi_mon_re = re.compile(
-        r"\{\{\s*u\s*b\s*i\s*c\s*a\s*c\s*i\s*o\s*n\s*(?:_| |\t)?\s*m\s*o\s*n\s*i\s*t\s*o\s*r\s*e\s*o\s*\}\}",
-        re.IGNORECASE
-    )
-
-    def replace_text(text: str) -> str:
-        t = _norm(text)
-        # Pase literal con lo que ya tenés en 'mapping'
-        for k, v in mapping.items():
-            t = t.replace(k, v)
-        # Pase extra solo para ubicacion_monitoreo tolerando cortes/espacios
-        valor_ubi_mon = mapping.get("{{ ubicacion_monitoreo }}", "")
-        if valor_ubi_mon:
-            t = ubi_mon_re.sub(valor_ubi_mon, t)
-        return t
+def _huella_envio(campos: dict, firma_b64: str, token: str = "") -> str:
+    """
+    sha256 del envío normalizado (campos + firma tal como llegó + token del formulario).
+    El token cambia con cada carga de la página: un doble click repite la huella,
+    un contrato nuevo cargado a propósito no.
+    """
+    h = hashlib.sha256()
+    for k in sorted(campos):
+        v = re.sub(r"\D", "", campos[k]) if k == "dni" else " ".join(campos[k].split()).lower()
+        h.update(f"{k}={v}\x00".encode("utf-8"))
+    h.update(f"token={token.strip()[:64]}\x00".encode("utf-8"))
+    h.update("".join(firma_b64.split(",", 1)[-1].split()).encode("ascii", "ignore"))
+    return h.hexdigest()
+
+def _insert_text_placeholders(doc: "Document", mapping: dict):
+    """
+    Reemplazo robusto a nivel de párrafo/celda (recorre todo el documento).
+    - Un solo escaneo de tags por párrafo, tolerante a espacios/NBSP/zero-width.
+    - Respeta el formato de los runs aunque el tag esté partido entre varios.
+    El pipeline usa la plantilla compilada, que solo toca los párrafos con tags.
+    """
+    claves = plantilla_util.normalizar_mapping(mapping)
 
     # Párrafos fuera de tablas
     for p in doc.paragraphs:
-        new = replace_text(p.text)
-        if new != p.text:
-            p.text = new
+        plantilla_util.reemplazar_en_parrafo(p, claves)
 
     # Celdas de tablas
     for table in doc.tables:
         for row in table.rows:
             for cell in row.cells:
                 for p in cell.paragraphs:
-                    new = replace_text(p.text)
-                    if new != p.text:
-                        p.text = new
+                    plantilla_util.reemplazar_en_parrafo(p, claves)
 
 def _ensure_company_signature(path_png: str, texto: str = "Alan Arndt"):
     """Genera una firma PNG básica para la empresa si no existe."""
@@ -142,24 +151,32 @@ def _ensure_company_signature(path_png: str, texto: str = "Alan Arndt"):
     draw.text(((600 - w) // 2, (220 - h) // 2), texto, fill=(0, 0, 0, 255), font=font)
     img.save(path_png, "PNG")
 
-def _add_signatures_section(doc: Document, firma_cliente_path: str, firma_empresa_path: str):
-    """
-    Inserta ambas firmas en una tabla 2x2:
-      Fila 0: imágenes (cliente | empresa)
-      Fila 1: rótulos  ("Firma del Cliente" | "Firma de la Empresa")
-    Si detecta ya una tabla con esos rótulos, la reutiliza.
-    """
-    target = None
+def _tabla_firmas(doc: "Document"):
+    """La tabla con los rótulos "Firma del Cliente" | "Firma de la Empresa" en la fila 1, o None."""
     for tbl in doc.tables:
         try:
             if len(tbl.rows) >= 2 and len(tbl.columns) >= 2:
                 if ("firma del cliente" in tbl.cell(1, 0).text.lower()
                         and "firma de la empresa" in tbl.cell(1, 1).text.lower()):
-                    target = tbl
-                    break
+                    return tbl
         except Exception:
             continue
+    return None
 
+def _add_signatures_section(doc: "Document", firma_cliente, firma_empresa_path: str):
+    """
+    Inserta ambas firmas en una tabla 2x2 (cada firma: ruta o stream PNG, o None):
+      Fila 0: imágenes (cliente | empresa)
+      Fila 1: rótulos  ("Firma del Cliente" | "Firma de la Empresa")
+    Si detecta ya una tabla con esos rótulos, la reutiliza. Devuelve la tabla usada.
+    """
+    from docx.enum.table import WD_ALIGN_VERTICAL
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+    from docx.shared import Inches, Pt
+
+    target = _tabla_firmas(doc)
     if target is None:
         target = doc.add_table(rows=2, cols=2)
         target.cell(1, 0).text = "Firma del Cliente"
@@ -196,14 +213,19 @@ def _add_signatures_section(doc: Document, firma_cliente_path: str, firma_empres
                 pass
 
     # Fila 0: imágenes centradas
-    for col, img_path in enumerate([firma_cliente_path, firma_empresa_path]):
+    for col, img in enumerate([firma_cliente, firma_empresa_path]):
         c = target.cell(0, col)
         c.text = ""
         c.vertical_alignment = WD_ALIGN_VERTICAL.CENTER
         p = c.paragraphs[0]
         p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        if os.path.exists(img_path) and os.path.getsize(img_path) > 0:
-            p.add_run().add_picture(img_path, width=Inches(SIGNATURE_IMAGE_WIDTH_IN))
+        if img is None:
+            continue
+        if hasattr(img, "read"):
+            img.seek(0)
+            p.add_run().add_picture(img, width=Inches(SIGNATURE_IMAGE_WIDTH_IN))
+        elif os.path.exists(img) and os.path.getsize(img) > 0:
+            p.add_run().add_picture(img, width=Inches(SIGNATURE_IMAGE_WIDTH_IN))
 
     # Fila 1: rótulos centrados
     for col, texto in enumerate(["Firma del Cliente", "Firma de la Empresa"]):
@@ -218,42 +240,390 @@ def _add_signatures_section(doc: Document, firma_cliente_path: str, firma_empres
             run.font.size = Pt(SIGNATURE_LABEL_FONT_PT)
         except Exception:
             pass
+    return target
+
+_FIRMA_EMPRESA_LISTA = None
+
+def _firma_empresa_impresion() -> str:
+    """
+    Ruta de la firma de la empresa lista para imprimir (recortada al trazo y escalada
+    a SIGNATURE_IMAGE_WIDTH_IN, como la del cliente). Se calcula una vez por proceso;
+    el archivo se regenera si el original es más nuevo.
+    """
+    global _FIRMA_EMPRESA_LISTA
+    if _FIRMA_EMPRESA_LISTA is None:
+        _ensure_company_signature(FIRMA_EMPRESA_PATH)
+        if (not os.path.exists(FIRMA_EMPRESA_IMPRESION)
+                or os.path.getmtime(FIRMA_EMPRESA_IMPRESION) < os.path.getmtime(FIRMA_EMPRESA_PATH)):
+            with open(FIRMA_EMPRESA_PATH, "rb") as f:
+                png = firma_util.preparar_firma_bytes(f.read(), SIGNATURE_IMAGE_WIDTH_IN)
+            os.makedirs(os.path.dirname(FIRMA_EMPRESA_IMPRESION), exist_ok=True)
+            tmp = f"{FIRMA_EMPRESA_IMPRESION}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(png)
+            os.replace(tmp, FIRMA_EMPRESA_IMPRESION)
+        _FIRMA_EMPRESA_LISTA = FIRMA_EMPRESA_IMPRESION
+    return _FIRMA_EMPRESA_LISTA
+
+def _preparar_tabla_firmas(doc: "Document"):
+    """
+    Se aplica una vez a la plantilla compilada: agrega la tabla de firmas con la
+    de la empresa ya insertada. Su imagen queda como parte compartida entre los
+    clones, así cada contrato solo agrega la firma del cliente.
+    """
+    _add_signatures_section(doc, None, _firma_empresa_impresion())
+
+def _insertar_firma_cliente(doc: "Document", firma_png: bytes):
+    """
+    Pone la firma del cliente en la celda (0, 0) de la tabla de firmas precompilada.
+    La tabla se busca por sus rótulos: la plantilla puede traerla y no ser la última.
+    """
+    from docx.shared import Inches
+
+    tabla = _tabla_firmas(doc)
+    if tabla is None:
+        raise RuntimeError("La plantilla no tiene la tabla de firmas")
+    p = tabla.cell(0, 0).paragraphs[0]
+    p.add_run().add_picture(BytesIO(firma_png), width=Inches(SIGNATURE_IMAGE_WIDTH_IN))
 
 def _export_to_pdf_safe(out_docx: str, out_pdf: str) -> bool:
     """
-    Convierte DOCX -> PDF en Linux usando LibreOffice.
-    - Fuerza headless/locale y prueba 'soffice' y 'libreoffice'.
+    Convierte DOCX -> PDF en Linux usando LibreOffice (ver pdf_util).
+    - Usa el pool de instancias calientes y cae a la CLI si hace falta.
+    - Si el pool está saturado propaga ConversionOcupada (la etapa se reintenta).
+    """
+    try:
+        return pdf_util.convertir_docx_a_pdf(out_docx, out_pdf)
+    except pdf_util.ConversionOcupada:
+        raise
+    except Exception:
+        app.logger.exception("[PDF] Error convirtiendo a PDF")
+        return False
+
+def _export_to_pdf_nativo(datos: dict, firma_png, out_pdf: str) -> bool:
+    """
+    Arma el PDF directo desde el layout cacheado de la plantilla (pdf_nativo_util),
+    sin pasar por el DOCX ni LibreOffice. False si falla (se usa el camino DOCX).
+    """
+    try:
+        import pdf_nativo_util   # reportlab: solo con PDF_BACKEND=nativo
+        return pdf_nativo_util.renderizar_contrato(
+            TEMPLATE_DOCX, _mapping_contrato(datos), out_pdf,
+            firma_cliente=firma_png,
+            firma_empresa_path=_firma_empresa_impresion(),
+            ancho_firma_in=SIGNATURE_IMAGE_WIDTH_IN,
+            tam_rotulo=SIGNATURE_LABEL_FONT_PT,
+        )
+    except Exception:
+        app.logger.exception("[PDF] Error en el render nativo")
+        return False
+
+def _cuerpo_email(nombre: str, ubicacion: str, ubicacion_monitoreo: str) -> str:
+    return (
+        f"Estimado/a {nombre},\n\n"
+        f"Adjuntamos el contrato firmado correspondiente al servicio de monitoreo en {ubicacion_monitoreo}.\n"
+        f"Domicilio del abonado: {ubicacion}.\n"
+        "Le recomendamos conservar el archivo para su referencia.\n\n"
+        "Quedamos a disposición por cualquier consulta.\n\n"
+        "Atentamente,\n"
+        "Seguridad Ituzaingó\n"
+        "Alan Arndt — Dueño de la Empresa\n"
+        f"Tel.: {CONTACTO_TELEFONO or '-'}\n"
+        f"Email: {EMAIL_EMPRESA or '-'}\n"
+    )
+
+# =========================================================
+# Pipeline de contratos (corre en los workers de trabajos_util)
+# =========================================================
+def _mapping_contrato(datos: dict) -> dict:
+    """Placeholders de la plantilla -> valores del contrato (DOCX y PDF nativo)."""
+    return {
+        "{{ nombre }}": datos["nombre"],
+        "{{ dni }}": datos["dni"],
+        "{{ email }}": datos["email"],
+        "{{ ubicacion }}": datos["ubicacion"],                         # domicilio del abonado
+        "{{ ubicacion_monitoreo }}": datos["ubicacion_monitoreo"],     # lugar monitoreado
+        "{{ fecha_hoy }}": datos["fecha"],
+    }
+
+def _render_contrato(datos: dict, firma_png, out_docx: str):
     """
-    import subprocess, shlex
+    Camino común de /generar y de los lotes: completa la plantilla, agrega las
+    firmas y guarda el DOCX.
+      - datos: nombre, dni, email, ubicacion, ubicacion_monitoreo, fecha (dd/mm/aaaa)
+      - firma_png: bytes del PNG de la firma del cliente (o None: celda vacía)
+    """
+    mapping = _mapping_contrato(datos)
+    etapa = metricas_util.ETAPA_SEGUNDOS.tiempo
+    # Plantilla precompilada: clona el XML y reemplaza solo los párrafos indexados;
+    # ya trae la tabla de firmas con la de la empresa
+    with etapa(etapa="plantilla"):
+        doc = plantilla_util.get_plantilla(TEMPLATE_DOCX, _preparar_tabla_firmas).completar(mapping)
+
+    # Firma del cliente
+    with etapa(etapa="firmas"):
+        if firma_png:
+            _insertar_firma_cliente(doc, firma_png)
+
+    with etapa(etapa="guardar_docx"):
+        doc.save(out_docx)
 
-    out_dir = os.path.dirname(out_pdf) or "."
-    env = os.environ.copy()
-    env.setdefault("HOME", "/tmp")
-    env.setdefault("LANG", "en_US.UTF-8")
+def _etapa_render(datos: dict, resultado: dict) -> dict:
+    """Abre la plantilla, hace los reemplazos, agrega las firmas y guarda el DOCX en el almacén."""
+    almacen = artefactos_util.get_almacen()
+    out_docx = os.path.join(almacen.directorio_trabajo(datos["slug"]), f"{datos['slug']}.docx")
+    try:
+        _render_contrato(datos, base64.b64decode(datos["firma_png"]), out_docx)
+        return {"docx": almacen.guardar(out_docx)}
+    finally:
+        almacen.liberar_trabajo(datos["slug"])
+
+def _etapa_pdf(datos: dict, resultado: dict) -> dict:
+    """Convierte a PDF (si falla, dejamos el DOCX como archivo final)."""
+    almacen = artefactos_util.get_almacen()
+    out_docx = resultado["docx"]
+    out_pdf = os.path.join(almacen.directorio_trabajo(datos["slug"]), f"{datos['slug']}.pdf")
+    try:
+        # Un lugar del semáforo de conversiones (admision_util): acota los soffice en curso
+        with admision_util.get_admision().conversion(espera=pdf_util.PDF_QUEUE_WAIT) as ok, \
+                metricas_util.ETAPA_SEGUNDOS.tiempo(etapa="pdf"):
+            if not ok:
+                raise RuntimeError("Sin lugar para convertir a PDF")
+            pdf_ok = False
+            if PDF_BACKEND == "nativo":
+                pdf_ok = _export_to_pdf_nativo(datos, base64.b64decode(datos["firma_png"]), out_pdf)
+            if not pdf_ok:
+                pdf_ok = _export_to_pdf_safe(out_docx, out_pdf)
+        if pdf_ok and os.path.exists(out_pdf) and os.path.getsize(out_pdf) > 0:
+            final = _archivo_final(datos, almacen.guardar(out_pdf))
+            # Con el PDF guardado el DOCX intermedio ya no hace falta
+            almacen.descartar(out_docx)
+            return dict(final, docx=None)
+    finally:
+        almacen.liberar_trabajo(datos["slug"])
+    metricas_util.PDF_RESPALDO_DOCX.inc()
+    app.logger.warning("[PDF] Sin PDF para %s, se entrega el DOCX", datos["slug"])
+    return _archivo_final(datos, out_docx)
+
+def _archivo_final(datos: dict, ruta: str) -> dict:
+    """Archivo que se sube/envía, con su token de descarga (GET /descargar/<token>)."""
+    ext = os.path.splitext(ruta)[1].lower()
+    token = artefactos_util.get_almacen().emitir_token(ruta, f"{datos['slug']}{ext}")
+    return {"archivo": ruta, "descarga": token}
+
+def _etapa_drive(datos: dict, resultado: dict) -> dict:
+    """Sube el archivo final a Drive."""
+    adjunto_path = resultado["archivo"]
+    ext = os.path.splitext(adjunto_path)[1].lower()
+    mimetype = "application/pdf" if ext == ".pdf" else "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+    fecha_str = datetime.strptime(datos["fecha"], "%d/%m/%Y").strftime("%Y-%m-%d")
+    nombre_remoto = exportar_util.nombre_archivo(datos["nombre"], datos["dni"], fecha_str, ext)
+
+    # La clave (slug) hace idempotente la subida: un reintento no duplica el archivo
+    try:
+        drive_id = upload_path_to_drive(adjunto_path, nombre_remoto, mimetype,
+                                        clave=datos["slug"], slug=datos["slug"])
+    except drive_util.DriveNoConfigurado as e:
+        raise trabajos_util.SinReintento(str(e))
+    app.logger.info(f"[Drive] Subido OK. fileId={drive_id}")
+    # Ya hay copia en Drive: los archivos locales pasan a la retención corta
+    artefactos_util.get_almacen().marcar_subido(adjunto_path, resultado.get("docx"))
+    return {"drive_id": drive_id}
+
+def _drive_subido(entrada: dict):
+    """
+    Subida que terminó el barrido del spool después de que la etapa drive agotó sus
+    reintentos: se refleja en el trabajo, el almacén y el índice. Si el trabajo todavía
+    corre, TrabajoEnProceso deja la entrada en el spool y se avisa en el próximo barrido.
+    """
+    slug, drive_id = entrada["slug"], entrada["file_id"]
+    cola = _get_cola()
+    job_id = cola.buscar_slug(slug)
+    resultado = cola.resolver_etapa(job_id, "drive", {"drive_id": drive_id}) if job_id else {}
+    artefactos_util.get_almacen().marcar_subido(entrada["path"], resultado.get("docx"))
+    indice_util.get_indice().asignar_drive(slug, drive_id)
+    app.logger.info(f"[Drive] {slug} subido por el barrido del spool. fileId={drive_id}")
+
+def _etapa_email(datos: dict, resultado: dict) -> None:
+    """
+    Envía el contrato al cliente y la copia a la empresa en un solo request a Brevo.
+    Guarda cada envío OK en `resultado`, así un reintento no duplica correos.
+    """
+    if not correo_util.BREVO_API_KEY:
+        raise trabajos_util.SinReintento("BREVO_API_KEY no configurada")
 
-    cmds = [
-        f"soffice --headless --norestore --nolockcheck --nodefault "
-        f"--convert-to pdf:writer_pdf_Export --outdir {shlex.quote(out_dir)} {shlex.quote(out_docx)}",
-        f"libreoffice --headless --norestore --nolockcheck --nodefault "
-        f"--convert-to pdf:writer_pdf_Export --outdir {shlex.quote(out_dir)} {shlex.quote(out_docx)}",
-    ]
+    email = datos["email"]
+    app.logger.info(f"[Contrato] Enviar a cliente: {email} | CC empresa: {EMAIL_EMPRESA}")
 
-    for cmd in cmds:
+    # Cliente (CC lo agrega correo_util vía CC_EMPRESA en .env) + copia directa a la empresa
+    pendientes = [(k, to) for k, to in (("email_cliente", email), ("email_empresa", EMAIL_EMPRESA))
+                  if to and k not in resultado]
+    if not pendientes:
+        return
+
+    cuerpo = _cuerpo_email(datos["nombre"], datos["ubicacion"], datos["ubicacion_monitoreo"])
+    ext = os.path.splitext(resultado["archivo"])[1].lower()
+    envios = correo_util.enviar_emails([to for _, to in pendientes], ASUNTO_CONTRATO, cuerpo,
+                                       adjunto_path=resultado["archivo"],
+                                       adjunto_nombre=f"{datos['slug']}{ext}")
+
+    fallas = []
+    for (clave, to), (ok, info) in zip(pendientes, envios):
+        app.logger.info("ENVIO %s: ok=%s info=%s", clave, ok, info)
+        if ok:
+            resultado[clave] = info
+        else:
+            fallas.append(f"{to}: {info}")
+    if fallas:
+        raise RuntimeError("; ".join(fallas))
+
+def _etapa_indice(datos: dict, resultado: dict) -> None:
+    """Registra el contrato en el índice local (búsqueda y reenvíos desde /admin/contratos)."""
+    indice_util.get_indice().registrar(datos, resultado)
+
+_COLA = None
+
+def _get_cola() -> trabajos_util.ColaTrabajos:
+    global _COLA
+    if _COLA is None:
+        _COLA = trabajos_util.ColaTrabajos([
+            trabajos_util.Etapa("render", _etapa_render, reintentos=1),
+            trabajos_util.Etapa("pdf", _etapa_pdf, reintentos=4, espera=5),
+            trabajos_util.Etapa("drive", _etapa_drive, reintentos=3, espera=5, obligatoria=False),
+            trabajos_util.Etapa("email", _etapa_email, reintentos=3, espera=5, obligatoria=False),
+            trabajos_util.Etapa("indice", _etapa_indice, reintentos=2, espera=1, obligatoria=False),
+        ], descartar=("firma_png",))   # la firma ya está en el contrato: no queda en la base
+    return _COLA
+
+def _limpiar_static():
+    artefactos_util.limpiar_legado(STATIC_DIR, _LEGADO_STATIC_RE, artefactos_util.ARTEFACTOS_RETENCION_H)
+
+def _mantenimiento():
+    # Corre en cada vuelta del barrido del almacén
+    _limpiar_static()
+    _get_cola().purgar()
+
+@app.before_request
+def _arrancar_workers():
+    # Los hilos se lanzan en el worker (no en el master de Gunicorn) y retoman pendientes
+    _get_cola().iniciar()
+    artefactos_util.get_almacen().iniciar(extra=_mantenimiento, con_respaldo=drive_util.drive_configurado())
+    if drive_util.drive_configurado():
+        drive_util.get_manager().iniciar(al_subir=_drive_subido)
+
+# =========================================================
+# Métricas / traza por request
+# =========================================================
+@app.before_request
+def _iniciar_traza():
+    metricas_util.nueva_traza(request.headers.get("X-Request-ID"))
+    g.t0 = time.perf_counter()
+    if metricas_util.MUESTREADOR is not None:
+        g.perfil = metricas_util.MUESTREADOR.empezar()
+
+@app.after_request
+def _registrar_request(resp):
+    ruta = request.url_rule.rule if request.url_rule else "sin_ruta"
+    if "t0" in g:
+        metricas_util.HTTP_SEGUNDOS.observar(time.perf_counter() - g.t0, ruta=ruta,
+                                             metodo=request.method, codigo=resp.status_code)
+    if "perfil" in g:
+        metricas_util.MUESTREADOR.terminar(g.pop("perfil"), f"{request.method}_{ruta}")
+    resp.headers["X-Request-ID"] = metricas_util.TRAZA.get()
+    return resp
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(metricas_util.exponer(), content_type=metricas_util.CONTENT_TYPE)
+
+# =========================================================
+# Lotes (CSV / JSONL)
+# =========================================================
+def _requiere_admin():
+    """None si el request trae `Authorization: Bearer <ADMIN_TOKEN>`; si no, la respuesta de error."""
+    if not ADMIN_TOKEN:
+        return "No disponible.", 404
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode("utf-8"), f"Bearer {ADMIN_TOKEN}".encode("utf-8")):
+        return "No autorizado.", 401
+    return None
+
+def _generador_lote(out_dir: str, firmas_dir: str = None, al_generar=None) -> lote_util.GeneradorLote:
+    return lote_util.GeneradorLote(
+        _render_contrato, _slug, out_dir, SIGNATURE_IMAGE_WIDTH_IN, firmas_dir=firmas_dir,
+        render_pdf=_export_to_pdf_nativo if PDF_BACKEND == "nativo" else None, al_generar=al_generar,
+    )
+
+def _archivar_lote(lote_id: str, copiar: bool):
+    """
+    al_generar de los lotes: pasa el archivo final de cada fila al almacén y lo registra
+    en el índice (slug lote_<lote>_<fila>), así se busca y se reenvía como los de /generar.
+      - copiar: la carpeta de salida es del operador (CLI) y conserva su archivo;
+        si no (/lote), se mueve y la fila trae su URL de descarga.
+    """
+    almacen = artefactos_util.get_almacen()
+
+    def al_generar(datos: dict, item: dict) -> dict:
+        final = item["pdf"] or item["docx"]
+        nombre = os.path.basename(final)
+        slug = f"lote_{lote_id}_{os.path.splitext(nombre)[0]}"
+        if copiar:
+            clave = f"lote_{uuid4().hex}"
+            try:
+                origen = os.path.join(almacen.directorio_trabajo(clave), nombre)
+                shutil.copyfile(final, origen)
+                ruta = almacen.guardar(origen)
+            finally:
+                almacen.liberar_trabajo(clave)
+        else:
+            ruta = almacen.guardar(final)
         try:
-            subprocess.run(
-                cmd, shell=True, check=True,
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                timeout=180, env=env
-            )
-            gen_pdf = os.path.join(out_dir, os.path.splitext(os.path.basename(out_docx))[0] + ".pdf")
-            if os.path.exists(gen_pdf) and os.path.getsize(gen_pdf) > 0:
-                if gen_pdf != out_pdf:
-                    os.replace(gen_pdf, out_pdf)
-                return True
+            indice_util.get_indice().registrar(dict(datos, slug=slug), {"archivo": ruta})
         except Exception:
-            continue
+            app.logger.exception(f"[Lote] No se pudo indexar {slug}")
+        salida = {"slug": slug}
+        if not copiar:
+            salida.update(archivo=nombre, descarga=url_for(
+                "descargar", token=almacen.emitir_token(ruta, nombre)))
+        return salida
 
-    return False
+    return al_generar
+
+# =========================================================
+# Cachés (vista previa / plantilla)
+# =========================================================
+def _vista_previa() -> vista_previa_util.PaginaCacheada:
+    return vista_previa_util.get_pagina(
+        TEMPLATE_DOCX,
+        lambda contrato_html: render_template("formulario_contrato.html", contrato_html=contrato_html),
+    )
+
+def _precalentar_caches():
+    """
+    Vista previa lista antes del primer request. Barato: sale de la caché en disco
+    de vista_previa_util (sin python-docx) salvo la primera vez tras cambiar la plantilla.
+    """
+    if not os.path.exists(TEMPLATE_DOCX):
+        return
+    try:
+        with app.test_request_context("/"):
+            _vista_previa()
+    except Exception:
+        app.logger.exception("No se pudo precalentar la vista previa")
+
+def _precalentar_pipeline():
+    """
+    Compila la plantilla con la tabla de firmas (importa python-docx y Pillow) antes
+    del primer contrato. Gunicorn lo corre en el master (preload) o en un hilo del
+    worker, así no demora el primer byte de GET /.
+    """
+    if not os.path.exists(TEMPLATE_DOCX):
+        return
+    try:
+        plantilla_util.get_plantilla(TEMPLATE_DOCX, _preparar_tabla_firmas)
+    except Exception:
+        app.logger.exception("No se pudo precompilar la plantilla")
 
 # =========================================================
 # Rutas
@@ -262,12 +632,40 @@ def _export_to_pdf_safe(out_docx: str, out_pdf: str) -> bool:
 def index():
     if not os.path.exists(TEMPLATE_DOCX):
         contrato_html = "<p><strong>No se encontró la plantilla del contrato.</strong></p>"
-    else:
-        contrato_html = _docx_to_html_paragraphs(TEMPLATE_DOCX)
-    return render_template("formulario_contrato.html", contrato_html=contrato_html)
+        return render_template("formulario_contrato.html", contrato_html=contrato_html)
+    # Página precalculada (HTML + gzip/br) con ETag; 304 si el cliente ya la tiene
+    return _vista_previa().responder(request)
+
+@app.errorhandler(413)
+def _demasiado_grande(e):
+    # Solo /generar pasa por el control de admisión; un /lote demasiado grande no cuenta
+    if request.endpoint == "generar":
+        metricas_util.ADMISION_RECHAZOS.inc(motivo="tamano")
+    return "El envío supera el tamaño máximo permitido.", 413
+
+def _rechazo_admision(rechazo):
+    mensajes = {
+        413: "El envío supera el tamaño máximo permitido.",
+        429: "Demasiados envíos seguidos. Probá de nuevo en unos segundos.",
+        503: "El servicio está ocupado. Probá de nuevo en unos segundos.",
+    }
+    headers = {"Retry-After": str(rechazo.retry_after)} if rechazo.retry_after else {}
+    app.logger.info(f"[Admision] Rechazo {rechazo.codigo} ({rechazo.motivo})")
+    return mensajes[rechazo.codigo], rechazo.codigo, headers
 
 @app.route("/generar", methods=["POST"])
 def generar():
+    # 0) Control de admisión: tamaño, límites por IP/global y cola, antes de leer el cuerpo
+    admision = admision_util.get_admision()
+    rechazo = admision.verificar(admision_util.ip_cliente(request), request.content_length,
+                                 _get_cola().en_curso)
+    if rechazo is not None:
+        return _rechazo_admision(rechazo)
+    # Almacén por encima de la cuota con nada que se pueda borrar: no se aceptan contratos nuevos
+    if artefactos_util.get_almacen().lleno():
+        metricas_util.ADMISION_RECHAZOS.inc(motivo="almacen")
+        return _rechazo_admision(admision_util.Rechazo(503, "almacen", admision_util.ADMISION_RETRY_AFTER))
+
     # 1) Lectura de campos
     nombre = request.form.get("nombre", "").strip()
     dni = request.form.get("dni", "").strip()
@@ -300,122 +698,293 @@ def generar():
         return f"Faltan campos obligatorios: {', '.join(faltantes)}", 400
 
     # Validación simple de formato de email
-    import re
     if not re.match(r"^[^@\s]+@[^@\s]+\.[^@\s]+$", email):
         return "El email del cliente no es válido.", 400
 
-    # 2) Preparar rutas de salida
-    slug = f"{_slug(nombre)}_{_now_tag()}_{uuid4().hex[:6]}"
-    out_docx = os.path.join(STATIC_DIR, f"{slug}.docx")
-    out_pdf = os.path.join(STATIC_DIR, f"{slug}.pdf")
-    firma_cliente_path = os.path.join(STATIC_DIR, f"firma_{slug}.png")
+    # 1.c) Doble envío: se devuelve el trabajo ya registrado, sin volver a procesar la firma
+    huella = _huella_envio({"nombre": nombre, "dni": dni, "email": email, "ubicacion": ubicacion,
+                            "ubicacion_monitoreo": ubicacion_monitoreo},
+                           firma_b64, request.form.get("idempotencia", ""))
+    job_id = _ENVIOS_RECIENTES.get(huella) or _get_cola().buscar_huella(huella, IDEMPOTENCIA_VENTANA)
+    if job_id:
+        return _respuesta_duplicada(job_id, huella)
+
+    # 2) y 3) Con JOBS_WORKERS=0 la conversión corre en este request: se reserva su lugar
+    # antes de registrar el trabajo y, si no hay, se responde 503 enseguida
+    en_linea = _get_cola().workers <= 0
+    with admision.conversion() if en_linea else nullcontext(True) as ok:
+        if not ok:
+            metricas_util.ADMISION_RECHAZOS.inc(motivo="cupo")
+            return _rechazo_admision(admision_util.Rechazo(503, "cupo", admision_util.ADMISION_RETRY_AFTER))
+
+        # 2) Firma del cliente: límites, recorte y escala de impresión (se valida acá para poder responder 400)
+        try:
+            with metricas_util.ETAPA_SEGUNDOS.tiempo(etapa="firma"):
+                firma_png = firma_util.preparar_firma(firma_b64, SIGNATURE_IMAGE_WIDTH_IN)
+        except firma_util.FirmaInvalida as e:
+            return str(e), 400
+        del firma_b64
+        slug = f"{_slug(nombre)}_{_now_tag()}_{uuid4().hex[:6]}"
+
+        # 3) Registrar el trabajo: render/PDF/Drive/email siguen en segundo plano
+        job_id, nuevo = _get_cola().crear_unico({
+            "slug": slug,
+            "nombre": nombre,
+            "dni": dni,
+            "email": email,
+            "ubicacion": ubicacion,
+            "ubicacion_monitoreo": ubicacion_monitoreo,
+            "fecha": datetime.now().strftime("%d/%m/%Y"),
+            "firma_png": base64.b64encode(firma_png).decode("ascii"),
+            "traza": metricas_util.TRAZA.get(),
+        }, huella, IDEMPOTENCIA_VENTANA)
+    if not nuevo:
+        return _respuesta_duplicada(job_id, huella)
+    _ENVIOS_RECIENTES.set(huella, job_id)
+    app.logger.info(f"[Contrato] Trabajo {job_id} registrado para {email}")
+
+    # 4) Página de agradecimiento (consulta el avance en /estado/<job_id>)
+    return render_template("agradecimiento.html", telefono=CONTACTO_TELEFONO, job_id=job_id), 202
+
+def _respuesta_duplicada(job_id: str, huella: str):
+    _ENVIOS_RECIENTES.set(huella, job_id)
+    metricas_util.ENVIOS_DUPLICADOS.inc()
+    app.logger.info(f"[Contrato] Envío repetido: se devuelve el trabajo {job_id}")
+    return render_template("agradecimiento.html", telefono=CONTACTO_TELEFONO, job_id=job_id), 202
+
+@app.route("/estado/<job_id>", methods=["GET"])
+def estado(job_id):
+    """
+    Avance del trabajo. "completado" solo dice que el contrato se generó: `etapas` trae
+    el estado de cada paso y `fallidas` los opcionales que no salieron (drive, email...).
+    """
+    t = _get_cola().obtener(job_id)
+    if t is None:
+        return jsonify({"error": "Trabajo inexistente"}), 404
+    etapas = t["resultado"].get("etapas", {})
+    return jsonify({
+        "id": t["id"],
+        "estado": t["estado"],
+        "etapa": t["etapa"],
+        "progreso": t["progreso"],
+        "total": t["total"],
+        "etapas": etapas,
+        "fallidas": [nombre for nombre, e in etapas.items() if e == "error"],
+        "error": t["error"],
+        "descarga": url_for("descargar", token=t["resultado"]["descarga"]) if t["resultado"].get("descarga") else None,
+    })
+
+@app.route("/descargar/<token>", methods=["GET"])
+def descargar(token):
+    """
+    Descarga el contrato final. send_file con conditional=True responde ETag /
+    If-None-Match (304) y Range (206), así se puede retomar una descarga cortada.
+    """
+    encontrado = artefactos_util.get_almacen().resolver_token(token)
+    if encontrado is None:
+        abort(404)
+    ruta, nombre, _ = encontrado
+    if not os.path.exists(ruta):
+        abort(410)  # el barrido ya lo borró (la copia queda en Drive)
+    resp = send_file(ruta, as_attachment=True, download_name=nombre, conditional=True, max_age=0)
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    return resp
+
+@app.route("/lote", methods=["POST"])
+def lote():
+    """
+    Genera contratos a partir de un CSV/JSONL (campo multipart `archivo`).
+    Responde NDJSON en streaming: una línea por fila a medida que se procesa cada tanda.
+    El archivo final de cada fila pasa al almacén de artefactos y al índice: la línea trae
+    su slug, su nombre (`archivo`) y la URL de descarga (`descarga`), no rutas del servidor.
+    La entrada (datos personales y firmas) y los DOCX intermedios van a un directorio de
+    trabajo del almacén que se borra al terminar (o, si el proceso cae, en el barrido).
+    """
+    error = _requiere_admin()
+    if error:
+        return error
+    archivo = request.files.get("archivo")
+    if archivo is None or not archivo.filename:
+        return "Falta el archivo del lote.", 400
+    formato = request.form.get("formato") or lote_util.formato_de(archivo.filename)
+    if formato not in ("csv", "jsonl"):
+        return "Formato inválido (csv o jsonl).", 400
+    lote_id = f"{_now_tag()}_{uuid4().hex[:6]}"
+    almacen = artefactos_util.get_almacen()
+    clave = f"lote_{lote_id}"
+    out_dir = almacen.directorio_trabajo(clave)
+    # Se copia a disco: el upload se cierra con el request y la respuesta sigue en streaming
+    entrada = os.path.join(out_dir, f"entrada.{formato}")
+    archivo.save(entrada)
+    app.logger.info(f"[Lote] {lote_id}: {archivo.filename} ({formato})")
+
+    def _ndjson():
+        yield json.dumps({"lote": lote_id}) + "\n"
+        generador = _generador_lote(out_dir, al_generar=_archivar_lote(lote_id, copiar=False))
+        try:
+            with open(entrada, encoding="utf-8-sig", newline="") as f:
+                for item in generador.procesar(lote_util.leer_filas(f, formato)):
+                    item.pop("docx", None), item.pop("pdf", None)
+                    yield json.dumps(item, ensure_ascii=False) + "\n"
+        except lote_util.LoteInvalido as e:
+            yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+        finally:
+            almacen.liberar_trabajo(clave)
 
-    # 3) Guardar firma del cliente
-    try:
-        img = _b64_to_pil_image(firma_b64)
-        img.save(firma_cliente_path, "PNG")
-    except Exception:
-        return "La imagen de la firma es inválida.", 400
+    return Response(stream_with_context(_ndjson()), mimetype="application/x-ndjson")
 
-    # 3.b) Abrir plantilla y hacer reemplazos
-    try:
-        doc = Document(TEMPLATE_DOCX)
-    except Exception as e:
-        return f"No se pudo abrir la plantilla del contrato: {e}", 500
-
-    mapping = {
-        "{{ nombre }}": nombre,
-        "{{ dni }}": dni,
-        "{{ email }}": email,
-        "{{ ubicacion }}": ubicacion,                         # domicilio del abonado
-        "{{ ubicacion_monitoreo }}": ubicacion_monitoreo,     # lugar monitoreado
-        "{{ fecha_hoy }}": datetime.now().strftime("%d/%m/%Y"),
-    }
+# =========================================================
+# Contratos generados (índice local)
+# =========================================================
+@app.route("/admin/contratos", methods=["GET"])
+def admin_contratos():
+    """
+    Búsqueda en el índice local: ?dni=, ?q= (nombre/email/domicilio), ?desde=/?hasta=
+    (aaaa-mm-dd), ?limite=. La respuesta trae `siguiente`: se pasa como ?cursor= para
+    la página siguiente.
+    """
+    error = _requiere_admin()
+    if error:
+        return error
     try:
-        _insert_text_placeholders(doc, mapping)
-    except Exception as e:
-        app.logger.exception("Error reemplazando placeholders")
-        return f"Error interno al completar el contrato: {e}", 500
+        filas, siguiente = indice_util.get_indice().buscar(
+            dni=request.args.get("dni"), texto=request.args.get("q"),
+            desde=request.args.get("desde"), hasta=request.args.get("hasta"),
+            limite=request.args.get("limite", indice_util.INDICE_PAGINA, type=int),
+            cursor=request.args.get("cursor"),
+        )
+    except indice_util.ConsultaInvalida as e:
+        return str(e), 400
+    return jsonify({"contratos": filas, "siguiente": siguiente})
 
-    # 3.c) Firmas (cliente + empresa)
-    _ensure_company_signature(FIRMA_EMPRESA_PATH)
-    _add_signatures_section(doc, firma_cliente_path, FIRMA_EMPRESA_PATH)
+@app.route("/admin/contratos/<slug>/reenviar", methods=["POST"])
+def admin_reenviar(slug):
+    """
+    Reenvía el contrato por email (al del contrato o al campo `email` del request).
+    Usa la copia local si sigue en el almacén; si no, la baja de Drive por fileId.
+    """
+    error = _requiere_admin()
+    if error:
+        return error
+    contrato = indice_util.get_indice().obtener(slug)
+    if contrato is None:
+        return "Contrato inexistente.", 404
+    email = (request.form.get("email") or contrato["email"]).strip().lower()
+    if not re.match(r"^[^@\s]+@[^@\s]+\.[^@\s]+$", email):
+        return "El email no es válido.", 400
 
-    # 4) Guardar DOCX
+    almacen = artefactos_util.get_almacen()
+    clave = f"{slug}_reenvio"
     try:
-        doc.save(out_docx)
-    except Exception as e:
-        return f"No se pudo guardar el DOCX: {e}", 500
-
-    # 5) Convertir a PDF (si falla, dejamos el DOCX para descargar)
-    pdf_ok = _export_to_pdf_safe(out_docx, out_pdf)
-    if pdf_ok and os.path.exists(out_pdf) and os.path.getsize(out_pdf) > 0:
-        session["archivo_pdf"] = out_pdf
-    else:
-        session["archivo_pdf"] = out_docx
-
-    # 5.1) Subir a Drive (no bloqueante)
+        ruta = almacen.ruta(contrato["hash"], contrato["ext"]) if contrato["hash"] else None
+        if ruta is None or not os.path.exists(ruta):
+            if not contrato["drive_id"]:
+                return "El archivo ya no está disponible.", 410
+            ruta = os.path.join(almacen.directorio_trabajo(clave), f"{slug}{contrato['ext'] or '.pdf'}")
+            try:
+                drive_util.download_path_from_drive(contrato["drive_id"], ruta)
+            except Exception as e:
+                app.logger.exception(f"[Reenvío] No se pudo bajar {contrato['drive_id']} de Drive")
+                return f"No se pudo obtener el archivo de Drive: {e}", 502
+        cuerpo = _cuerpo_email(contrato["nombre"], contrato["ubicacion"], contrato["ubicacion_monitoreo"])
+        ok, info = correo_util.enviar_email(email, ASUNTO_CONTRATO, cuerpo, adjunto_path=ruta,
+                                            adjunto_nombre=f"{slug}{os.path.splitext(ruta)[1].lower()}")
+    finally:
+        almacen.liberar_trabajo(clave)
+    if not ok:
+        return jsonify({"ok": False, "error": info}), 502
+    indice_util.get_indice().agregar_mensaje(slug, info)
+    app.logger.info(f"[Reenvío] {slug} -> {email} (messageId={info})")
+    return jsonify({"ok": True, "email": email, "message_id": info})
+
+@app.route("/admin/exportar", methods=["GET"])
+def admin_exportar():
+    """
+    Contratos de ?desde= a ?hasta= (aaaa-mm-dd) en un ZIP (?formato=zip, por defecto)
+    o en un único PDF (?formato=pdf), generados en streaming (transferencia chunked).
+    """
+    error = _requiere_admin()
+    if error:
+        return error
+    desde, hasta = request.args.get("desde", ""), request.args.get("hasta", "")
+    formato = request.args.get("formato", "zip")
+    if formato not in ("zip", "pdf"):
+        return "Formato inválido (zip o pdf).", 400
     try:
-        adjunto_path = session["archivo_pdf"]
-        ext = os.path.splitext(adjunto_path)[1].lower()
-        mimetype = "application/pdf" if ext == ".pdf" else "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-
-        safe_nombre = "".join(c for c in nombre if c.isalnum() or c in " _-").strip().replace(" ", "_")
-        fecha_str = datetime.now().strftime("%Y-%m-%d")
-        nombre_remoto = f"{fecha_str}_{safe_nombre}_{dni}_Contrato{ext}"
-
-        drive_id = upload_path_to_drive(adjunto_path, nombre_remoto, mimetype)
-        app.logger.info(f"[Drive] Subido OK. fileId={drive_id}")
-    except Exception as e:
-        app.logger.exception(f"[Drive] Falló la subida: {e}")
-
-    # Log de destinatarios
-    app.logger.info(f"[Contrato] Enviar a cliente: {email} | CC empresa: {EMAIL_EMPRESA}")
-
-    # 6) Enviar correos (no interrumpe si falla)
-    adjunto = session["archivo_pdf"]
-    asunto = "Contrato firmado - Seguridad Ituzaingó"
-    cuerpo = (
-        f"Estimado/a {nombre},\n\n"
-        f"Adjuntamos el contrato firmado correspondiente al servicio de monitoreo en {ubicacion_monitoreo}.\n"
-        f"Domicilio del abonado: {ubicacion}.\n"
-        "Le recomendamos conservar el archivo para su referencia.\n\n"
-        "Quedamos a disposición por cualquier consulta.\n\n"
-        "Atentamente,\n"
-        "Seguridad Ituzaingó\n"
-        "Alan Arndt — Dueño de la Empresa\n"
-        f"Tel.: {CONTACTO_TELEFONO or '-'}\n"
-        f"Email: {EMAIL_EMPRESA or '-'}\n"
-    )
-
-    ok_cli = info_cli = ok_emp = info_emp = None
-
+        exportar_util.validar_rango(desde, hasta)
+    except indice_util.ConsultaInvalida as e:
+        return str(e), 400
+    partes = (exportar_util.zip_en_cadena if formato == "zip" else exportar_util.pdf_en_cadena)(
+        exportar_util.contratos(desde, hasta))
+    app.logger.info(f"[Exportar] {desde} a {hasta} ({formato})")
+    resp = Response(stream_with_context(partes),
+                    mimetype="application/zip" if formato == "zip" else "application/pdf")
+    resp.headers["Content-Disposition"] = f'attachment; filename="contratos_{desde}_{hasta}.{formato}"'
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+@app.cli.command("exportar")
+@click.argument("desde")
+@click.argument("hasta")
+@click.option("--formato", type=click.Choice(["zip", "pdf"]), default="zip")
+@click.option("--salida", type=click.Path(dir_okay=False), default=None,
+              help="Por defecto, contratos_<desde>_<hasta>.<formato> en el directorio actual.")
+def exportar_cli(desde, hasta, formato, salida):
+    """Exporta los contratos de un rango de fechas (aaaa-mm-dd) en un ZIP o un PDF unido."""
     try:
-        # Envío al cliente (CC lo agrega correo_util vía CC_EMPRESA en .env)
-        ok_cli, info_cli = correo_util.enviar_email(
-            email,
-            asunto,
-            cuerpo,
-            adjunto_path=adjunto
-        )
-
-        # Copia directa a la empresa (además del CC, si querés)
-        if EMAIL_EMPRESA:
-            ok_emp, info_emp = correo_util.enviar_email(
-                EMAIL_EMPRESA,
-                asunto,
-                cuerpo,
-                adjunto_path=adjunto
-            )
-        else:
-            ok_emp, info_emp = None, "EMAIL_EMPRESA vacío"
-
-        # Logs por si después querés revisar en Render
-        app.logger.info("ENVIO CLIENTE: ok=%s info=%s", ok_cli, info_cli)
-        app.logger.info("ENVIO EMPRESA: ok=%s info=%s", ok_emp, info_emp)
-
-    except Exception as e:
-        app.logger.exception(f"[Email] Falló el envío: {e}")
-
-    # 7) Página de agradecimiento profesional
-    return render_template("agradecimiento.html", telefono=CONTACTO_TELEFONO)
+        exportar_util.validar_rango(desde, hasta)
+    except indice_util.ConsultaInvalida as e:
+        raise click.BadParameter(str(e))
+    salida = salida or f"contratos_{desde}_{hasta}.{formato}"
+    partes = (exportar_util.zip_en_cadena if formato == "zip" else exportar_util.pdf_en_cadena)(
+        exportar_util.contratos(desde, hasta))
+    total = 0
+    with open(salida, "wb") as f:
+        for parte in partes:
+            f.write(parte)
+            total += len(parte)
+            click.echo(f"\r{total / 1024 / 1024:.1f} MB", err=True, nl=False)
+    click.echo(f"\n{salida}", err=True)
+
+@app.cli.command("indexar")
+def indexar_cli():
+    """Carga en el índice local los contratos de los trabajos ya completados."""
+    n = 0
+    indice = indice_util.get_indice()
+    for _, datos, resultado, creado in _get_cola().recorrer(trabajos_util.COMPLETADO):
+        if resultado.get("archivo"):
+            indice.registrar(datos, resultado, creado=creado)
+            n += 1
+    click.echo(f"{n} contratos indexados", err=True)
+
+@app.cli.command("lote")
+@click.argument("archivo", type=click.Path(exists=True, dir_okay=False))
+@click.option("--formato", type=click.Choice(["csv", "jsonl"]), default=None, help="Por defecto, según la extensión.")
+@click.option("--salida", type=click.Path(file_okay=False), default=None, help="Carpeta de salida (DOCX/PDF + manifest.jsonl).")
+@click.option("--firmas-dir", type=click.Path(exists=True, file_okay=False), default=None,
+              help="Carpeta base para la columna `firma` cuando es una ruta a imagen.")
+def lote_cli(archivo, formato, salida, firmas_dir):
+    """Genera contratos en lote desde un CSV o JSONL."""
+    formato = formato or lote_util.formato_de(archivo)
+    lote_id = f"{_now_tag()}_{uuid4().hex[:6]}"
+    salida = salida or os.path.join(LOTES_DIR, lote_id)
+    ok = err = 0
+    os.makedirs(salida, exist_ok=True)
+    with open(archivo, encoding="utf-8-sig", newline="") as f, \
+            open(os.path.join(salida, "manifest.jsonl"), "w", encoding="utf-8") as manifest:
+        generador = _generador_lote(salida, firmas_dir, al_generar=_archivar_lote(lote_id, copiar=True))
+        for item in generador.procesar(lote_util.leer_filas(f, formato)):
+            manifest.write(json.dumps(item, ensure_ascii=False) + "\n")
+            manifest.flush()
+            if item["estado"] == "ok":
+                ok += 1
+            else:
+                err += 1
+                click.echo(f"fila {item['fila']}: {item['error']}", err=True)
+            click.echo(f"\r{ok + err} filas ({ok} ok, {err} con error)", err=True, nl=False)
+    click.echo(f"\nManifiesto: {os.path.join(salida, 'manifest.jsonl')}", err=True)
+    sys.exit(1 if err else 0)
+
+if os.getenv("PRECALENTAR_CACHES", "1") == "1":
+    _precalentar_caches()
@@ -0,0 +1,310 @@
+# artefactos_util.py
+"""
+Almacén de artefactos de los contratos (DOCX/PDF), fuera de static/.
+
+- Cada trabajo escribe en su propio directorio de trabajo (tmp/<clave>) y al
+  terminar un paso guarda el archivo en el almacén con `guardar`.
+- Los objetos se nombran por el sha256 del contenido (objetos/ab/<sha>.<ext>):
+  un reintento que produce el mismo archivo no duplica nada.
+- El índice (SQLite) lleva tamaño, fecha de alta y fecha de subida a Drive; el
+  barrido consulta el índice en vez de listar directorios, así su costo no
+  crece con la cantidad de archivos.
+- Retención: un objeto subido a Drive se borra ARTEFACTOS_RETENCION_H horas
+  después de la subida. Uno que nunca se subió es la única copia del contrato:
+  no se borra; si tiene más de ARTEFACTOS_RETENCION_MAX_H el barrido lo avisa
+  en el log. Si el total supera ARTEFACTOS_CUOTA_MB se borran antes de tiempo
+  los subidos más viejos. Sin Drive configurado (con_respaldo=False) nada se va
+  a subir nunca: los objetos se borran a las ARTEFACTOS_RETENCION_MAX_H horas
+  de creados y la cuota también borra los más viejos. Si aun así el total
+  supera la cuota, `lleno()` da True y /generar rechaza trabajos nuevos.
+- Intermedios: el DOCX de un contrato que ya tiene PDF se borra con `descartar`.
+- Descargas: `emitir_token` da un token aleatorio que vence a las
+  DESCARGA_TTL_H horas y apunta a un objeto (GET /descargar/<token>).
+"""
+import os
+import re
+import time
+import secrets
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import metricas_util
+
+# ==============================
+# Config desde variables de entorno
+# ==============================
+BASE_DIR                  = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR                  = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "data"))
+ARTEFACTOS_DIR            = os.getenv("ARTEFACTOS_DIR", os.path.join(DATA_DIR, "artefactos"))
+ARTEFACTOS_DB             = os.getenv("ARTEFACTOS_DB", os.path.join(DATA_DIR, "artefactos.sqlite3"))
+ARTEFACTOS_RETENCION_H    = float(os.getenv("ARTEFACTOS_RETENCION_H", "24"))     # tras subir a Drive
+ARTEFACTOS_RETENCION_MAX_H = float(os.getenv("ARTEFACTOS_RETENCION_MAX_H", "720"))  # nunca subidos: aviso (sin Drive: se borran)
+ARTEFACTOS_CUOTA_MB       = float(os.getenv("ARTEFACTOS_CUOTA_MB", "1024"))
+ARTEFACTOS_BARRIDO_INTERVALO = int(os.getenv("ARTEFACTOS_BARRIDO_INTERVALO", "600"))  # seg.
+ARTEFACTOS_TMP_H          = float(os.getenv("ARTEFACTOS_TMP_H", "6"))  # directorios de trabajo huérfanos
+DESCARGA_TTL_H            = float(os.getenv("DESCARGA_TTL_H", "24"))
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artefactos (
+    hash     TEXT PRIMARY KEY,
+    ext      TEXT NOT NULL,
+    tamano   INTEGER NOT NULL,
+    creado   REAL NOT NULL,
+    subido   REAL
+);
+CREATE INDEX IF NOT EXISTS ix_artefactos_subido ON artefactos (subido);
+CREATE INDEX IF NOT EXISTS ix_artefactos_creado ON artefactos (creado);
+CREATE TABLE IF NOT EXISTS descargas (
+    token    TEXT PRIMARY KEY,
+    hash     TEXT NOT NULL,
+    ext      TEXT NOT NULL,
+    nombre   TEXT NOT NULL,
+    expira   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_descargas_expira ON descargas (expira);
+"""
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+_CLAVE_RE = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+class Almacen:
+    def __init__(self, raiz: str = ARTEFACTOS_DIR, db_path: str = ARTEFACTOS_DB,
+                 retencion_h: float = ARTEFACTOS_RETENCION_H, retencion_max_h: float = ARTEFACTOS_RETENCION_MAX_H,
+                 cuota_mb: float = ARTEFACTOS_CUOTA_MB):
+        self.raiz = raiz
+        self.db_path = db_path
+        self.retencion = retencion_h * 3600
+        self.retencion_max = retencion_max_h * 3600
+        self.cuota = int(cuota_mb * 1024 * 1024)
+        self.con_respaldo = True    # False: no hay Drive, nada se va a subir (ver iniciar)
+        self._local = threading.local()
+        self._barrido_pid = None
+        self._barrido_lock = threading.Lock()
+        os.makedirs(os.path.join(raiz, "objetos"), exist_ok=True)
+        os.makedirs(os.path.join(raiz, "tmp"), exist_ok=True)
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._conn() as c:
+            c.executescript(_SCHEMA)
+
+    # --- SQLite (una conexión por hilo) ---
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None or getattr(self._local, "pid", None) != os.getpid():
+            c = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            c.row_factory = sqlite3.Row
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = c, os.getpid()
+        return c
+
+    # --- rutas ---
+    def directorio_trabajo(self, clave: str) -> str:
+        """Directorio privado del trabajo para archivos intermedios (se crea si no existe)."""
+        if not _CLAVE_RE.match(clave):
+            raise ValueError(f"Clave de trabajo inválida: {clave!r}")
+        d = os.path.join(self.raiz, "tmp", clave)
+        os.makedirs(d, exist_ok=True)
+        return d
+
+    def liberar_trabajo(self, clave: str):
+        if _CLAVE_RE.match(clave):
+            shutil.rmtree(os.path.join(self.raiz, "tmp", clave), ignore_errors=True)
+
+    def ruta(self, digest: str, ext: str) -> str:
+        if not _HASH_RE.match(digest):
+            raise ValueError(f"Hash inválido: {digest!r}")
+        return os.path.join(self.raiz, "objetos", digest[:2], f"{digest}{ext}")
+
+    # --- API ---
+    def guardar(self, path: str) -> str:
+        """
+        Mueve `path` al almacén bajo el hash de su contenido y lo registra.
+        Devuelve la ruta final (si ya existía un objeto igual, se descarta `path`).
+        """
+        ext = os.path.splitext(path)[1].lower()
+        digest = _sha256(path)
+        destino = self.ruta(digest, ext)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        if os.path.exists(destino):
+            os.remove(path)
+        else:
+            os.replace(path, destino)
+        # Un objeto repetido vuelve a contar como nuevo (y pendiente de subida)
+        self._conn().execute(
+            "INSERT INTO artefactos (hash, ext, tamano, creado) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(hash) DO UPDATE SET creado = excluded.creado, subido = NULL",
+            (digest, ext, os.path.getsize(destino), time.time()),
+        )
+        return destino
+
+    def marcar_subido(self, *rutas: str):
+        """Registra que los objetos ya están en Drive: corre el plazo de retención corto."""
+        hashes = [os.path.splitext(os.path.basename(r))[0] for r in rutas if r]
+        self._conn().executemany("UPDATE artefactos SET subido = ? WHERE hash = ?",
+                                 [(time.time(), h) for h in hashes])
+
+    def descartar(self, ruta: str):
+        """Borra un objeto intermedio que ya no hace falta (p. ej. el DOCX cuando hay PDF)."""
+        digest = os.path.splitext(os.path.basename(ruta))[0]
+        rows = self._conn().execute("SELECT hash, ext, tamano FROM artefactos WHERE hash = ?", (digest,)).fetchall()
+        self._borrar(rows, "intermedio")
+
+    def emitir_token(self, ruta: str, nombre: str, ttl_h: float = DESCARGA_TTL_H) -> str:
+        """Token de descarga para el objeto en `ruta`, que se entrega como `nombre`."""
+        digest, ext = os.path.splitext(os.path.basename(ruta))
+        token = secrets.token_urlsafe(24)
+        self._conn().execute(
+            "INSERT INTO descargas (token, hash, ext, nombre, expira) VALUES (?, ?, ?, ?, ?)",
+            (token, digest, ext, nombre, time.time() + ttl_h * 3600))
+        return token
+
+    def resolver_token(self, token: str):
+        """(ruta, nombre, expira) si el token existe y no venció; None si no. La ruta puede ya no existir."""
+        row = self._conn().execute(
+            "SELECT hash, ext, nombre, expira FROM descargas WHERE token = ? AND expira > ?",
+            (token, time.time())).fetchone()
+        if row is None:
+            return None
+        return self.ruta(row["hash"], row["ext"]), row["nombre"], row["expira"]
+
+    def uso(self) -> dict:
+        row = self._conn().execute(
+            "SELECT COUNT(*) AS n, COALESCE(SUM(tamano), 0) AS bytes, "
+            "COALESCE(SUM(subido IS NULL), 0) AS sin_subir FROM artefactos").fetchone()
+        return dict(row)
+
+    def lleno(self) -> bool:
+        """True si el almacén supera la cuota: /generar deja de aceptar trabajos."""
+        return self.uso()["bytes"] > self.cuota
+
+    # --- barrido ---
+    def _borrar(self, rows, motivo: str) -> int:
+        liberado = 0
+        for r in rows:
+            try:
+                os.remove(self.ruta(r["hash"], r["ext"]))
+            except FileNotFoundError:
+                pass
+            self._conn().execute("DELETE FROM artefactos WHERE hash = ?", (r["hash"],))
+            liberado += r["tamano"]
+            metricas_util.ARTEFACTOS_BORRADOS.inc(motivo=motivo)
+        return liberado
+
+    def barrer(self, ahora: float = None) -> dict:
+        """Aplica retención y cuota, y borra directorios de trabajo huérfanos. Devuelve un resumen."""
+        ahora = ahora or time.time()
+        c = self._conn()
+        vencidos = c.execute(
+            "SELECT hash, ext, tamano FROM artefactos WHERE subido IS NOT NULL AND subido < ?",
+            (ahora - self.retencion,)).fetchall()
+        liberado = self._borrar(vencidos, "retencion")
+        viejos = c.execute(
+            "SELECT hash, ext, tamano FROM artefactos WHERE subido IS NULL AND creado < ?",
+            (ahora - self.retencion_max,)).fetchall()
+        sin_subir = len(viejos)
+        if not self.con_respaldo:
+            # Sin Drive no hay copia que esperar: la retención larga es la única
+            liberado += self._borrar(viejos, "retencion_sin_drive")
+            vencidos += viejos
+        elif sin_subir:
+            # Sin subir a Drive: es la única copia, se conserva pero se avisa
+            log.warning("[Artefactos] %d archivos con más de %.0f h sin subir a Drive (no se borran)",
+                        sin_subir, self.retencion_max / 3600)
+
+        exceso = self.uso()["bytes"] - self.cuota
+        por_cuota = []
+        if exceso > 0:
+            sql = ("SELECT hash, ext, tamano FROM artefactos WHERE subido IS NOT NULL ORDER BY subido"
+                   if self.con_respaldo else "SELECT hash, ext, tamano FROM artefactos ORDER BY creado")
+            for r in c.execute(sql):
+                if exceso <= 0:
+                    break
+                por_cuota.append(r)
+                exceso -= r["tamano"]
+            liberado += self._borrar(por_cuota, "cuota")
+            if exceso > 0:
+                log.warning("[Artefactos] Cuota superada en %d bytes que no se pueden borrar "
+                            "(se rechazan contratos nuevos)", exceso)
+
+        c.execute("DELETE FROM descargas WHERE expira < ?", (ahora,))
+
+        tmp = os.path.join(self.raiz, "tmp")
+        huerfanos = 0
+        for e in os.scandir(tmp):
+            if e.is_dir() and e.stat().st_mtime < ahora - ARTEFACTOS_TMP_H * 3600:
+                shutil.rmtree(e.path, ignore_errors=True)
+                huerfanos += 1
+        resumen = {"borrados": len(vencidos) + len(por_cuota), "liberado": liberado, "tmp_huerfanos": huerfanos,
+                   "sin_subir_viejos": sin_subir}
+        if resumen["borrados"] or huerfanos:
+            log.info("[Artefactos] Barrido: %s", resumen)
+        return resumen
+
+    def iniciar(self, intervalo: int = ARTEFACTOS_BARRIDO_INTERVALO, extra=None, con_respaldo: bool = True):
+        """
+        Hilo que barre periódicamente (una vez por proceso). `extra()` corre en cada vuelta.
+        con_respaldo: hay Drive configurado (si no, los nunca subidos también vencen).
+        """
+        self.con_respaldo = con_respaldo
+        if self._barrido_pid == os.getpid():
+            return
+
+        def _bucle():
+            while True:
+                try:
+                    self.barrer()
+                    if extra:
+                        extra()
+                except Exception:
+                    log.exception("[Artefactos] Falló el barrido")
+                time.sleep(intervalo)
+
+        with self._barrido_lock:
+            if self._barrido_pid == os.getpid():
+                return
+            self._barrido_pid = os.getpid()
+            threading.Thread(target=_bucle, name="artefactos-barrido", daemon=True).start()
+
+
+def limpiar_legado(directorio: str, patron: str, antiguedad_h: float) -> int:
+    """Borra de `directorio` los archivos que matchean `patron` y son más viejos que `antiguedad_h`."""
+    regex = re.compile(patron)
+    limite = time.time() - antiguedad_h * 3600
+    borrados = 0
+    for e in os.scandir(directorio):
+        if e.is_file() and regex.match(e.name) and e.stat().st_mtime < limite:
+            try:
+                os.remove(e.path)
+                borrados += 1
+            except FileNotFoundError:
+                pass
+    if borrados:
+        log.info("[Artefactos] %d archivos viejos borrados de %s", borrados, directorio)
+    return borrados
+
+
+_ALMACEN = None
+_ALMACEN_LOCK = threading.Lock()
+
+
+def get_almacen() -> Almacen:
+    global _ALMACEN
+    if _ALMACEN is None:
+        with _ALMACEN_LOCK:
+            if _ALMACEN is None:
+                _ALMACEN = Almacen()
+    return _ALMACEN
@@ -0,0 +1,122 @@
+# benchmarks/arranque.py
+"""
+Arranque en frío: cuánto cuesta importar la app y cuánto tarda el primer byte de GET /.
+
+1) Presupuesto de import (`python -X importtime -c "import app"`, con la caché de
+   la vista previa ya en disco): tiempo acumulado de `app`, los módulos más caros
+   y los pesados que no deberían cargarse al importar (python-docx, Pillow,
+   reportlab, googleapiclient, requests). Sale con código 1 si se pasa del
+   presupuesto o si se cargó alguno de esos.
+2) TTFB: levanta Gunicorn (gunicorn.conf.py, 1 worker) y mide desde el spawn
+   hasta el primer 200 de GET /, con la caché en disco vacía y ya generada.
+
+Uso:
+    python benchmarks/arranque.py [--presupuesto-ms 400] [-n 5] [--raiz OTRA_COPIA]
+"""
+import argparse
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from comun import RAIZ, percentil
+
+PESADOS = ("docx", "PIL", "reportlab", "googleapiclient", "requests", "httplib2")
+_LINEA_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def _env(data_dir: str, **extra) -> dict:
+    env = dict(os.environ, DATA_DIR=data_dir, PDF_POOL_SIZE="0", JOBS_WORKERS="0", **extra)
+    env.pop("PYTHONPATH", None)
+    return env
+
+
+def perfil_import(raiz: str, data_dir: str):
+    """(ms acumulados de `app`, [(ms, módulo)] de primer nivel, módulos pesados cargados)."""
+    codigo = "import sys, app; print(','.join(sorted(m for m in %r if m in sys.modules)))" % (PESADOS,)
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", codigo], cwd=raiz,
+                       env=_env(data_dir), capture_output=True, text=True, check=True)
+    total, directos = 0.0, []
+    for linea in r.stderr.splitlines():
+        m = _LINEA_RE.match(linea)
+        if not m:
+            continue
+        acumulado_ms, nivel, modulo = int(m.group(2)) / 1000, len(m.group(3)), m.group(4)
+        if nivel == 1:
+            total = acumulado_ms if modulo == "app" else total
+            if modulo != "app":
+                directos = []   # eran hijos de site u otro import de arranque
+        elif nivel == 3:     # importado directamente por app.py (o por site)
+            directos.append((acumulado_ms, modulo))
+    cargados = [m for m in r.stdout.strip().split(",") if m]
+    return total, sorted(directos, reverse=True), cargados
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def ttfb(raiz: str, data_dir: str, preload: bool) -> float:
+    """Segundos desde el spawn de Gunicorn hasta el primer 200 de GET /."""
+    puerto = _puerto_libre()
+    env = _env(data_dir, PORT=str(puerto), GUNICORN_WORKERS="1", GUNICORN_LOGLEVEL="warning",
+               GUNICORN_PRELOAD="1" if preload else "0")
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+                            cwd=raiz, env=env)
+    try:
+        limite = time.time() + 60
+        while True:
+            if time.time() > limite or proc.poll() is not None:
+                raise SystemExit("Gunicorn no arrancó")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{puerto}/", timeout=10) as r:
+                    r.read()
+                    if r.status == 200:
+                        return time.perf_counter() - t0
+            except OSError:
+                time.sleep(0.005)
+    finally:
+        proc.terminate()
+        proc.wait(60)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--presupuesto-ms", type=float, default=400, help="tope para `import app` (acumulado)")
+    ap.add_argument("-n", type=int, default=5, help="arranques de Gunicorn por variante")
+    ap.add_argument("--raiz", default=RAIZ, help="copia del repo a medir (p. ej. un worktree de otra versión)")
+    args = ap.parse_args()
+
+    # 1) Import con la caché de la vista previa ya generada (el caso de un reinicio)
+    data_dir = tempfile.mkdtemp(prefix="bench_arranque_")
+    perfil_import(args.raiz, data_dir)
+    total, directos, cargados = perfil_import(args.raiz, data_dir)
+    print(f"import app: {total:.0f} ms (presupuesto {args.presupuesto_ms:.0f} ms)")
+    for ms, modulo in directos[:8]:
+        print(f"  {ms:>7.1f} ms  {modulo}")
+    print(f"módulos pesados cargados al importar: {', '.join(cargados) or 'ninguno'}")
+
+    # 2) Primer byte de GET /
+    print(f"\n{'TTFB GET / (1 worker)':<34} {'p50':>8} {'máx':>8}")
+    for preload in (True, False):
+        for con_cache in (False, True):
+            tiempos = []
+            for _ in range(args.n):
+                d = data_dir if con_cache else tempfile.mkdtemp(prefix="bench_arranque_")
+                tiempos.append(ttfb(args.raiz, d, preload))
+            nombre = f"{'con' if preload else 'sin'} preload, {'con' if con_cache else 'sin'} caché en disco"
+            print(f"{nombre:<34} {percentil(tiempos, 50) * 1000:>6.0f}ms {max(tiempos) * 1000:>6.0f}ms")
+
+    if total > args.presupuesto_ms or cargados:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
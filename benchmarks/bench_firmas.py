@@ -0,0 +1,72 @@
+# benchmarks/bench_firmas.py
+"""
+Costo de la sección de firmas por contrato (plantilla + firmas + guardar DOCX):
+  - antes:   completar + _ensure_company_signature + _add_signatures_section
+             (busca la tabla, arma el layout y agrega las dos imágenes)
+  - después: plantilla compilada con la tabla de firmas y la firma de la empresa
+             ya insertadas (_preparar_tabla_firmas) + _insertar_firma_cliente
+
+Reporta p50/p95/p99 de cada camino y el tamaño del DOCX resultante.
+
+Uso:
+    python benchmarks/bench_firmas.py [-n 100]
+"""
+import argparse
+import io
+import os
+import tempfile
+
+from comun import firma_realista, medir, resumen
+
+os.environ.setdefault("PRECALENTAR_CACHES", "0")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench_firmas_"))
+
+from docx import Document
+
+import app
+import firma_util
+import plantilla_util
+from bench_plantilla import MAPPING
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", type=int, default=100)
+    args = ap.parse_args()
+
+    firma_png = firma_util.preparar_firma(firma_realista(), app.SIGNATURE_IMAGE_WIDTH_IN)
+    simple = plantilla_util.get_plantilla(app.TEMPLATE_DOCX)
+    firmada = plantilla_util.get_plantilla(app.TEMPLATE_DOCX, app._preparar_tabla_firmas)
+
+    def antes() -> bytes:
+        doc = simple.completar(MAPPING)
+        app._ensure_company_signature(app.FIRMA_EMPRESA_PATH)
+        app._add_signatures_section(doc, io.BytesIO(firma_png), app.FIRMA_EMPRESA_PATH)
+        out = io.BytesIO()
+        doc.save(out)
+        return out.getvalue()
+
+    def despues() -> bytes:
+        doc = firmada.completar(MAPPING)
+        app._insertar_firma_cliente(doc, firma_png)
+        out = io.BytesIO()
+        doc.save(out)
+        return out.getvalue()
+
+    # Mismo texto y misma cantidad de imágenes en ambos caminos
+    a, d = Document(io.BytesIO(antes())), Document(io.BytesIO(despues()))
+    celdas = lambda doc: [c.text for t in doc.tables for r in t.rows for c in r.cells]
+    if ([p.text for p in a.paragraphs], celdas(a), len(a.inline_shapes)) != \
+            ([p.text for p in d.paragraphs], celdas(d), len(d.inline_shapes)):
+        raise SystemExit("Los dos caminos producen documentos distintos")
+
+    r_antes = resumen("firmas por request", medir(antes, args.n))
+    r_despues = resumen("tabla de firmas precompilada", medir(despues, args.n))
+    print(f"speedup p50: x{r_antes['p50_ms'] / max(r_despues['p50_ms'], 1e-9):.2f} "
+          f"({r_antes['p50_ms'] - r_despues['p50_ms']:.2f} ms menos por contrato)")
+    t_antes, t_despues = len(antes()), len(despues())
+    print(f"tamaño DOCX: antes={t_antes} B  después={t_despues} B  ({t_despues - t_antes:+d} B)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# benchmarks/bench_pdf.py
+"""
+Compara la latencia DOCX -> PDF en frío (un `soffice` por conversión, perfil
+compartido) contra el pool de instancias calientes de pdf_util.
+
+Uso:
+    python benchmarks/bench_pdf.py [-n 20] [--pool 2]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+from comun import RAIZ, medir, resumen
+
+import pdf_util
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", type=int, default=20, help="conversiones por escenario")
+    ap.add_argument("--pool", type=int, default=2, help="instancias del pool caliente")
+    ap.add_argument("--docx", default=os.path.join(RAIZ, "Contrato_Plantilla.docx"))
+    args = ap.parse_args()
+
+    if not pdf_util._soffice_bin():
+        raise SystemExit("LibreOffice no está instalado: no hay nada que medir.")
+
+    tmp = tempfile.mkdtemp(prefix="bench_pdf_")
+    src = os.path.join(tmp, "contrato.docx")
+    shutil.copy(args.docx, src)
+    out_pdf = os.path.join(tmp, "contrato.pdf")
+
+    def frio():
+        if not pdf_util.convertir_cli(src, out_pdf):
+            raise RuntimeError("Falló la conversión en frío")
+
+    pool = pdf_util.PoolConversion(size=args.pool, max_cola=0)
+    pool.calentar()
+
+    def caliente():
+        if not pool.convertir(src, out_pdf):
+            raise RuntimeError("Falló la conversión en el pool")
+
+    try:
+        print(f"modo pool: {pool.modo}")
+        resumen("frío (CLI)", medir(frio, args.n))
+        caliente()  # primera conversión: crea el perfil de la instancia
+        resumen(f"caliente (pool={args.pool})", medir(caliente, args.n))
+    finally:
+        pool.cerrar()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
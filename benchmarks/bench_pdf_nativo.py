@@ -0,0 +1,129 @@
+# benchmarks/bench_pdf_nativo.py
+"""
+Backend PDF nativo (pdf_nativo_util) contra el camino DOCX + LibreOffice.
+
+Fidelidad: extrae el texto de ambos PDF (pypdf), lo normaliza y compara palabra
+por palabra (difflib); además compara cantidad de páginas e imágenes. Sin
+LibreOffice, la referencia es el texto del DOCX completado.
+Velocidad: p50/p95/p99 de cada camino y speedup.
+
+Uso:
+    python benchmarks/bench_pdf_nativo.py [-n 20] [--umbral 0.98] [--salida /tmp/pdfs]
+Sale con código 1 si la similitud de texto queda por debajo del umbral.
+"""
+import argparse
+import difflib
+import os
+import re
+import shutil
+import tempfile
+
+from comun import FORMULARIO, firma_realista, medir, resumen
+
+os.environ.setdefault("PRECALENTAR_CACHES", "0")
+
+from docx import Document
+from pypdf import PdfReader
+
+import app
+import firma_util
+import pdf_util
+
+DATOS = dict(FORMULARIO, fecha="01/01/2025")
+
+
+def _palabras(texto: str):
+    return re.sub(r"\s+", " ", texto).strip().split(" ")
+
+
+def texto_pdf(ruta: str) -> str:
+    return "\n".join(p.extract_text() or "" for p in PdfReader(ruta).pages)
+
+
+def texto_docx(ruta: str) -> str:
+    doc = Document(ruta)
+    partes = [p.text for p in doc.paragraphs]
+    for t in doc.tables:
+        partes += [c.text for row in t.rows for c in row.cells]
+    return "\n".join(partes)
+
+
+def _imagenes(ruta: str) -> int:
+    return sum(len(p.images) for p in PdfReader(ruta).pages)
+
+
+def fidelidad(pdf_nativo: str, referencia: str, es_pdf: bool) -> dict:
+    a = _palabras(texto_pdf(pdf_nativo))
+    b = _palabras(texto_pdf(referencia) if es_pdf else texto_docx(referencia))
+    sm = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    r = {"similitud": round(sm.ratio(), 4), "palabras": (len(a), len(b)),
+         "paginas_nativo": len(PdfReader(pdf_nativo).pages), "imagenes_nativo": _imagenes(pdf_nativo)}
+    if es_pdf:
+        r["paginas_ref"] = len(PdfReader(referencia).pages)
+        r["imagenes_ref"] = _imagenes(referencia)
+    diffs = [(op, " ".join(a[i1:i2]), " ".join(b[j1:j2]))
+             for op, i1, i2, j1, j2 in sm.get_opcodes() if op != "equal"]
+    r["diferencias"] = diffs[:10]
+    return r
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", type=int, default=20)
+    ap.add_argument("--umbral", type=float, default=0.98, help="similitud mínima de texto")
+    ap.add_argument("--salida", default=None, help="carpeta donde dejar los PDF para revisarlos")
+    args = ap.parse_args()
+
+    tmp = args.salida or tempfile.mkdtemp(prefix="bench_pdf_nativo_")
+    os.makedirs(tmp, exist_ok=True)
+    firma_png = firma_util.preparar_firma(firma_realista(), app.SIGNATURE_IMAGE_WIDTH_IN)
+    out_docx = os.path.join(tmp, "contrato.docx")
+    out_lo = os.path.join(tmp, "contrato_libreoffice.pdf")
+    out_nat = os.path.join(tmp, "contrato_nativo.pdf")
+    hay_lo = bool(pdf_util._soffice_bin())
+
+    def camino_docx():
+        app._render_contrato(DATOS, firma_png, out_docx)
+        if hay_lo and not pdf_util.convertir_cli(out_docx, out_lo):
+            raise RuntimeError("Falló LibreOffice")
+
+    def camino_nativo():
+        if not app._export_to_pdf_nativo(DATOS, firma_png, out_nat):
+            raise RuntimeError("Falló el render nativo")
+
+    try:
+        camino_docx()
+        camino_nativo()
+
+        # --- Fidelidad ---
+        f = fidelidad(out_nat, out_lo if hay_lo else out_docx, es_pdf=hay_lo)
+        ref = "LibreOffice" if hay_lo else "texto del DOCX (LibreOffice no está instalado)"
+        print(f"Fidelidad contra {ref}: similitud={f['similitud']:.4f} palabras={f['palabras']}")
+        print(f"  páginas nativo={f['paginas_nativo']} imágenes nativo={f['imagenes_nativo']}", end="")
+        if hay_lo:
+            print(f" | páginas LO={f['paginas_ref']} imágenes LO={f['imagenes_ref']}")
+        else:
+            print()
+        for op, x, y in f["diferencias"]:
+            print(f"  {op:<8} nativo={x[:60]!r} ref={y[:60]!r}")
+        print(f"  tamaño nativo={os.path.getsize(out_nat)} B"
+              + (f" | LO={os.path.getsize(out_lo)} B" if hay_lo else ""))
+
+        # --- Velocidad ---
+        etiqueta = "DOCX + LibreOffice (CLI)" if hay_lo else "DOCX (sin conversión)"
+        r_docx = resumen(etiqueta, medir(camino_docx, max(3, args.n // 4) if hay_lo else args.n))
+        r_nat = resumen("PDF nativo", medir(camino_nativo, args.n))
+        if hay_lo:
+            print(f"speedup p50: x{r_docx['p50_ms'] / max(r_nat['p50_ms'], 1e-9):.1f}")
+        else:
+            print("speedup: sin LibreOffice no hay referencia; la fila DOCX es solo el piso del camino viejo")
+    finally:
+        if not args.salida:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    if f["similitud"] < args.umbral:
+        raise SystemExit(f"Similitud {f['similitud']:.4f} por debajo del umbral {args.umbral}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# benchmarks/bench_plantilla.py
+"""
+Costo de completar la plantilla por contrato:
+  - antes:   Document(plantilla) + _insert_text_placeholders (todo el documento)
+  - después: plantilla_util.get_plantilla(...).completar(mapping)
+
+Uso:
+    python benchmarks/bench_plantilla.py [-n 200]
+"""
+import argparse
+
+from comun import medir, resumen
+
+from docx import Document
+
+import app
+import plantilla_util
+
+MAPPING = {
+    "{{ nombre }}": "Juan Pérez",
+    "{{ dni }}": "30111222",
+    "{{ email }}": "juan@example.com",
+    "{{ ubicacion }}": "Salta 123, Ituzaingó",
+    "{{ ubicacion_monitoreo }}": "Corrientes 456, Ituzaingó",
+    "{{ fecha_hoy }}": "01/01/2025",
+}
+
+
+def antes():
+    doc = Document(app.TEMPLATE_DOCX)
+    app._insert_text_placeholders(doc, MAPPING)
+    return doc
+
+
+def despues():
+    return plantilla_util.get_plantilla(app.TEMPLATE_DOCX).completar(MAPPING)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", type=int, default=200)
+    args = ap.parse_args()
+
+    # Mismo texto en ambos caminos
+    texto = lambda d: [p.text for p in d.paragraphs]
+    if texto(antes()) != texto(despues()):
+        raise SystemExit("Los dos caminos producen documentos distintos")
+
+    r_antes = resumen("Document + reemplazo", medir(antes, args.n))
+    r_despues = resumen("plantilla compilada", medir(despues, args.n))
+    print(f"speedup p50: x{r_antes['p50_ms'] / max(r_despues['p50_ms'], 1e-9):.1f}")
+
+
+if __name__ == "__main__":
+    main()
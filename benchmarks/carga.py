@@ -0,0 +1,201 @@
+# benchmarks/carga.py
+"""
+Prueba de carga del flujo de contratos (POST /generar -> trabajo completo).
+
+- Levanta la app en el proceso (servidor threaded de Werkzeug) o bajo Gunicorn.
+- Drive y Brevo se reemplazan por fakes locales con latencia configurable
+  (benchmarks/fakes.py); nada sale a la red.
+- Cada cliente manda el formulario real con una firma de tamaño real (canvas
+  1560x600) y, con --e2e, sondea /estado/<id> hasta que el trabajo termina.
+- Reporta throughput y p50/p95/p99 por nivel de concurrencia; --guardar-base /
+  --comparar contra benchmarks/baseline_carga.json.
+
+Uso:
+    python benchmarks/carga.py [-c 1,4,16] [-n 40] [--e2e] [--modo gunicorn --workers 2]
+    python benchmarks/carga.py --comparar [--tolerancia 0.25]
+"""
+import argparse
+import itertools
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from comun import FORMULARIO, RAIZ, comparar_base, firma_realista, guardar_base, resumen
+
+import requests
+
+BASE_CARGA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_carga.json")
+_JOB_RE = re.compile(r"seguimiento: (\w+)")
+# DNI distinto en cada envío de la corrida: con el mismo formulario en otro nivel, la
+# deduplicación de /generar devolvería el trabajo existente y no se mediría nada
+_DNIS = itertools.count(30000000)
+
+
+def _entorno(data_dir: str, url_brevo: str) -> dict:
+    """Variables comunes a ambos modos (antes de importar la app)."""
+    return {
+        "DATA_DIR": data_dir,
+        "BREVO_API_KEY": "clave-falsa",
+        "BREVO_API_URL": url_brevo,
+        "BREVO_BACKOFF": "0.05",
+        "EMAIL_EMPRESA": "empresa@example.com",
+        "GOOGLE_APPLICATION_CREDENTIALS": "falso.json",
+        "GOOGLE_DRIVE_FOLDER_ID": "carpeta_falsa",
+        "DRIVE_SPOOL_INTERVALO": "3600",
+        # Todos los clientes salen de 127.0.0.1: el control de admisión (user-020)
+        # rechazaría casi todo con 429; se mide el pipeline, no el limitador
+        "ADMISION_IP_POR_MIN": "1000000",
+        "ADMISION_IP_RAFAGA": "1000000",
+        "ADMISION_GLOBAL_POR_MIN": "1000000",
+        "ADMISION_GLOBAL_RAFAGA": "1000000",
+        "ADMISION_MAX_EN_CURSO": "1000000",
+    }
+
+
+# ==============================
+# Servidores
+# ==============================
+class _ServidorInterno:
+    def __init__(self, latencia_drive: float):
+        import fakes
+        from werkzeug.serving import make_server
+
+        import app as app_mod
+        fakes.instalar_drive_falso(latencia_drive)
+        self.httpd = make_server("127.0.0.1", 0, app_mod.app, threaded=True)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def cerrar(self):
+        self.httpd.shutdown()
+
+
+class _ServidorGunicorn:
+    def __init__(self, workers: int, threads: int, puerto: int):
+        self.url = f"http://127.0.0.1:{puerto}"
+        cmd = [sys.executable, "-m", "gunicorn", "-c", os.path.join(RAIZ, "benchmarks", "gunicorn_fakes.py"),
+               "-b", f"127.0.0.1:{puerto}", "-w", str(workers), "--threads", str(threads), "app:app"]
+        self.proc = subprocess.Popen(cmd, cwd=RAIZ, env=os.environ.copy())
+        limite = time.time() + 60
+        while time.time() < limite:
+            try:
+                requests.get(self.url + "/metrics", timeout=1)
+                return
+            except requests.RequestException:
+                if self.proc.poll() is not None:
+                    raise SystemExit("Gunicorn terminó al arrancar")
+                time.sleep(0.2)
+        self.cerrar()
+        raise SystemExit("Gunicorn no respondió a tiempo")
+
+    def cerrar(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+# ==============================
+# Clientes
+# ==============================
+def _un_contrato(url: str, form: dict, e2e: bool, local: threading.local, timeout_e2e: float):
+    """Devuelve (seg. hasta el 202, seg. hasta completado | None, ok)."""
+    s = getattr(local, "s", None)
+    if s is None:
+        s = local.s = requests.Session()
+    t0 = time.perf_counter()
+    r = s.post(url + "/generar", data=form, timeout=60)
+    t_acept = time.perf_counter() - t0
+    if r.status_code != 202:
+        return t_acept, None, False
+    if not e2e:
+        return t_acept, None, True
+    job_id = _JOB_RE.search(r.text).group(1)
+    limite = time.time() + timeout_e2e
+    while time.time() < limite:
+        estado = s.get(f"{url}/estado/{job_id}", timeout=10).json()
+        if estado["estado"] in ("completado", "error"):
+            return t_acept, time.perf_counter() - t0, estado["estado"] == "completado"
+        time.sleep(0.05)
+    return t_acept, None, False
+
+
+def correr_nivel(url: str, concurrencia: int, n: int, e2e: bool, timeout_e2e: float) -> dict:
+    firma = firma_realista()
+    local = threading.local()
+
+    def tarea(i):
+        form = dict(FORMULARIO, dni=str(next(_DNIS)), firma=firma)
+        return _un_contrato(url, form, e2e, local, timeout_e2e)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as ex:
+        resultados = list(ex.map(tarea, range(n)))
+    total = time.perf_counter() - t0
+
+    oks = [r for r in resultados if r[2]]
+    out = {}
+    out[f"aceptacion_c{concurrencia}"] = resumen(f"aceptación c={concurrencia}", [r[0] for r in oks])
+    if e2e:
+        out[f"e2e_c{concurrencia}"] = resumen(f"fin a fin c={concurrencia}", [r[1] for r in oks if r[1]])
+    rps = len(oks) / total if total else 0.0
+    print(f"{'':<32} ok={len(oks)}/{n}  throughput={rps:.1f} contratos/s")
+    for r in out.values():
+        r["throughput_rps"] = round(rps, 2)
+        r["errores"] = n - len(oks)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-c", "--concurrencia", default="1,4,16", help="niveles separados por coma")
+    ap.add_argument("-n", type=int, default=40, help="contratos por nivel")
+    ap.add_argument("--e2e", action="store_true", help="esperar a que cada trabajo termine")
+    ap.add_argument("--timeout-e2e", type=float, default=120)
+    ap.add_argument("--modo", choices=("interno", "gunicorn"), default="interno")
+    ap.add_argument("--workers", type=int, default=2, help="workers de Gunicorn")
+    ap.add_argument("--threads", type=int, default=4, help="hilos por worker de Gunicorn")
+    ap.add_argument("--puerto", type=int, default=8765)
+    ap.add_argument("--latencia-drive", type=float, default=0.05, help="seg. por chunk en el Drive falso")
+    ap.add_argument("--latencia-brevo", type=float, default=0.1, help="seg. por request en el Brevo falso")
+    ap.add_argument("--guardar-base", action="store_true")
+    ap.add_argument("--comparar", action="store_true")
+    ap.add_argument("--tolerancia", type=float, default=0.25, help="margen relativo sobre el p50 de la base")
+    ap.add_argument("--margen-ms", type=float, default=0.5, help="margen absoluto (ms) sobre el p50 de la base")
+    args = ap.parse_args()
+
+    import fakes
+
+    with fakes.ServidorBrevoFalso(latencia=args.latencia_brevo) as brevo, \
+            tempfile.TemporaryDirectory(prefix="bench_carga_") as data_dir:
+        os.environ.update(_entorno(data_dir, brevo.url))
+        os.environ["BENCH_DRIVE_LATENCIA"] = str(args.latencia_drive)
+        if args.modo == "gunicorn":
+            srv = _ServidorGunicorn(args.workers, args.threads, args.puerto)
+        else:
+            srv = _ServidorInterno(args.latencia_drive)
+        try:
+            # Calentamiento: cachés de plantilla/vista previa, conexiones, workers
+            correr_nivel(srv.url, 1, 2, args.e2e, args.timeout_e2e)
+            print("-" * 80)
+            resultados = {}
+            for c in (int(x) for x in args.concurrencia.split(",")):
+                resultados.update(correr_nivel(srv.url, c, args.n, args.e2e, args.timeout_e2e))
+        finally:
+            srv.cerrar()
+
+    if args.guardar_base:
+        guardar_base(BASE_CARGA, resultados)
+    if args.comparar:
+        if comparar_base(BASE_CARGA, resultados, args.tolerancia, args.margen_ms):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
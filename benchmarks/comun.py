@@ -0,0 +1,132 @@
+# benchmarks/comun.py
+"""Utilidades compartidas por los benchmarks (percentiles, cronómetro, rutas, líneas base)."""
+import base64
+import gc
+import io
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+
+def percentil(valores, p: float) -> float:
+    """Percentil con interpolación lineal (p en 0..100)."""
+    if not valores:
+        return 0.0
+    xs = sorted(valores)
+    k = (len(xs) - 1) * (p / 100.0)
+    f = int(k)
+    c = min(f + 1, len(xs) - 1)
+    return xs[f] + (xs[c] - xs[f]) * (k - f)
+
+
+def resumen(nombre: str, tiempos_s) -> dict:
+    """Imprime y devuelve p50/p95/p99 (en ms) de una lista de tiempos en segundos."""
+    ms = [t * 1000 for t in tiempos_s]
+    r = {
+        "n": len(ms),
+        "p50_ms": round(percentil(ms, 50), 2),
+        "p95_ms": round(percentil(ms, 95), 2),
+        "p99_ms": round(percentil(ms, 99), 2),
+    }
+    print(f"{nombre:<32} n={r['n']:<5} p50={r['p50_ms']:>9.2f}ms "
+          f"p95={r['p95_ms']:>9.2f}ms p99={r['p99_ms']:>9.2f}ms")
+    return r
+
+
+def medir(fn, repeticiones: int, *args, **kwargs):
+    """Ejecuta fn `repeticiones` veces y devuelve la lista de duraciones (s). Sin GC, como timeit."""
+    tiempos = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeticiones):
+            t0 = time.perf_counter()
+            fn(*args, **kwargs)
+            tiempos.append(time.perf_counter() - t0)
+    finally:
+        gc.enable()
+    return tiempos
+
+
+# ==============================
+# Datos realistas
+# ==============================
+def firma_realista(ancho: int = 1560, alto: int = 600, semilla: int = 7) -> str:
+    """
+    data URL como la que manda el canvas de formulario_contrato.html en un
+    escritorio con devicePixelRatio 2 (fondo transparente, trazo antialiasado).
+    """
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rnd = random.Random(semilla)
+    img = Image.new("RGBA", (ancho, alto), (0, 0, 0, 0))
+    d = ImageDraw.Draw(img)
+    x, y = ancho * 0.1, alto * 0.55
+    for _ in range(5):                      # trazos tipo rúbrica
+        pts = []
+        for i in range(40):
+            x += rnd.uniform(4, 22)
+            y = alto * 0.5 + math.sin(i / 3.0 + rnd.random()) * alto * rnd.uniform(0.1, 0.3)
+            pts.append((min(x, ancho - 20), y))
+        d.line(pts, fill=(17, 17, 17, 255), width=rnd.choice((4, 5, 6)), joint="curve")
+        x = rnd.uniform(ancho * 0.1, ancho * 0.6)
+    img = img.filter(ImageFilter.GaussianBlur(0.8))
+    b = io.BytesIO()
+    img.save(b, "PNG")
+    return "data:image/png;base64," + base64.b64encode(b.getvalue()).decode("ascii")
+
+
+FORMULARIO = {
+    "nombre": "Juan Pérez",
+    "dni": "30111222",
+    "email": "juan@example.com",
+    "ubicacion": "Salta 123, Ituzaingó",
+    "ubicacion_monitoreo": "Corrientes 456, Ituzaingó",
+}
+
+
+# ==============================
+# Líneas base / regresiones
+# ==============================
+def guardar_base(ruta: str, resultados: dict):
+    """Guarda los resultados como línea base (con datos de la máquina para comparar con criterio)."""
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump({
+            "maquina": {"python": platform.python_version(), "plataforma": platform.platform(),
+                        "cpus": os.cpu_count()},
+            "fecha": time.strftime("%Y-%m-%d"),
+            "resultados": resultados,
+        }, f, indent=2, ensure_ascii=False, sort_keys=True)
+        f.write("\n")
+    print(f"Línea base guardada en {ruta}")
+
+
+def comparar_base(ruta: str, resultados: dict, tolerancia: float, margen_ms: float = 0.5,
+                  metrica: str = "p50_ms") -> list:
+    """
+    Compara `metrica` contra la línea base. Devuelve las regresiones (nombre, base, actual)
+    que superan base * (1 + tolerancia) + margen_ms (el margen absoluto evita falsos
+    positivos en pasos de menos de 1 ms). Los escenarios que no están en la base se ignoran.
+    """
+    with open(ruta, encoding="utf-8") as f:
+        base = json.load(f)["resultados"]
+    regresiones = []
+    for nombre, r in sorted(resultados.items()):
+        b = base.get(nombre)
+        if not b or metrica not in b or metrica not in r:
+            continue
+        limite = b[metrica] * (1 + tolerancia) + margen_ms
+        estado = "REGRESIÓN" if r[metrica] > limite else "ok"
+        print(f"{nombre:<32} base={b[metrica]:>9.2f} actual={r[metrica]:>9.2f} "
+              f"límite={limite:>9.2f}  {estado}")
+        if r[metrica] > limite:
+            regresiones.append((nombre, b[metrica], r[metrica]))
+    return regresiones
@@ -0,0 +1,80 @@
+# benchmarks/drive_reanudar.py
+"""
+Subida reanudable a Drive (drive_util.UploadManager) contra el DriveFalso, sin red.
+
+Sube un archivo de --mb MB en chunks de 256 KB, corta la conexión en el chunk
+--cortar-en y vuelve a llamar a `subir` con la misma clave (como el reintento de
+la etapa drive o el barrido del spool). Verifica que:
+  - se consultó el estado de la sesión guardada en el spool,
+  - no se reenvió lo que Drive ya tenía (bytes recibidos == tamaño del archivo),
+  - quedó un solo archivo, con el contenido completo,
+  - la entrada salió del spool.
+
+Uso:
+    python benchmarks/drive_reanudar.py [--mb 2] [--cortar-en 3]
+Sale con código 1 si alguna verificación falla.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+os.environ.setdefault("PRECALENTAR_CACHES", "0")
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench_drive_")
+
+from comun import resumen
+from fakes import DriveFalso
+
+from googleapiclient.errors import HttpError
+
+import drive_util
+
+CHUNK = 256 * 1024
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--mb", type=float, default=2)
+    ap.add_argument("--cortar-en", type=int, default=3, help="chunk en el que se corta la subida (>= 1: antes del primero no hay sesión guardada)")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_drive_archivo_")
+    ruta = os.path.join(tmp, "contrato.pdf")
+    contenido = os.urandom(int(args.mb * 1024 * 1024))
+    with open(ruta, "wb") as f:
+        f.write(contenido)
+
+    drive = DriveFalso(cortar_en=args.cortar_en)
+    manager = drive_util.UploadManager(spool_dir=os.path.join(tmp, "spool"),
+                                       drive_factory=lambda: drive, chunksize=CHUNK)
+    clave = "bench_reanudar"
+    try:
+        manager.subir(ruta, "contrato.pdf", "application/pdf", "carpeta", clave)
+        print("la subida no se cortó (¿--cortar-en mayor que la cantidad de chunks?)")
+        raise SystemExit(1)
+    except HttpError as e:
+        print(f"corte en el chunk {args.cortar_en}: {e.resp.status}")
+    antes = drive.bytes_recibidos
+    t0 = time.perf_counter()
+    file_id = manager.subir(ruta, "contrato.pdf", "application/pdf", "carpeta", clave)
+    resumen("subida retomada", [time.perf_counter() - t0])
+
+    chequeos = {
+        "consulta de estado": drive.consultas == 1,
+        "sin reenviar bytes": drive.bytes_recibidos == len(contenido),
+        "un solo archivo": list(drive.archivos) == [file_id],
+        "contenido completo": drive.archivos[file_id]["contenido"] == contenido,
+        "spool vacío": manager.pendientes() == [],
+    }
+    print(f"{len(contenido) / 1024 / 1024:.1f} MB: {antes} bytes antes del corte, "
+          f"{drive.bytes_recibidos - antes} después, {drive.consultas} consulta(s) de estado")
+    for nombre, ok in chequeos.items():
+        print(f"  {'ok   ' if ok else 'FALLA'} {nombre}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    if not all(chequeos.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# benchmarks/exportar.py
+"""
+Exportación en streaming (exportar_util): memoria pico y throughput del ZIP y
+del PDF unido según la cantidad de contratos.
+
+Arma un índice con N contratos que apuntan a PDFs reales del almacén de
+artefactos (backend nativo, cada uno con su firma) y consume la salida de
+zip_en_cadena / pdf_en_cadena sin guardarla, midiendo el pico de memoria de
+Python (tracemalloc). Después valida el resultado: el ZIP con zipfile
+(entradas + CRC) y el PDF con pypdf (cantidad de páginas).
+
+Uso:
+    python benchmarks/exportar.py [--contratos 50 500] [--distintos 20]
+Sale con código 1 si la salida es inválida o si el pico con el N más grande
+supera el doble del pico con el más chico.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+os.environ.setdefault("PRECALENTAR_CACHES", "0")
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench_exportar_")
+
+from comun import FORMULARIO, firma_realista
+
+from pypdf import PdfReader
+
+import app
+import artefactos_util
+import exportar_util
+import firma_util
+import indice_util
+
+
+def preparar(distintos: int) -> list:
+    """`distintos` PDFs en el almacén (misma plantilla, distinto nombre); devuelve sus rutas."""
+    almacen = artefactos_util.get_almacen()
+    firma = firma_util.preparar_firma(firma_realista(), app.SIGNATURE_IMAGE_WIDTH_IN)
+    tmp = almacen.directorio_trabajo("bench")
+    rutas = []
+    for i in range(distintos):
+        out = os.path.join(tmp, f"c{i}.pdf")
+        datos = dict(FORMULARIO, nombre=f"Cliente {i}", fecha="01/03/2025")
+        if not app._export_to_pdf_nativo(datos, firma, out):
+            raise SystemExit("No se pudo generar el PDF de prueba (backend nativo)")
+        rutas.append(almacen.guardar(out))
+    almacen.liberar_trabajo("bench")
+    return rutas
+
+
+def indexar(n: int, rutas: list):
+    indice = indice_util.IndiceContratos(os.path.join(os.environ["DATA_DIR"], f"indice_{n}.sqlite3"))
+    for i in range(n):
+        datos = dict(FORMULARIO, slug=f"bench_{n}_{i}", nombre=f"Cliente {i}",
+                     fecha=f"{1 + i % 28:02d}/03/2025")
+        indice.registrar(datos, {"archivo": rutas[i % len(rutas)]})
+    indice_util._INDICE = indice
+
+
+def consumir(generador, destino: str = None) -> dict:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    total = partes = 0
+    f = open(destino, "wb") if destino else None
+    try:
+        for parte in generador:
+            total += len(parte)
+            partes += 1
+            if f:
+                f.write(parte)
+    finally:
+        if f:
+            f.close()
+    segundos = time.perf_counter() - t0
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"mb": total / 1024 / 1024, "partes": partes, "s": segundos, "pico_mb": pico / 1024 / 1024}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--contratos", type=int, nargs="+", default=[50, 500])
+    ap.add_argument("--distintos", type=int, default=20, help="PDFs distintos en el almacén")
+    args = ap.parse_args()
+
+    rutas = preparar(args.distintos)
+    salida = tempfile.mkdtemp(prefix="bench_exportar_salida_")
+    picos = {"zip": [], "pdf": []}
+    paginas = len(PdfReader(rutas[0]).pages)
+    ok = True
+    print(f"{'':<12} {'salida':>9} {'partes':>7} {'tiempo':>8} {'MB/s':>7} {'pico py':>9}")
+    for n in sorted(args.contratos):
+        indexar(n, rutas)
+        for formato, fn in (("zip", exportar_util.zip_en_cadena), ("pdf", exportar_util.pdf_en_cadena)):
+            destino = os.path.join(salida, f"{n}.{formato}")
+            r = consumir(fn(exportar_util.contratos("2025-03-01", "2025-03-31")), destino)
+            picos[formato].append(r["pico_mb"])
+            print(f"{formato} n={n:<6} {r['mb']:>7.1f}MB {r['partes']:>7} {r['s']:>7.2f}s "
+                  f"{r['mb'] / r['s']:>7.1f} {r['pico_mb']:>7.2f}MB")
+            if formato == "zip":
+                with zipfile.ZipFile(destino) as zf:
+                    valido = zf.testzip() is None and len(zf.namelist()) == n + 1
+            else:
+                valido = len(PdfReader(destino).pages) == n * paginas
+            if not valido:
+                print(f"  salida inválida: {destino}")
+                ok = False
+    shutil.rmtree(salida, ignore_errors=True)
+
+    for formato, p in picos.items():
+        if len(p) > 1 and p[-1] > 2 * p[0]:
+            print(f"{formato}: el pico de memoria crece con la cantidad de contratos")
+            ok = False
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
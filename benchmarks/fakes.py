@@ -0,0 +1,221 @@
+# benchmarks/fakes.py
+"""
+Dobles locales de los servicios externos, para medir y probar sin red.
+
+- ServidorBrevoFalso: HTTP local que imita POST /v3/smtp/email, con latencia
+  configurable y respuestas 429/5xx inyectables.
+- DriveFalso: servicio Drive en memoria para drive_util.UploadManager
+  (subida resumable por chunks, consulta de estado de la sesión, cortes
+  simulados, búsqueda por idempotencyKey).
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ServidorBrevoFalso:
+    """
+    Uso:
+        with ServidorBrevoFalso(latencia=0.2) as srv:
+            os.environ["BREVO_API_URL"] = srv.url
+    - fallas: lista de códigos a devolver en los primeros requests (p. ej. [429, 503])
+    - retry_after: valor del header Retry-After en las fallas
+    """
+
+    def __init__(self, latencia: float = 0.0, fallas=None, retry_after: str = "0"):
+        self.latencia = latencia
+        self.fallas = list(fallas or [])
+        self.retry_after = retry_after
+        self.recibidos = []
+        self.conexiones = set()
+        self._lock = threading.Lock()
+        srv = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                largo = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(largo) or b"{}")
+                time.sleep(srv.latencia)
+                with srv._lock:
+                    srv.conexiones.add(self.client_address)
+                    codigo = srv.fallas.pop(0) if srv.fallas else None
+                    if codigo is None:
+                        srv.recibidos.append(payload)
+                if codigo is not None:
+                    cuerpo = json.dumps({"code": "falla_simulada"}).encode()
+                    self.send_response(codigo)
+                    self.send_header("Retry-After", srv.retry_after)
+                else:
+                    versiones = payload.get("messageVersions") or [payload]
+                    ids = [f"<{uuid.uuid4().hex}@fake.brevo>" for _ in versiones]
+                    data = {"messageIds": ids} if "messageVersions" in payload else {"messageId": ids[0]}
+                    cuerpo = json.dumps(data).encode()
+                    self.send_response(201)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v3/smtp/email"
+        self._hilo = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# ==============================
+# Drive
+# ==============================
+class _Resp(dict):
+    def __init__(self, status, **headers):
+        super().__init__(status=str(status), **headers)
+        self.status = status
+        self.reason = "fake"
+
+
+class _Estado:
+    def __init__(self, progreso, total):
+        self.resumable_progress = progreso
+        self.total_size = total
+
+    def progress(self):
+        return self.resumable_progress / self.total_size if self.total_size else 1.0
+
+
+class _HttpFalso:
+    """
+    Imita el httplib2.Http del request en lo que usa la consulta de estado de una
+    sesión: PUT vacío con "Content-Range: bytes */N" -> 308 con Range (o 200 si ya terminó).
+    """
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        d = self.drive
+        d.consultas += 1
+        rango = (headers or {}).get("Content-Range", "")
+        if method != "PUT" or not re.match(r"^bytes \*/\d+$", rango):
+            return _Resp(400), b"request no soportado por el falso"
+        if uri in d.terminadas:
+            return _Resp(200), json.dumps({"id": d.terminadas[uri]}).encode()
+        if uri not in d.sesiones:
+            return _Resp(404), b"sesion vencida"
+        recibidos = len(d.sesiones[uri])
+        if not recibidos:
+            return _Resp(308), b""
+        return _Resp(308, range=f"bytes=0-{recibidos - 1}"), b""
+
+
+class _CrearFalso:
+    """Imita HttpRequest.next_chunk() de una subida resumable (sube desde resumable_progress)."""
+
+    def __init__(self, drive, body, media_body):
+        self.drive = drive
+        self.body = body
+        self.media = media_body
+        self.http = _HttpFalso(drive)
+        self.resumable_uri = None
+        self.resumable_progress = 0
+
+    def next_chunk(self, num_retries=0):
+        from googleapiclient.errors import HttpError
+
+        d = self.drive
+        if self.resumable_uri is None:
+            self.resumable_uri = f"fake://upload/{len(d.sesiones) + len(d.terminadas)}"
+            d.sesiones[self.resumable_uri] = bytearray()
+        if self.resumable_uri not in d.sesiones:
+            raise HttpError(_Resp(404), b"sesion vencida")
+        if d.cortar_en is not None and d.chunks_subidos >= d.cortar_en:
+            d.cortar_en = None
+            raise HttpError(_Resp(503), b"corte simulado")
+
+        recibido = d.sesiones[self.resumable_uri]
+        if self.resumable_progress != len(recibido):
+            # Como Drive: un chunk que no sigue a lo recibido es un error del cliente
+            raise HttpError(_Resp(400), b"offset distinto al de la sesion")
+        total = self.media.size()
+        trozo = self.media.getbytes(self.resumable_progress, self.media.chunksize())
+        time.sleep(d.latencia)
+        recibido += trozo
+        d.bytes_recibidos += len(trozo)
+        self.resumable_progress = len(recibido)
+        d.chunks_subidos += 1
+        if len(recibido) < total:
+            return _Estado(len(recibido), total), None
+        file_id = uuid.uuid4().hex
+        d.archivos[file_id] = dict(self.body, size=total, contenido=bytes(recibido))
+        d.terminadas[self.resumable_uri] = file_id
+        del d.sesiones[self.resumable_uri]
+        return None, {"id": file_id}
+
+
+class _Ejecutable:
+    def __init__(self, valor):
+        self.valor = valor
+
+    def execute(self, num_retries=0):
+        return self.valor
+
+
+class DriveFalso:
+    """
+    Servicio Drive en memoria (files().create con next_chunk y files().list por appProperties).
+    - latencia: seg. por chunk
+    - cortar_en: número de chunk en el que se simula una caída (una vez)
+    Lleva la cuenta de chunks, bytes recibidos y consultas de estado (para verificar
+    que una subida retomada no reenvía lo que Drive ya tenía).
+    """
+
+    def __init__(self, latencia: float = 0.0, cortar_en=None):
+        self.latencia = latencia
+        self.cortar_en = cortar_en
+        self.sesiones = {}      # uri -> bytes recibidos
+        self.terminadas = {}    # uri -> fileId
+        self.archivos = {}
+        self.chunks_subidos = 0
+        self.bytes_recibidos = 0
+        self.consultas = 0
+
+    def files(self):
+        return self
+
+    def create(self, body=None, media_body=None, **kwargs):
+        return _CrearFalso(self, body, media_body)
+
+    def list(self, q="", **kwargs):
+        m = re.search(r"value='([^']+)'", q)
+        clave = m.group(1) if m else None
+        files = [{"id": fid} for fid, meta in self.archivos.items()
+                 if (meta.get("appProperties") or {}).get("idempotencyKey") == clave]
+        return _Ejecutable({"files": files[:1]})
+
+
+def instalar_drive_falso(latencia: float = 0.0) -> DriveFalso:
+    """
+    Hace que drive_util suba a un DriveFalso en este proceso (llamar en cada
+    worker, después del fork). Devuelve el falso para inspeccionarlo.
+    """
+    import os
+    import drive_util
+
+    os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "falso.json")
+    os.environ.setdefault("GOOGLE_DRIVE_FOLDER_ID", "carpeta_falsa")
+    drive = DriveFalso(latencia=latencia)
+    drive_util.get_manager().drive_factory = lambda: drive
+    return drive
@@ -0,0 +1,16 @@
+# benchmarks/gunicorn_fakes.py
+"""
+Config de Gunicorn para benchmarks/carga.py --modo gunicorn: cada worker sube
+a un DriveFalso en memoria (Brevo ya apunta al servidor falso por BREVO_API_URL).
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+loglevel = "warning"
+
+
+def post_fork(server, worker):
+    import fakes
+    fakes.instalar_drive_falso(float(os.getenv("BENCH_DRIVE_LATENCIA", "0")))
@@ -0,0 +1,115 @@
+# benchmarks/gunicorn_memoria.py
+"""
+Arranque y memoria de Gunicorn con gunicorn.conf.py, con y sin preload_app.
+
+Para cada variante levanta Gunicorn, mide el tiempo hasta que todos los workers
+responden (la página / ya lista en cada uno), hace unos requests de
+calentamiento y lee /proc/<pid>/smaps_rollup del master y de cada worker:
+  - RSS:     memoria residente (cuenta las páginas compartidas en cada proceso)
+  - PSS:     residente proporcional (las compartidas se reparten): la suma es
+             lo que ocupa realmente la instancia
+  - privada: Private_Clean + Private_Dirty (lo que no se comparte con el master)
+
+Solo Linux. LibreOffice queda fuera (PDF_POOL_SIZE=0) para medir la app.
+
+Uso:
+    python benchmarks/gunicorn_memoria.py [--workers 2] [--threads 4] [--requests 20]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from comun import RAIZ
+
+import requests
+
+
+def _smaps(pid: int) -> dict:
+    kb = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for linea in f:
+            partes = linea.split()
+            if len(partes) >= 3 and partes[2] == "kB":
+                kb[partes[0].rstrip(":")] = int(partes[1])
+    return {"rss": kb.get("Rss", 0), "pss": kb.get("Pss", 0),
+            "privada": kb.get("Private_Clean", 0) + kb.get("Private_Dirty", 0)}
+
+
+def _hijos(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(x) for x in f.read().split()]
+
+
+def medir(preload: bool, workers: int, threads: int, n_requests: int, puerto: int) -> dict:
+    env = dict(os.environ, GUNICORN_PRELOAD="1" if preload else "0", GUNICORN_WORKERS=str(workers),
+               GUNICORN_THREADS=str(threads), PORT=str(puerto), PDF_POOL_SIZE="0",
+               GUNICORN_LOGLEVEL="warning", DATA_DIR=tempfile.mkdtemp(prefix="bench_gunicorn_"))
+    url = f"http://127.0.0.1:{puerto}"
+    # Un Gunicorn viejo en el mismo puerto respondería los sondeos por este
+    with socket.socket() as sock:
+        if sock.connect_ex(("127.0.0.1", puerto)) == 0:
+            raise SystemExit(f"El puerto {puerto} ya está en uso")
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+                            cwd=RAIZ, env=env)
+    # Sin keep-alive: una conexión abierta hacia un worker demora su apagado ordenado
+    s = requests.Session()
+    s.headers["Connection"] = "close"
+    try:
+        # Listo = todos los workers vivos y respondiendo (cada uno calienta en post_fork)
+        listos = set()
+        limite = time.time() + 120
+        while len(listos) < workers:
+            if time.time() > limite or proc.poll() is not None:
+                raise SystemExit("Gunicorn no arrancó")
+            try:
+                r = s.get(url + "/metrics", timeout=2)
+                listos.update(l.split('pid="')[1].split('"')[0] for l in r.text.splitlines()
+                              if 'pid="' in l)
+                listos &= {str(p) for p in _hijos(proc.pid)}
+            except requests.RequestException:
+                pass
+            time.sleep(0.05)
+        arranque = time.perf_counter() - t0
+
+        for _ in range(n_requests):
+            s.get(url + "/", timeout=10)
+        time.sleep(0.5)
+
+        master = _smaps(proc.pid)
+        hijos = [_smaps(p) for p in _hijos(proc.pid)]
+        return {
+            "arranque_s": round(arranque, 2),
+            "pss_total_mb": round((master["pss"] + sum(h["pss"] for h in hijos)) / 1024, 1),
+            "rss_worker_mb": round(sum(h["rss"] for h in hijos) / len(hijos) / 1024, 1),
+            "privada_worker_mb": round(sum(h["privada"] for h in hijos) / len(hijos) / 1024, 1),
+            "rss_master_mb": round(master["rss"] / 1024, 1),
+        }
+    finally:
+        s.close()
+        proc.terminate()
+        proc.wait(60)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--requests", type=int, default=20, help="GET / de calentamiento antes de medir")
+    ap.add_argument("--puerto", type=int, default=8766)
+    args = ap.parse_args()
+
+    print(f"{'':<18} {'arranque':>9} {'PSS total':>10} {'RSS/worker':>11} {'privada/worker':>15} {'RSS master':>11}")
+    for preload in (False, True):
+        r = medir(preload, args.workers, args.threads, args.requests, args.puerto)
+        nombre = "con preload_app" if preload else "sin preload_app"
+        print(f"{nombre:<18} {r['arranque_s']:>8.2f}s {r['pss_total_mb']:>8.1f}MB {r['rss_worker_mb']:>9.1f}MB "
+              f"{r['privada_worker_mb']:>13.1f}MB {r['rss_master_mb']:>9.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# benchmarks/micro.py
+"""
+Microbenchmarks de los pasos del contrato, con línea base y chequeo de regresión.
+
+  - insert_placeholders:   Document(plantilla) + app._insert_text_placeholders
+  - plantilla_compilada:   plantilla_util.get_plantilla(...).completar
+  - preparar_firma:        firma_util.preparar_firma (reemplazó a _b64_to_pil_image)
+  - add_signatures:        app._add_signatures_section sobre un documento ya completado (camino viejo)
+  - firma_cliente:         app._insertar_firma_cliente sobre la plantilla con la tabla de firmas precompilada
+  - guardar_docx:          doc.save a memoria
+  - export_pdf:            app._export_to_pdf_safe (solo si LibreOffice está instalado)
+
+Uso:
+    python benchmarks/micro.py [-n 200] [--solo add_signatures,preparar_firma]
+    python benchmarks/micro.py --guardar-base          # en la máquina de referencia
+    python benchmarks/micro.py --comparar [--tolerancia 0.25]   # exit 1 si hay regresión
+"""
+import argparse
+import io
+import os
+import shutil
+import tempfile
+
+from comun import comparar_base, firma_realista, guardar_base, medir, resumen
+
+os.environ.setdefault("PRECALENTAR_CACHES", "0")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench_micro_"))
+
+from docx import Document
+
+import app
+import firma_util
+import pdf_util
+import plantilla_util
+from bench_plantilla import MAPPING
+
+BASE_MICRO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_micro.json")
+
+
+def escenarios(tmp: str, n: int) -> dict:
+    """nombre -> (fn, repeticiones relativas). Prepara las entradas fuera del cronómetro."""
+    firma_b64 = firma_realista()
+    firma_png = firma_util.preparar_firma(firma_b64, app.SIGNATURE_IMAGE_WIDTH_IN)
+    app._ensure_company_signature(app.FIRMA_EMPRESA_PATH)
+    plantilla = plantilla_util.get_plantilla(app.TEMPLATE_DOCX)
+    firmada = plantilla_util.get_plantilla(app.TEMPLATE_DOCX, app._preparar_tabla_firmas)
+
+    def insert_placeholders():
+        app._insert_text_placeholders(Document(app.TEMPLATE_DOCX), MAPPING)
+
+    def plantilla_compilada():
+        plantilla.completar(MAPPING)
+
+    def preparar_firma():
+        firma_util.preparar_firma(firma_b64, app.SIGNATURE_IMAGE_WIDTH_IN)
+
+    # Un documento nuevo por iteración (la sección de firmas se agrega al final), armado antes
+    docs = [plantilla.completar(MAPPING) for _ in range(n + 1)]
+
+    def add_signatures():
+        app._add_signatures_section(docs.pop(), io.BytesIO(firma_png), app.FIRMA_EMPRESA_PATH)
+
+    docs_firmados = [firmada.completar(MAPPING) for _ in range(n + 1)]
+
+    def firma_cliente():
+        app._insertar_firma_cliente(docs_firmados.pop(), firma_png)
+
+    completo = firmada.completar(MAPPING)
+    app._insertar_firma_cliente(completo, firma_png)
+
+    def guardar_docx():
+        completo.save(io.BytesIO())
+
+    out = {
+        "insert_placeholders": (insert_placeholders, 1),
+        "plantilla_compilada": (plantilla_compilada, 1),
+        "preparar_firma": (preparar_firma, 1),
+        "add_signatures": (add_signatures, 1),
+        "firma_cliente": (firma_cliente, 1),
+        "guardar_docx": (guardar_docx, 1),
+    }
+
+    if pdf_util._soffice_bin():
+        src = os.path.join(tmp, "contrato.docx")
+        completo.save(src)
+        out_pdf = os.path.join(tmp, "contrato.pdf")
+
+        def export_pdf():
+            if not app._export_to_pdf_safe(src, out_pdf):
+                raise RuntimeError("Falló la conversión")
+
+        out["export_pdf"] = (export_pdf, 0.2)   # segundos por iteración: menos vueltas
+    else:
+        print("(LibreOffice no está instalado: se omite export_pdf)")
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", type=int, default=200, help="repeticiones por escenario (la base usa 200)")
+    ap.add_argument("--solo", default="", help="escenarios separados por coma")
+    ap.add_argument("--guardar-base", action="store_true")
+    ap.add_argument("--comparar", action="store_true")
+    ap.add_argument("--tolerancia", type=float, default=0.25, help="margen relativo sobre el p50 de la base")
+    ap.add_argument("--margen-ms", type=float, default=0.5, help="margen absoluto (ms) sobre el p50 de la base")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_micro_")
+    try:
+        todos = escenarios(tmp, args.n)
+        elegidos = [s for s in args.solo.split(",") if s] or list(todos)
+        resultados = {}
+        for nombre in elegidos:
+            fn, factor = todos[nombre]
+            fn()  # calentamiento (cachés, imports perezosos)
+            resultados[nombre] = resumen(nombre, medir(fn, max(3, int(args.n * factor))))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.guardar_base:
+        guardar_base(BASE_MICRO, resultados)
+    if args.comparar:
+        if comparar_base(BASE_MICRO, resultados, args.tolerancia, args.margen_ms):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
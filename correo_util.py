@@ -3,8 +3,13 @@ import os
 import base64
 import json
 import logging
-import mimetypes
-import requests
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+import metricas_util
 
 # ==============================
 # Config desde variables de entorno
@@ -15,86 +20,276 @@ FROM_NAME       = os.environ.get("FROM_NAME", "Seguridad Ituzaingó")
 CC_EMPRESA      = os.environ.get("CC_EMPRESA")          # ej: administracion@seguridadituzaingo.com
 CONTACTO_TEL    = os.environ.get("CONTACTO_TELEFONO", "")  # ej: 3786-617492
 
-BREVO_URL = "https://api.brevo.com/v3/smtp/email"
+BREVO_URL       = os.environ.get("BREVO_API_URL", "https://api.brevo.com/v3/smtp/email")
+BREVO_TIMEOUT   = float(os.environ.get("BREVO_TIMEOUT", "20"))
+BREVO_REINTENTOS = int(os.environ.get("BREVO_REINTENTOS", "3"))    # reintentos ante 429/sin conexión
+BREVO_BACKOFF   = float(os.environ.get("BREVO_BACKOFF", "1.0"))    # seg. base de la espera exponencial
+BREVO_MAX_ESPERA = float(os.environ.get("BREVO_MAX_ESPERA", "30"))  # tope por espera (incluye Retry-After)
+
+_CACHE_ADJUNTOS = 16   # adjuntos codificados que se guardan en memoria
+
+
+def _lista(x):
+    if not x:
+        return []
+    return x if isinstance(x, list) else [x]
+
+
+def _sin_enviar(e) -> bool:
+    """
+    True si el error de red es seguro de reintentar: la conexión no llegó a
+    establecerse, así que Brevo no recibió el mail. Un timeout de lectura o un
+    corte a mitad de la respuesta es ambiguo (el mail pudo salir) y no se reintenta.
+    """
+    import requests
+    from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(e, requests.ConnectionError):
+        return False
+    causa = e.args[0] if e.args else None
+    causa = getattr(causa, "reason", causa)
+    return isinstance(causa, (NewConnectionError, ConnectTimeoutError))
 
 
-def _adjunto_to_b64(path):
-    """Convierte un archivo a adjunto base64 para Brevo."""
-    if not path:
+def _espera_retry_after(valor):
+    """Segundos indicados por Retry-After (número o fecha HTTP); None si no se entiende."""
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        fecha = parsedate_to_datetime(valor)
+        return max(0.0, fecha.timestamp() - time.time())
+    except Exception:
         return None
-    ctype, enc = mimetypes.guess_type(path)
-    if ctype is None or enc is not None:
-        ctype = "application/octet-stream"
-    with open(path, "rb") as f:
-        content_b64 = base64.b64encode(f.read()).decode("utf-8")
-    return {"content": content_b64, "name": os.path.basename(path)}
 
 
-def enviar_email(to, asunto, cuerpo_texto, adjunto_path=None, cc=None, reply_to=None):
+class BrevoClient:
+    """
+    Cliente de la API transaccional de Brevo.
+      - Session con keep-alive (no se repite el handshake TLS por envío).
+      - Reintenta solo lo que seguro no envió el mail: 429 y errores de conexión, con
+        espera exponencial y respetando Retry-After. Un 5xx o un timeout de lectura
+        no se reintentan acá (el mail pudo salir): queda el reintento de la etapa email.
+      - Cachea el adjunto ya codificado, por hash del archivo.
+      - enviar_lote(): un solo request para varios destinatarios (messageVersions).
+    """
+
+    def __init__(self, api_key=None, url=BREVO_URL, reintentos=BREVO_REINTENTOS,
+                 backoff=BREVO_BACKOFF, timeout=BREVO_TIMEOUT, pool=10):
+        self.api_key = api_key if api_key is not None else BREVO_API_KEY
+        self.url = url
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.timeout = timeout
+        import requests.adapters   # al primer envío, no al importar la app
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._adjuntos = OrderedDict()    # sha256 -> adjunto codificado
+        self._hash_por_stat = {}          # (path, size, mtime_ns) -> sha256
+        self._lock = threading.Lock()
+
+    # --- adjuntos ---
+    def _adjunto(self, path, nombre=None):
+        if not path:
+            return None
+        nombre = nombre or os.path.basename(path)
+        st = os.stat(path)
+        clave_stat = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._hash_por_stat.get(clave_stat)
+            if digest and digest in self._adjuntos:
+                self._adjuntos.move_to_end(digest)
+                return dict(self._adjuntos[digest], name=nombre)
+
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            adj = self._adjuntos.get(digest)
+            if adj is None:
+                adj = {"content": base64.b64encode(data).decode("utf-8"), "name": os.path.basename(path)}
+                self._adjuntos[digest] = adj
+                while len(self._adjuntos) > _CACHE_ADJUNTOS:
+                    self._adjuntos.popitem(last=False)
+            self._hash_por_stat[clave_stat] = digest
+            if len(self._hash_por_stat) > 4 * _CACHE_ADJUNTOS:
+                self._hash_por_stat.pop(next(iter(self._hash_por_stat)))
+        return dict(adj, name=nombre)
+
+    # --- payload ---
+    def _base(self, asunto, cuerpo_texto, adjunto_path=None, reply_to=None, adjunto_nombre=None):
+        # --- construir HTML sin f-strings problemáticos ---
+        texto_plano = cuerpo_texto or ""
+        texto_html  = texto_plano.replace("\n", "<br>")
+        html_body   = "<p>" + texto_html + "</p>"
+        if CONTACTO_TEL:
+            html_body += "<p><strong>Teléfono:</strong> " + CONTACTO_TEL + "</p>"
+
+        payload = {
+            "sender": {"email": FROM_EMAIL, "name": FROM_NAME},
+            "subject": asunto,
+            "textContent": texto_plano,
+            "htmlContent": html_body,
+        }
+        if reply_to:
+            payload["replyTo"] = {"email": reply_to}
+        adj = self._adjunto(adjunto_path, adjunto_nombre)
+        if adj:
+            payload["attachment"] = [adj]
+        return payload
+
+    @staticmethod
+    def _cc(cc):
+        cc_list = list(_lista(cc))
+        # agrega siempre CC_EMPRESA si está configurado
+        if CC_EMPRESA and CC_EMPRESA not in cc_list:
+            cc_list.append(CC_EMPRESA)
+        return [{"email": x} for x in cc_list if x]
+
+    # --- HTTP ---
+    def _post(self, payload):
+        """POST con reintentos (429 / sin conexión). Return: (ok, data | mensaje de error)."""
+        headers = {
+            "accept": "application/json",
+            "api-key": self.api_key,
+            "content-type": "application/json",
+        }
+        import requests
+
+        cuerpo = json.dumps(payload)
+        for intento in range(self.reintentos + 1):
+            espera = min(BREVO_MAX_ESPERA, self.backoff * (2 ** intento))
+            try:
+                r = self.session.post(self.url, headers=headers, data=cuerpo, timeout=self.timeout)
+            except requests.RequestException as e:
+                if intento >= self.reintentos or not _sin_enviar(e):
+                    return False, str(e)
+                logging.warning("[Brevo] Error de red (%s), reintento en %.1fs", e, espera)
+                time.sleep(espera)
+                continue
+
+            if r.status_code in (200, 201, 202):
+                try:
+                    return True, r.json()
+                except ValueError:
+                    return True, {}
+            if r.status_code == 429 and intento < self.reintentos:
+                pedida = _espera_retry_after(r.headers.get("Retry-After"))
+                if pedida is not None:
+                    espera = min(BREVO_MAX_ESPERA, pedida)
+                logging.warning("[Brevo] HTTP %s, reintento en %.1fs", r.status_code, espera)
+                time.sleep(espera)
+                continue
+            logging.error("[Brevo] Error %s: %s", r.status_code, r.text)
+            return False, f"HTTP {r.status_code}: {r.text}"
+        return False, "Sin respuesta de Brevo"
+
+    # --- API ---
+    def enviar(self, to, asunto, cuerpo_texto, adjunto_path=None, cc=None, reply_to=None, adjunto_nombre=None):
+        """Un email (to: str o lista). Return: (ok: bool, info: str)."""
+        return self.enviar_lote([to], asunto, cuerpo_texto, adjunto_path, cc, reply_to, adjunto_nombre)[0]
+
+    def enviar_lote(self, destinatarios, asunto, cuerpo_texto, adjunto_path=None, cc=None, reply_to=None,
+                    adjunto_nombre=None):
+        """
+        Mismo mensaje a varios destinatarios, cada uno en su propia copia,
+        en un único request (messageVersions) y con el adjunto codificado una vez.
+          - destinatarios: lista de str (o de listas de str)
+          - adjunto_nombre: nombre del adjunto en el correo (por defecto, el del archivo)
+        Return: lista de (ok, info) en el mismo orden.
+        """
+        with metricas_util.ETAPA_SEGUNDOS.tiempo(etapa="email_envio"):
+            resultados = self._enviar_lote(destinatarios, asunto, cuerpo_texto, adjunto_path, cc, reply_to,
+                                           adjunto_nombre)
+        fallas = sum(1 for ok, _ in resultados if not ok)
+        if fallas:
+            metricas_util.EMAIL_FALLAS.inc(fallas)
+        return resultados
+
+    def _enviar_lote(self, destinatarios, asunto, cuerpo_texto, adjunto_path, cc, reply_to, adjunto_nombre=None):
+        if not self.api_key:
+            return [(False, "BREVO_API_KEY no configurada")] * len(destinatarios)
+        try:
+            payload = self._base(asunto, cuerpo_texto, adjunto_path, reply_to, adjunto_nombre)
+        except OSError as e:
+            logging.exception("[Brevo] No se pudo leer el adjunto")
+            return [(False, str(e))] * len(destinatarios)
+
+        cc_list = self._cc(cc)
+        versiones = []
+        for to in destinatarios:
+            v = {"to": [{"email": x} for x in _lista(to)]}
+            if cc_list:
+                v["cc"] = cc_list
+            versiones.append(v)
+        if len(versiones) == 1:
+            payload.update(versiones[0])
+        else:
+            payload["messageVersions"] = versiones
+
+        ok, data = self._post(payload)
+        if not ok:
+            return [(False, data)] * len(destinatarios)
+
+        ids = data.get("messageIds") if isinstance(data.get("messageIds"), list) else []
+        if data.get("messageId"):
+            ids = [data["messageId"]] + ids
+        resultados = []
+        for i, to in enumerate(destinatarios):
+            message_id = ids[i] if i < len(ids) else ""
+            logging.info("[Brevo] Enviado OK -> to=%s id=%s", _lista(to), message_id)
+            resultados.append((True, str(message_id)))
+        return resultados
+
+
+_CLIENTE = None
+_CLIENTE_LOCK = threading.Lock()
+
+
+def get_cliente() -> BrevoClient:
+    """Cliente compartido del proceso (la Session es thread-safe para POSTs)."""
+    global _CLIENTE
+    if _CLIENTE is None:
+        with _CLIENTE_LOCK:
+            if _CLIENTE is None:
+                _CLIENTE = BrevoClient()
+    return _CLIENTE
+
+
+def enviar_email(to, asunto, cuerpo_texto, adjunto_path=None, cc=None, reply_to=None, adjunto_nombre=None):
     """
     Envía email vía Brevo API.
       - to: str o lista de str
       - asunto: str
       - cuerpo_texto: str (texto plano)
       - adjunto_path: ruta archivo (opcional)
+      - adjunto_nombre: nombre con el que llega el adjunto (opcional)
       - cc: str o lista de str (opcional)
       - reply_to: str (opcional)
     Return: (ok: bool, info: str)
     """
-    if not BREVO_API_KEY:
-        return False, "BREVO_API_KEY no configurada"
-
-    # Normalizar destinatarios
-    to_list = to if isinstance(to, list) else [to]
-    cc_list = []
-    if cc:
-        cc_list = cc if isinstance(cc, list) else [cc]
-    # agrega siempre CC_EMPRESA si está configurado
-    if CC_EMPRESA and CC_EMPRESA not in cc_list:
-        cc_list.append(CC_EMPRESA)
-
-    # --- construir HTML sin f-strings problemáticos ---
-    texto_plano = cuerpo_texto or ""
-    texto_html  = texto_plano.replace("\n", "<br>")
-    html_body   = "<p>" + texto_html + "</p>"
-    if CONTACTO_TEL:
-        html_body += "<p><strong>Teléfono:</strong> " + CONTACTO_TEL + "</p>"
-
-    payload = {
-        "sender": {"email": FROM_EMAIL, "name": FROM_NAME},
-        "to": [{"email": x} for x in to_list],
-        "subject": asunto,
-        "textContent": texto_plano,
-        "htmlContent": html_body,
-    }
-
-    if reply_to:
-        payload["replyTo"] = {"email": reply_to}
-    if cc_list:
-        payload["cc"] = [{"email": x} for x in cc_list if x]
-
-    adj = _adjunto_to_b64(adjunto_path)
-    if adj:
-        payload["attachment"] = [adj]
-
-    headers = {
-        "accept": "application/json",
-        "api-key": BREVO_API_KEY,
-        "content-type": "application/json",
-    }
-
     try:
-        r = requests.post(BREVO_URL, headers=headers, data=json.dumps(payload), timeout=20)
-        if r.status_code in (200, 201, 202):
-            data = r.json()
-            message_id = data.get("messageId") or (
-                data.get("messageIds", [""])[0] if isinstance(data.get("messageIds"), list) else ""
-            )
-            logging.info("[Brevo] Enviado OK -> to=%s id=%s", to_list, message_id)
-            return True, str(message_id)
-        else:
-            logging.error("[Brevo] Error %s: %s", r.status_code, r.text)
-            return False, f"HTTP {r.status_code}: {r.text}"
+        return get_cliente().enviar(to, asunto, cuerpo_texto, adjunto_path, cc, reply_to, adjunto_nombre)
     except Exception as e:
         logging.exception("[Brevo] Excepción enviando email")
+        metricas_util.EMAIL_FALLAS.inc()
         return False, str(e)
+
+
+def enviar_emails(destinatarios, asunto, cuerpo_texto, adjunto_path=None, cc=None, reply_to=None,
+                  adjunto_nombre=None):
+    """Como enviar_email, pero una copia por destinatario en un solo request. Return: [(ok, info)]."""
+    try:
+        return get_cliente().enviar_lote(destinatarios, asunto, cuerpo_texto, adjunto_path, cc, reply_to,
+                                         adjunto_nombre)
+    except Exception as e:
+        logging.exception("[Brevo] Excepción enviando emails")
+        metricas_util.EMAIL_FALLAS.inc(len(destinatarios))
+        return [(False, str(e))] * len(destinatarios)
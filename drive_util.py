@@ -1,34 +1,400 @@
 # drive_util.py
-import os, io
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
+import os, io, json, time, fcntl, logging, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-_DRIVE = None
+import metricas_util
+
+# googleapiclient / google-auth / httplib2 se importan al primer uso: cargarlos
+# cuesta ~0.3 s y GET / (ni un deploy sin Drive) los necesita
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "data"))
+DRIVE_SPOOL_DIR = os.getenv("DRIVE_SPOOL_DIR", os.path.join(DATA_DIR, "drive_spool"))
+DRIVE_CHUNK_MB = int(os.getenv("DRIVE_CHUNK_MB", "5"))                # múltiplo de 256 KB
+DRIVE_UPLOAD_WORKERS = int(os.getenv("DRIVE_UPLOAD_WORKERS", "2"))
+DRIVE_REINTENTOS = int(os.getenv("DRIVE_REINTENTOS", "5"))            # por chunk (backoff de googleapiclient)
+DRIVE_SPOOL_INTERVALO = int(os.getenv("DRIVE_SPOOL_INTERVALO", "300"))  # seg. entre barridos del spool
+DRIVE_TOKEN_MARGEN = int(os.getenv("DRIVE_TOKEN_MARGEN", "300"))        # seg. antes del vencimiento para renovar
+DRIVE_TOKEN_CACHE = os.getenv("DRIVE_TOKEN_CACHE", os.path.join(DATA_DIR, "drive_token.json"))
+DRIVE_HTTP_TIMEOUT = int(os.getenv("DRIVE_HTTP_TIMEOUT", "60"))
+
+log = logging.getLogger(__name__)
+
+class DriveNoConfigurado(Exception):
+    """Faltan credenciales o carpeta de Drive: no tiene sentido reintentar."""
+
+# =========================================================
+# Cliente: credenciales compartidas + un transporte HTTP por hilo
+# =========================================================
+# httplib2.Http no es thread-safe: cada hilo arma su propio servicio sobre las
+# mismas credenciales. El token se renueva antes de vencer y se comparte entre
+# workers por un archivo en DATA_DIR (con flock), así un deploy no pide N tokens.
+_SCOPES = ["https://www.googleapis.com/auth/drive"]
+_CREDS = None
+_CREDS_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+_HTTP_MEDIDO = None
+
+def _http_medido(**kwargs):
+    """httplib2.Http que mide cada request a la API en DRIVE_API_SEGUNDOS (la clase se arma al primer uso)."""
+    global _HTTP_MEDIDO
+    if _HTTP_MEDIDO is None:
+        import httplib2
+
+        class _HttpMedido(httplib2.Http):
+            def request(self, *args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    resp, content = super().request(*args, **kwargs)
+                except Exception:
+                    metricas_util.DRIVE_API_SEGUNDOS.observar(time.perf_counter() - t0, resultado="excepcion")
+                    raise
+                metricas_util.DRIVE_API_SEGUNDOS.observar(
+                    time.perf_counter() - t0, resultado="http_error" if resp.status >= 400 else "ok")
+                return resp, content
+
+        _HTTP_MEDIDO = _HttpMedido
+    return _HTTP_MEDIDO(**kwargs)
+
+def _leer_token_compartido(creds):
+    try:
+        with open(DRIVE_TOKEN_CACHE, encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            data = json.load(f)
+        expiry = datetime.fromisoformat(data["expiry"])
+    except (OSError, ValueError, KeyError):
+        return False
+    if data.get("cuenta") != creds.service_account_email:
+        return False
+    if expiry - datetime.utcnow() <= timedelta(seconds=DRIVE_TOKEN_MARGEN):
+        return False
+    creds.token, creds.expiry = data["token"], expiry
+    return True
+
+def _guardar_token_compartido(creds):
+    try:
+        os.makedirs(os.path.dirname(DRIVE_TOKEN_CACHE) or ".", exist_ok=True)
+        fd = os.open(DRIVE_TOKEN_CACHE, os.O_CREAT | os.O_WRONLY, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.truncate()
+            json.dump({"cuenta": creds.service_account_email, "token": creds.token,
+                       "expiry": creds.expiry.isoformat()}, f)
+    except OSError:
+        log.warning("[Drive] No se pudo guardar el token compartido", exc_info=True)
+
+def _asegurar_token(creds):
+    """Renueva el token si vence dentro de DRIVE_TOKEN_MARGEN (antes de que falle un request)."""
+    def vigente():
+        return creds.token and creds.expiry and \
+            creds.expiry - datetime.utcnow() > timedelta(seconds=DRIVE_TOKEN_MARGEN)
+
+    if vigente():
+        return
+    with _CREDS_LOCK:
+        if vigente():
+            return
+        if _leer_token_compartido(creds):
+            metricas_util.DRIVE_TOKENS.inc(origen="cache")
+            return
+        import google.auth.transport.requests
+        creds.refresh(google.auth.transport.requests.Request())
+        metricas_util.DRIVE_TOKENS.inc(origen="google")
+        _guardar_token_compartido(creds)
+        log.info("[Drive] Token renovado (vence %s)", creds.expiry)
+
+def _get_creds():
+    global _CREDS
+    if _CREDS is None:
+        with _CREDS_LOCK:
+            if _CREDS is None:
+                from google.oauth2 import service_account
+                _CREDS = service_account.Credentials.from_service_account_file(
+                    os.getenv("GOOGLE_APPLICATION_CREDENTIALS"), scopes=_SCOPES
+                )
+    return _CREDS
 
 def _get_drive():
-    global _DRIVE
-    if _DRIVE:
-        return _DRIVE
-    creds = service_account.Credentials.from_service_account_file(
-        os.getenv("GOOGLE_APPLICATION_CREDENTIALS"),
-        scopes=["https://www.googleapis.com/auth/drive"]
-    )
-    _DRIVE = build("drive", "v3", credentials=creds, cache_discovery=False)
-    return _DRIVE
-
-def upload_path_to_drive(path: str, filename: str, mimetype: str, folder_id: str = None) -> str:
-    """Sube un archivo del disco a la carpeta indicada (o a GOOGLE_DRIVE_FOLDER_ID). Devuelve fileId."""
-    folder_id = folder_id or os.getenv("GOOGLE_DRIVE_FOLDER_ID")
-    meta = {"name": filename, "parents": [folder_id]}
-    media = MediaFileUpload(path, mimetype=mimetype, resumable=True)
-    created = _get_drive().files().create(
-        body=meta, media_body=media, fields="id", supportsAllDrives=True
-    ).execute()
-    return created["id"]
+    """Servicio Drive del hilo actual, con token vigente."""
+    creds = _get_creds()
+    _asegurar_token(creds)
+    drive = getattr(_LOCAL, "drive", None)
+    if drive is None or getattr(_LOCAL, "pid", None) != os.getpid():
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build
+        http = AuthorizedHttp(creds, http=_http_medido(timeout=DRIVE_HTTP_TIMEOUT))
+        # static_discovery: usa el documento de discovery incluido en la librería (sin red)
+        drive = build("drive", "v3", http=http, cache_discovery=False, static_discovery=True)
+        _LOCAL.drive, _LOCAL.pid = drive, os.getpid()
+    return drive
+
+def precalentar():
+    """Credenciales + token + servicio listos (p. ej. en el post_fork de Gunicorn)."""
+    if not drive_configurado():
+        return False
+    try:
+        _get_drive()
+        return True
+    except Exception:
+        log.exception("[Drive] No se pudo precalentar el cliente")
+        return False
+
+def drive_configurado() -> bool:
+    return bool(os.getenv("GOOGLE_APPLICATION_CREDENTIALS") and os.getenv("GOOGLE_DRIVE_FOLDER_ID"))
+
+# =========================================================
+# Gestor de subidas: spool en disco + subida por chunks reanudable
+# =========================================================
+class UploadManager:
+    """
+    Cada subida pendiente es un JSON en el spool (clave = idempotency key):
+      {clave, path, filename, mimetype, folder_id, slug, session_uri, progreso, file_id}
+    - La sesión resumable se guarda tras cada chunk: un worker reiniciado continúa desde ahí
+      (se le pregunta a Drive cuántos bytes tiene y se sigue desde ese offset).
+    - El archivo se crea con appProperties.idempotencyKey; antes de abrir una sesión
+      nueva se busca si ya existe, así un reintento no duplica el archivo.
+    - flock sobre <clave>.json.lock: dos procesos no suben la misma entrada a la vez.
+    - Lo que termina el barrido del spool (la etapa drive ya se había rendido) se avisa a
+      `al_subir(entrada)`; si el aviso falla, la entrada queda con su file_id y se
+      vuelve a avisar en el próximo barrido (sin volver a subir).
+    """
+
+    def __init__(self, spool_dir: str = DRIVE_SPOOL_DIR, workers: int = DRIVE_UPLOAD_WORKERS,
+                 drive_factory=None, chunksize: int = DRIVE_CHUNK_MB * 1024 * 1024):
+        self.spool_dir = spool_dir
+        self.workers = workers
+        self.drive_factory = drive_factory or _get_drive
+        self.chunksize = chunksize
+        self._pool = None
+        self._pid = None
+        self.al_subir = None
+        self._lock = threading.Lock()
+        self._barrido_pid = None
+        self._barrido_lock = threading.Lock()
+        os.makedirs(spool_dir, exist_ok=True)
+
+    # --- spool ---
+    def _ruta(self, clave: str) -> str:
+        return os.path.join(self.spool_dir, f"{clave}.json")
+
+    def _escribir(self, entrada: dict):
+        tmp = self._ruta(entrada["clave"]) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entrada, f)
+        os.replace(tmp, self._ruta(entrada["clave"]))
+
+    def pendientes(self):
+        return sorted(n[:-5] for n in os.listdir(self.spool_dir) if n.endswith(".json"))
+
+    def encolar(self, path: str, filename: str, mimetype: str, folder_id: str = None, clave: str = None,
+                slug: str = None) -> str:
+        """
+        Registra la subida en el spool (si ya existe la clave, se conserva su avance).
+        `slug`: contrato al que pertenece el archivo (para el aviso de al_subir).
+        """
+        folder_id = folder_id or os.getenv("GOOGLE_DRIVE_FOLDER_ID")
+        clave = clave or f"{int(time.time() * 1000)}_{os.urandom(4).hex()}"
+        if not os.path.exists(self._ruta(clave)):
+            self._escribir({
+                "clave": clave, "path": path, "filename": filename, "mimetype": mimetype,
+                "folder_id": folder_id, "slug": slug, "session_uri": None, "progreso": 0, "file_id": None,
+            })
+        return clave
+
+    # --- subida ---
+    def _buscar_existente(self, drive, clave: str):
+        q = f"appProperties has {{ key='idempotencyKey' and value='{clave}' }} and trashed = false"
+        res = drive.files().list(
+            q=q, fields="files(id)", pageSize=1,
+            supportsAllDrives=True, includeItemsFromAllDrives=True,
+        ).execute()
+        files = res.get("files") or []
+        return files[0]["id"] if files else None
+
+    @staticmethod
+    def _consultar_sesion(req, session_uri: str, total: int):
+        """
+        Estado de una sesión resumable: PUT vacío con "Content-Range: bytes */total".
+        Return: (bytes que Drive ya recibió, respuesta final si la subida ya terminó o None)
+        """
+        from googleapiclient.errors import HttpError
+
+        resp, content = req.http.request(session_uri, method="PUT", body=b"",
+                                         headers={"Content-Length": "0", "Content-Range": f"bytes */{total}"})
+        if resp.status in (200, 201):
+            return total, json.loads(content)
+        if resp.status == 308:
+            rango = resp.get("range")   # "bytes=0-N"; sin Range no recibió nada
+            return (int(rango.rsplit("-", 1)[1]) + 1 if rango else 0), None
+        raise HttpError(resp, content, uri=session_uri)
+
+    def _subir_entrada(self, entrada: dict) -> str:
+        from googleapiclient.errors import HttpError
+        from googleapiclient.http import MediaFileUpload
+
+        drive = self.drive_factory()
+        clave = entrada["clave"]
+
+        if not entrada.get("session_uri"):
+            existente = self._buscar_existente(drive, clave)
+            if existente:
+                log.info("[Drive] %s ya estaba subido (fileId=%s)", clave, existente)
+                return existente
+
+        meta = {"name": entrada["filename"], "parents": [entrada["folder_id"]],
+                "appProperties": {"idempotencyKey": clave}}
+        media = MediaFileUpload(entrada["path"], mimetype=entrada["mimetype"],
+                                chunksize=self.chunksize, resumable=True)
+        req = drive.files().create(body=meta, media_body=media, fields="id", supportsAllDrives=True)
+        resp = None
+        if entrada.get("session_uri"):
+            # Sesión previa: se le pregunta a Drive cuántos bytes ya tiene y se sigue desde ahí
+            try:
+                recibidos, resp = self._consultar_sesion(req, entrada["session_uri"], media.size())
+            except HttpError as e:
+                if e.resp.status not in (404, 410):
+                    raise
+                # La sesión venció: se descarta y se arranca de nuevo
+                entrada["session_uri"], entrada["progreso"] = None, 0
+                self._escribir(entrada)
+                return self._subir_entrada(entrada)
+            req.resumable_uri, req.resumable_progress = entrada["session_uri"], recibidos
+
+        while resp is None:
+            status, resp = req.next_chunk(num_retries=DRIVE_REINTENTOS)
+            if req.resumable_uri != entrada.get("session_uri") or status:
+                entrada["session_uri"] = req.resumable_uri
+                entrada["progreso"] = status.resumable_progress if status else entrada.get("progreso", 0)
+                self._escribir(entrada)
+        return resp["id"]
+
+    def procesar(self, clave: str, avisar: bool = False):
+        """
+        Sube una entrada del spool. Devuelve fileId, o None si otro proceso la está subiendo.
+        avisar: llamar a al_subir antes de sacarla del spool (barrido; la etapa drive ya no espera).
+        """
+        ruta = self._ruta(clave)
+        # Lock en un archivo aparte: el JSON se reemplaza (os.replace) en cada checkpoint
+        fd = os.open(ruta + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                with open(ruta, encoding="utf-8") as f:
+                    entrada = json.load(f)
+            except FileNotFoundError:
+                os.remove(ruta + ".lock")
+                return None  # ya la terminó otro proceso
+            if not entrada.get("file_id"):
+                try:
+                    with metricas_util.ETAPA_SEGUNDOS.tiempo(etapa="drive_subida"):
+                        entrada["file_id"] = self._subir_entrada(entrada)
+                except Exception:
+                    metricas_util.DRIVE_FALLAS.inc()
+                    raise
+                self._escribir(entrada)
+            if avisar and self.al_subir and entrada.get("slug"):
+                self.al_subir(entrada)
+            os.remove(ruta)
+            os.remove(ruta + ".lock")
+        finally:
+            os.close(fd)
+        log.info("[Drive] %s subido (fileId=%s)", clave, entrada["file_id"])
+        return entrada["file_id"]
+
+    # --- API ---
+    def subir(self, path: str, filename: str, mimetype: str, folder_id: str = None, clave: str = None,
+              slug: str = None) -> str:
+        """Encola y sube en el hilo actual. Si falla, la entrada queda en el spool."""
+        clave = self.encolar(path, filename, mimetype, folder_id, clave, slug)
+        file_id = self.procesar(clave)
+        if file_id is None:
+            raise RuntimeError(f"La subida {clave} está en curso en otro proceso")
+        return file_id
+
+    def enviar(self, path: str, filename: str, mimetype: str, folder_id: str = None, clave: str = None):
+        """Encola y sube en el pool de hilos. Devuelve un Future con el fileId."""
+        clave = self.encolar(path, filename, mimetype, folder_id, clave)
+        # El hilo del pool hereda la traza del request (logs correlacionados)
+        return self._executor().submit(contextvars.copy_context().run, self.procesar, clave)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="drive")
+                    self._pid = os.getpid()
+        return self._pool
+
+    def reanudar_pendientes(self):
+        """Manda al pool todo lo que quedó en el spool (reinicios, Drive caído)."""
+        futuros = []
+        for clave in self.pendientes():
+            futuros.append(self._executor().submit(self._procesar_seguro, clave))
+        return futuros
+
+    def _procesar_seguro(self, clave: str):
+        try:
+            return self.procesar(clave, avisar=True)
+        except Exception as e:
+            log.warning("[Drive] %s sigue pendiente: %s", clave, e)
+            return None
+
+    def iniciar(self, intervalo: int = DRIVE_SPOOL_INTERVALO, al_subir=None):
+        """
+        Hilo que barre el spool periódicamente (una vez por proceso).
+        al_subir(entrada): aviso de cada subida que termina el barrido.
+        """
+        if al_subir is not None:
+            self.al_subir = al_subir
+        if self._barrido_pid == os.getpid():
+            return
+
+        def _bucle():
+            while True:
+                try:
+                    if drive_configurado():
+                        self.reanudar_pendientes()
+                except Exception:
+                    log.exception("[Drive] Falló el barrido del spool")
+                time.sleep(intervalo)
+
+        with self._barrido_lock:
+            if self._barrido_pid == os.getpid():
+                return
+            self._barrido_pid = os.getpid()
+            threading.Thread(target=_bucle, name="drive-spool", daemon=True).start()
+
+_MANAGER = None
+_MANAGER_LOCK = threading.Lock()
+
+def get_manager() -> UploadManager:
+    global _MANAGER
+    if _MANAGER is None:
+        with _MANAGER_LOCK:
+            if _MANAGER is None:
+                _MANAGER = UploadManager()
+    return _MANAGER
+
+def upload_path_to_drive(path: str, filename: str, mimetype: str, folder_id: str = None, clave: str = None,
+                         slug: str = None) -> str:
+    """
+    Sube un archivo del disco a la carpeta indicada (o a GOOGLE_DRIVE_FOLDER_ID). Devuelve fileId.
+    Pasa por el spool: subida por chunks reanudable e idempotente según `clave`; si falla
+    y el barrido la termina después, se avisa con el `slug` (UploadManager.al_subir).
+    """
+    if not (os.getenv("GOOGLE_APPLICATION_CREDENTIALS") and (folder_id or os.getenv("GOOGLE_DRIVE_FOLDER_ID"))):
+        raise DriveNoConfigurado("Faltan GOOGLE_APPLICATION_CREDENTIALS o GOOGLE_DRIVE_FOLDER_ID")
+    return get_manager().subir(path, filename, mimetype, folder_id, clave, slug)
 
 def upload_bytes_to_drive(data: bytes, filename: str, mimetype: str, folder_id: str = None) -> str:
     """Sube bytes (BytesIO) como archivo a Drive. Devuelve fileId."""
+    from googleapiclient.http import MediaIoBaseUpload
+
     folder_id = folder_id or os.getenv("GOOGLE_DRIVE_FOLDER_ID")
     meta = {"name": filename, "parents": [folder_id]}
     media = MediaIoBaseUpload(io.BytesIO(data), mimetype=mimetype, resumable=True)
@@ -36,3 +402,17 @@ def upload_bytes_to_drive(data: bytes, filename: str, mimetype: str, folder_id:
         body=meta, media_body=media, fields="id", supportsAllDrives=True
     ).execute()
     return created["id"]
+
+def download_path_from_drive(file_id: str, path: str) -> str:
+    """Descarga el archivo `file_id` de Drive a `path` (por chunks). Devuelve `path`."""
+    from googleapiclient.http import MediaIoBaseDownload
+
+    if not os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+        raise DriveNoConfigurado("Falta GOOGLE_APPLICATION_CREDENTIALS")
+    req = _get_drive().files().get_media(fileId=file_id, supportsAllDrives=True)
+    with open(path, "wb") as f:
+        descarga = MediaIoBaseDownload(f, req, chunksize=DRIVE_CHUNK_MB * 1024 * 1024)
+        listo = False
+        while not listo:
+            _, listo = descarga.next_chunk(num_retries=DRIVE_REINTENTOS)
+    return path
@@ -0,0 +1,344 @@
+# exportar_util.py
+"""
+Exportación de los contratos de un rango de fechas (para contaduría), en
+streaming: la salida se genera de a partes y la memoria no crece con la
+cantidad de contratos.
+
+- Los contratos salen del índice local (indice_util), página por página.
+- Cada archivo se toma del almacén de artefactos si sigue ahí o se baja de
+  Drive por fileId; las descargas van en paralelo (EXPORTAR_PARALELO) con una
+  ventana acotada, en el orden del índice, a un directorio temporal que se
+  borra a medida que se escribe cada archivo.
+- ZIP: zipfile sobre una salida no posicionable (descriptores de datos después
+  de cada archivo, sin volver atrás), archivos sin comprimir (PDF/DOCX ya lo
+  están) y un manifiesto.csv al final con el estado de cada contrato (se
+  arma en un temporal en disco).
+- PDF unido: cada PDF de origen se lee con pypdf y sus páginas (con los objetos
+  que referencian, renumerados) se escriben enseguida; solo quedan en memoria
+  los offsets para la tabla xref y la lista de páginas. Los contratos que
+  quedaron en DOCX (sin PDF) se omiten.
+"""
+import io
+import os
+import csv
+import uuid
+import shutil
+import logging
+import zipfile
+from array import array
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import artefactos_util
+import drive_util
+import indice_util
+
+# ==============================
+# Config desde variables de entorno
+# ==============================
+EXPORTAR_PARALELO = int(os.getenv("EXPORTAR_PARALELO", "4"))   # descargas de Drive simultáneas
+EXPORTAR_CHUNK    = 64 * 1024                                   # bytes por parte de la respuesta
+
+log = logging.getLogger(__name__)
+
+
+def nombre_archivo(nombre: str, dni: str, fecha_iso: str, ext: str) -> str:
+    """Nombre del contrato en Drive y en las exportaciones: aaaa-mm-dd_Nombre_DNI_Contrato.ext"""
+    safe_nombre = "".join(c for c in nombre if c.isalnum() or c in " _-").strip().replace(" ", "_")
+    return f"{fecha_iso}_{safe_nombre}_{dni}_Contrato{ext}"
+
+
+def contratos(desde: str, hasta: str):
+    """Contratos del índice con fecha en [desde, hasta] (aaaa-mm-dd), de a una página por consulta."""
+    indice = indice_util.get_indice()
+    cursor = None
+    while True:
+        filas, cursor = indice.buscar(desde=desde, hasta=hasta, limite=indice_util.INDICE_MAX_PAGINA,
+                                      cursor=cursor)
+        yield from filas
+        if cursor is None:
+            return
+
+
+def validar_rango(desde: str, hasta: str):
+    """Valida el rango antes de empezar a responder (después ya no hay código de error)."""
+    if not desde or not hasta:
+        raise indice_util.ConsultaInvalida("Faltan las fechas desde/hasta (aaaa-mm-dd)")
+    indice_util.get_indice().buscar(desde=desde, hasta=hasta, limite=1)
+    if desde > hasta:
+        raise indice_util.ConsultaInvalida("La fecha desde es posterior a hasta")
+
+
+# =========================================================
+# Archivos: almacén local o Drive, en paralelo y en orden
+# =========================================================
+def _obtener(contrato: dict, tmp_dir: str):
+    """(ruta, es_temporal) del archivo del contrato; None si no está ni local ni en Drive."""
+    if contrato["hash"]:
+        ruta = artefactos_util.get_almacen().ruta(contrato["hash"], contrato["ext"])
+        if os.path.exists(ruta):
+            return ruta, False
+    if not contrato["drive_id"]:
+        return None
+    ruta = os.path.join(tmp_dir, f"{contrato['slug']}{contrato['ext'] or '.pdf'}")
+    drive_util.download_path_from_drive(contrato["drive_id"], ruta)
+    return ruta, True
+
+
+def archivos(filas, paralelo: int = EXPORTAR_PARALELO):
+    """
+    (contrato, ruta | None, error | None) por cada contrato, en el orden de `filas`.
+    Hay a lo sumo `paralelo` descargas en curso; los temporales se borran cuando el
+    consumidor pide el siguiente.
+    """
+    almacen = artefactos_util.get_almacen()
+    clave = f"exportar_{uuid.uuid4().hex[:12]}"
+    tmp_dir = almacen.directorio_trabajo(clave)
+    pool = ThreadPoolExecutor(max_workers=max(1, paralelo), thread_name_prefix="exportar")
+    ventana = deque()
+    filas = iter(filas)
+    try:
+        while True:
+            while len(ventana) < max(1, paralelo):
+                fila = next(filas, None)
+                if fila is None:
+                    break
+                ventana.append((fila, pool.submit(_obtener, fila, tmp_dir)))
+            if not ventana:
+                return
+            fila, futuro = ventana.popleft()
+            try:
+                obtenido = futuro.result()
+            except Exception as e:
+                log.warning("[Exportar] %s: no se pudo bajar de Drive: %s", fila["slug"], e)
+                yield fila, None, str(e)
+                continue
+            if obtenido is None:
+                yield fila, None, "archivo no disponible"
+                continue
+            ruta, temporal = obtenido
+            try:
+                yield fila, ruta, None
+            finally:
+                if temporal:
+                    os.remove(ruta)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        almacen.liberar_trabajo(clave)
+
+
+class _Salida(io.RawIOBase):
+    """Destino de escritura que acumula bytes hasta que el generador los entrega."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._buf += b
+        return len(b)
+
+    def __len__(self):
+        return len(self._buf)
+
+    def truncar(self, n: int):
+        del self._buf[n:]
+
+    def vaciar(self) -> bytes:
+        data, self._buf = bytes(self._buf), bytearray()
+        return data
+
+
+# =========================================================
+# ZIP
+# =========================================================
+def zip_en_cadena(filas):
+    """Partes (bytes) de un ZIP con los contratos de `filas` y un manifiesto.csv."""
+    salida = _Salida()
+    manifiesto = tempfile.TemporaryFile("w+", encoding="utf-8-sig", newline="")
+    escritor = csv.writer(manifiesto)
+    escritor.writerow(["archivo", "fecha", "nombre", "dni", "email", "drive_id", "estado"])
+    usados = set()
+    with manifiesto, zipfile.ZipFile(salida, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for contrato, ruta, error in archivos(filas):
+            nombre = nombre_archivo(contrato["nombre"], contrato["dni"], contrato["fecha"],
+                                    os.path.splitext(ruta)[1] if ruta else contrato["ext"] or "")
+            base, ext = os.path.splitext(nombre)
+            n = 1
+            while nombre in usados:
+                n += 1
+                nombre = f"{base}_{n}{ext}"
+            usados.add(nombre)
+            escritor.writerow([nombre if ruta else "", contrato["fecha"], contrato["nombre"], contrato["dni"],
+                               contrato["email"], contrato["drive_id"] or "", error or "ok"])
+            if ruta is None:
+                continue
+            with open(ruta, "rb") as origen, zf.open(nombre, "w", force_zip64=True) as destino:
+                for bloque in iter(lambda: origen.read(EXPORTAR_CHUNK), b""):
+                    destino.write(bloque)
+                    if len(salida) >= EXPORTAR_CHUNK:
+                        yield salida.vaciar()
+            if len(salida) >= EXPORTAR_CHUNK:
+                yield salida.vaciar()
+        manifiesto.seek(0)
+        with zf.open("manifiesto.csv", "w", force_zip64=True) as destino:
+            shutil.copyfileobj(manifiesto.buffer, destino, EXPORTAR_CHUNK)
+    yield salida.vaciar()
+
+
+# =========================================================
+# PDF unido
+# =========================================================
+# Atributos que una página puede heredar del árbol /Pages de su documento
+_HEREDABLES = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+class _PdfUnido:
+    """
+    Escribe un PDF de a objetos. Los objetos de cada documento de origen se
+    renumeran al copiarlos; 1 es el catálogo y 2 el árbol de páginas, que se
+    escribe al final (cuando ya se conocen todas).
+    """
+
+    def __init__(self, salida: _Salida):
+        self.salida = salida
+        self.offsets = array("Q", [0, 0])   # por número de objeto - 1
+        self.paginas = array("Q")
+        self.posicion = 0
+        self._escribir_bytes(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self._escribir_objeto(1, self._dict({"/Type": self._nombre("/Catalog"),
+                                             "/Pages": self._ref(2)}))
+
+    @staticmethod
+    def _nombre(n):
+        from pypdf.generic import NameObject
+        return NameObject(n)
+
+    @staticmethod
+    def _ref(n):
+        from pypdf.generic import IndirectObject
+        return IndirectObject(n, 0, None)
+
+    @staticmethod
+    def _dict(d):
+        from pypdf.generic import DictionaryObject, NameObject
+        return DictionaryObject({NameObject(k): v for k, v in d.items()})
+
+    def _escribir_bytes(self, data: bytes):
+        self.salida.write(data)
+        self.posicion += len(data)
+
+    def _escribir_objeto(self, n: int, obj):
+        buf = io.BytesIO()
+        buf.write(f"{n} 0 obj\n".encode("ascii"))
+        obj.write_to_stream(buf)
+        buf.write(b"\nendobj\n")
+        self.offsets[n - 1] = self.posicion
+        self._escribir_bytes(buf.getvalue())
+
+    def _nuevo_numero(self) -> int:
+        self.offsets.append(0)
+        return len(self.offsets)
+
+    def agregar(self, ruta: str):
+        """Copia todas las páginas del PDF en `ruta`; si falla, la salida queda como antes."""
+        estado = (len(self.offsets), len(self.paginas), self.posicion, len(self.salida))
+        try:
+            self._agregar(ruta)
+        except Exception:
+            n_objetos, n_paginas, self.posicion, largo = estado
+            del self.offsets[n_objetos:], self.paginas[n_paginas:]
+            self.salida.truncar(largo)
+            raise
+
+    def _agregar(self, ruta: str):
+        from pypdf import PdfReader
+        from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+        lector = PdfReader(ruta)
+        try:
+            numeros = {}            # idnum en el origen -> número en la salida
+            pendientes = deque()
+
+            def numero(ref):
+                if ref.idnum not in numeros:
+                    numeros[ref.idnum] = self._nuevo_numero()
+                    pendientes.append(ref)
+                return numeros[ref.idnum]
+
+            def copiar(obj):
+                if isinstance(obj, IndirectObject):
+                    return self._ref(numero(obj))
+                if isinstance(obj, StreamObject):
+                    nuevo = StreamObject()
+                    nuevo.update({k: copiar(v) for k, v in obj.items() if k != "/Length"})
+                    nuevo._data = obj._data      # contenido tal cual (sigue con su /Filter)
+                    return nuevo
+                if isinstance(obj, DictionaryObject):
+                    return DictionaryObject({k: copiar(v) for k, v in obj.items()})
+                if isinstance(obj, ArrayObject):
+                    return ArrayObject(copiar(v) for v in obj)
+                return obj
+
+            # Las páginas se numeran primero: un link a otra página del mismo documento
+            # apunta a la copia, no arrastra el árbol /Pages de origen
+            paginas = list(lector.pages)
+            for pagina in paginas:
+                numeros[pagina.indirect_reference.idnum] = self._nuevo_numero()
+            for pagina in paginas:
+                copia = {k: v for k, v in pagina.items() if k != "/Parent"}
+                for clave in _HEREDABLES:
+                    nodo = pagina
+                    while clave not in copia and nodo is not None:
+                        if clave in nodo:
+                            copia[clave] = nodo.raw_get(clave)
+                        nodo = nodo.get("/Parent")
+                        nodo = nodo.get_object() if nodo is not None else None
+                copia = copiar(DictionaryObject(copia))
+                copia[self._nombre("/Parent")] = self._ref(2)
+                n = numeros[pagina.indirect_reference.idnum]
+                self._escribir_objeto(n, copia)
+                self.paginas.append(n)
+                while pendientes:
+                    ref = pendientes.popleft()
+                    self._escribir_objeto(numeros[ref.idnum], copiar(ref.get_object()))
+        finally:
+            # Libera el archivo leído y la caché de objetos (el lector tiene ciclos: sin
+            # esto la memoria queda esperando al GC y el pico crece con cada PDF)
+            lector.close()
+
+    def cerrar(self):
+        """Árbol de páginas, tabla xref y trailer (escritos de a tandas: pueden ser miles)."""
+        self.offsets[1] = self.posicion
+        self._escribir_bytes(f"2 0 obj\n<< /Type /Pages /Count {len(self.paginas)} /Kids [".encode("ascii"))
+        for i in range(0, len(self.paginas), 1024):
+            self._escribir_bytes("".join(f"{n} 0 R " for n in self.paginas[i:i + 1024]).encode("ascii"))
+        self._escribir_bytes(b"] >>\nendobj\n")
+        xref = self.posicion
+        self._escribir_bytes(f"xref\n0 {len(self.offsets) + 1}\n0000000000 65535 f \n".encode("ascii"))
+        for i in range(0, len(self.offsets), 1024):
+            self._escribir_bytes("".join(f"{off:010d} 00000 n \n" for off in self.offsets[i:i + 1024])
+                                 .encode("ascii"))
+        self._escribir_bytes(f"trailer\n<< /Size {len(self.offsets) + 1} /Root 1 0 R >>\n"
+                             f"startxref\n{xref}\n%%EOF\n".encode("ascii"))
+
+
+def pdf_en_cadena(filas):
+    """Partes (bytes) de un único PDF con todas las páginas de los contratos en PDF de `filas`."""
+    salida = _Salida()
+    pdf = _PdfUnido(salida)
+    for contrato, ruta, error in archivos(f for f in filas if f["ext"] == ".pdf"):
+        if ruta is None:
+            log.warning("[Exportar] %s omitido del PDF: %s", contrato["slug"], error)
+            continue
+        try:
+            pdf.agregar(ruta)
+        except Exception:
+            log.exception("[Exportar] %s: PDF ilegible, se omite", contrato["slug"])
+        if len(salida) >= EXPORTAR_CHUNK:
+            yield salida.vaciar()
+    pdf.cerrar()
+    yield salida.vaciar()
@@ -0,0 +1,103 @@
+# firma_util.py
+"""
+Ingesta de la firma del cliente (canvas -> PNG listo para el DOCX).
+
+- Controla el tamaño del base64 antes de decodificar y los píxeles del PNG
+  antes de descomprimirlo (solo se lee el encabezado).
+- Recorta al área con tinta y reduce a la resolución que realmente se imprime
+  (ancho en pulgadas x FIRMA_DPI).
+- Devuelve los bytes del PNG final; el DOCX los recibe en un BytesIO, sin archivo temporal.
+"""
+import io
+import os
+import base64
+import binascii
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PIL import Image   # Pillow se importa en la primera firma, no al arrancar
+
+# ==============================
+# Config desde variables de entorno
+# ==============================
+FIRMA_MAX_BYTES  = int(os.getenv("FIRMA_MAX_BYTES", str(2 * 1024 * 1024)))  # imagen decodificada
+FIRMA_MAX_PIXELS = int(os.getenv("FIRMA_MAX_PIXELS", str(6_000_000)))       # ancho x alto del canvas
+FIRMA_DPI        = int(os.getenv("FIRMA_DPI", "200"))                       # resolución impresa
+
+_MARGEN_PX = 8          # aire alrededor del trazo recortado
+_UMBRAL_TINTA = 24      # 0..255: por debajo se considera fondo
+
+
+class FirmaInvalida(ValueError):
+    """La firma no se puede usar (vacía, corrupta o fuera de los límites)."""
+
+
+def decodificar_b64(b64data: str, max_bytes: int = FIRMA_MAX_BYTES) -> bytes:
+    """Decodifica `data:image/...;base64,...` rechazando payloads grandes antes de decodificar."""
+    if "," in b64data[:100]:
+        b64data = b64data.split(",", 1)[1]
+    # 4 caracteres base64 = 3 bytes: se descarta sin asignar memoria para el decodificado
+    if len(b64data) > (max_bytes * 4) // 3 + 4:
+        raise FirmaInvalida("La firma supera el tamaño máximo permitido.")
+    try:
+        return base64.b64decode(b64data)
+    except (binascii.Error, ValueError):
+        raise FirmaInvalida("La firma no es base64 válido.")
+
+
+def _bbox_tinta(img: "Image.Image"):
+    """Caja del trazo: por alfa si hay transparencia; si no, por oscuridad sobre fondo claro."""
+    from PIL import ImageOps
+
+    alfa = img.getchannel("A")
+    if alfa.getextrema()[0] < 255:
+        return alfa.point(lambda v: 255 if v > _UMBRAL_TINTA else 0).getbbox()
+    oscuro = ImageOps.invert(img.convert("L"))
+    return oscuro.point(lambda v: 255 if v > _UMBRAL_TINTA else 0).getbbox()
+
+
+def preparar_firma(b64data: str, ancho_in: float, dpi: int = FIRMA_DPI,
+                   max_bytes: int = FIRMA_MAX_BYTES, max_pixels: int = FIRMA_MAX_PIXELS) -> bytes:
+    """
+    base64 del canvas -> PNG RGBA recortado y escalado a `ancho_in` pulgadas a `dpi`.
+    Levanta FirmaInvalida si algo no cumple.
+    """
+    return preparar_firma_bytes(decodificar_b64(b64data, max_bytes), ancho_in, dpi, max_bytes, max_pixels)
+
+
+def preparar_firma_bytes(raw: bytes, ancho_in: float, dpi: int = FIRMA_DPI,
+                         max_bytes: int = FIRMA_MAX_BYTES, max_pixels: int = FIRMA_MAX_PIXELS) -> bytes:
+    """Igual que preparar_firma, a partir de la imagen ya decodificada (PNG/JPEG)."""
+    from PIL import Image
+
+    if len(raw) > max_bytes:
+        raise FirmaInvalida("La firma supera el tamaño máximo permitido.")
+    try:
+        img = Image.open(io.BytesIO(raw))   # perezoso: todavía no descomprime
+    except Exception:
+        raise FirmaInvalida("La imagen de la firma es inválida.")
+    if img.width * img.height > max_pixels:
+        raise FirmaInvalida("La firma supera la resolución máxima permitida.")
+
+    try:
+        img = img.convert("RGBA")
+    except Exception:
+        raise FirmaInvalida("La imagen de la firma es inválida.")
+    del raw
+
+    bbox = _bbox_tinta(img)
+    if bbox is None:
+        raise FirmaInvalida("La firma está vacía.")
+    x0, y0, x1, y1 = bbox
+    img = img.crop((max(0, x0 - _MARGEN_PX), max(0, y0 - _MARGEN_PX),
+                    min(img.width, x1 + _MARGEN_PX), min(img.height, y1 + _MARGEN_PX)))
+
+    ancho_px = max(1, int(ancho_in * dpi))
+    if img.width > ancho_px:
+        alto_px = max(1, round(img.height * ancho_px / img.width))
+        img = img.resize((ancho_px, alto_px), Image.LANCZOS)
+
+    out = io.BytesIO()
+    # compress_level bajo: optimize=True triplica el costo de la firma por ~5% menos de tamaño
+    img.save(out, "PNG", compress_level=3, dpi=(dpi, dpi))
+    return out.getvalue()
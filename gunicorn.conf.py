@@ -0,0 +1,149 @@
+# gunicorn.conf.py
+"""
+Config de producción de Gunicorn (Dockerfile: `gunicorn -c gunicorn.conf.py app:app`).
+
+Dimensionado (todo ajustable por variables de entorno):
+  - GUNICORN_WORKER_CLASS: "gthread" (por defecto) o "sync". Con gthread un
+    request lento (descarga grande, LibreOffice inline con JOBS_WORKERS=0) no
+    frena a los demás ni dispara el timeout del worker.
+  - WEB_CONCURRENCY / GUNICORN_WORKERS: por defecto CPUs / PDF_POOL_SIZE (mínimo 1).
+    Cada worker tiene su propio pool de LibreOffice y su cola de trabajos, así
+    el total de soffice queda cerca de la cantidad de CPUs. Con un solo worker,
+    reciclarlo deja la instancia sin atender hasta que arranca el reemplazo: si
+    sobra memoria, GUNICORN_WORKERS=2 evita ese hueco.
+  - GUNICORN_THREADS: hilos por worker (por defecto 4). Los requests son cortos:
+    el render/PDF/Drive/email corre en los hilos de trabajos_util.
+  - GUNICORN_TIMEOUT: PDF_QUEUE_WAIT + PDF_TIMEOUT + 30 s (una conversión
+    completa, esperando lugar en el pool, entra en el plazo).
+  - GUNICORN_MAX_REQUESTS (+ jitter del 10%): recicla workers para acotar la
+    memoria de lxml/Pillow y de las instancias de LibreOffice, que se
+    reinician con el worker. El jitter evita que se reciclen todos juntos.
+
+Métricas: /metrics suma las de todos los workers (METRICS_DIR, por defecto
+DATA_DIR/metricas; ver metricas_util). Cada worker vuelca sus series en
+post_fork/worker_exit y el master archiva las de los workers que salen.
+
+preload_app: la app y, en when_ready, python-docx, Pillow y la plantilla
+compilada se cargan una vez en el master y los workers los comparten
+copy-on-write (reportlab y googleapiclient se importan recién al usarlos, ver
+app.py); gc.freeze() en when_ready evita que el GC de cada
+worker toque (y copie) esas páginas. Lo que no sobrevive a un fork (cliente de
+Drive, conexiones SQLite, hilos, pool de LibreOffice) se crea en cada worker.
+
+Medido con benchmarks/gunicorn_memoria.py (1 CPU, 2 workers gthread x 4 hilos,
+PDF_POOL_SIZE=0, sin LibreOffice; PSS = memoria proporcional, RSS = residente):
+
+                      arranque   PSS total   RSS/worker   privada/worker   RSS master
+    sin preload_app     2.3 s      148 MB       82 MB          55 MB          26 MB
+    con preload_app     1.2 s       98 MB       65 MB           9 MB          84 MB
+
+Ojo: una señal TERM que llega mientras un worker todavía está en post_fork se
+pierde (Gunicorn instala sus handlers después); ese worker sale recién al
+vencer graceful_timeout.
+"""
+import gc
+import os
+import logging
+import threading
+
+log = logging.getLogger("gunicorn.error")
+
+
+def _cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))   # respeta los límites del contenedor
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+_PDF_POOL_SIZE = int(os.getenv("PDF_POOL_SIZE", "2"))
+_PDF_TIMEOUT = int(os.getenv("PDF_TIMEOUT", "60"))
+_PDF_QUEUE_WAIT = float(os.getenv("PDF_QUEUE_WAIT", "30"))
+
+# Antes de importar la app: metricas_util lee METRICS_DIR al cargarse
+os.environ.setdefault("METRICS_DIR", os.path.join(
+    os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")), "metricas"))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+if worker_class not in ("gthread", "sync"):
+    log.warning("GUNICORN_WORKER_CLASS=%s no soportado (pyuno/SQLite bloquean); se usa gthread", worker_class)
+    worker_class = "gthread"
+
+workers = int(os.getenv("GUNICORN_WORKERS") or os.getenv("WEB_CONCURRENCY")
+              or max(1, _cpus() // max(1, _PDF_POOL_SIZE)))
+threads = int(os.getenv("GUNICORN_THREADS", "4")) if worker_class == "gthread" else 1
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", str(int(_PDF_QUEUE_WAIT + _PDF_TIMEOUT + 30))))
+graceful_timeout = timeout
+keepalive = 5
+
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = max_requests // 10
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG") or None
+loglevel = os.getenv("GUNICORN_LOGLEVEL", "info")
+
+
+# ==============================
+# Hooks
+# ==============================
+def on_starting(server):
+    import metricas_util
+
+    metricas_util.limpiar_directorio()
+
+
+def when_ready(server):
+    if preload_app:
+        # python-docx/Pillow y la plantilla compilada se cargan en el master para que
+        # los workers los compartan; después, todo pasa a la generación permanente
+        if os.getenv("PRECALENTAR_CACHES", "1") == "1":
+            import app as app_mod
+            app_mod._precalentar_pipeline()
+        gc.freeze()
+    server.log.info("Gunicorn listo: %d workers %s x %d hilos, timeout %ds, max_requests %d",
+                    workers, worker_class, threads, timeout, max_requests)
+
+
+def post_fork(server, worker):
+    """
+    La vista previa ya viene con la app (heredada o de la caché en disco), así el
+    worker atiende GET / enseguida. La plantilla compilada (si no vino del master)
+    y el cliente de Drive se calientan en un hilo aparte; después arrancan los
+    hilos de la cola, que retoman los trabajos pendientes.
+    """
+    import app as app_mod
+    import drive_util
+    import metricas_util
+
+    metricas_util.iniciar_volcado()
+
+    def calentar():
+        if os.getenv("PRECALENTAR_CACHES", "1") == "1":
+            app_mod._precalentar_pipeline()
+        drive_util.precalentar()
+
+    threading.Thread(target=calentar, name="precalentar", daemon=True).start()
+    app_mod._arrancar_workers()
+
+
+def worker_exit(server, worker):
+    # Reciclado/parada: los trabajos en curso terminan antes de que el worker salga
+    import app as app_mod
+
+    import metricas_util
+
+    if not app_mod._get_cola().detener(espera=graceful_timeout * 0.8):
+        server.log.warning("Worker %s salió con trabajos en curso (se retoman al vencer el lease)", worker.pid)
+    metricas_util.guardar_proceso()
+
+
+def child_exit(server, worker):
+    # En el master: el último volcado del worker pasa a acumulado.json
+    import metricas_util
+
+    metricas_util.archivar_proceso(worker.pid)
@@ -0,0 +1,254 @@
+# indice_util.py
+"""
+Índice local (SQLite + FTS5) de los contratos generados.
+
+Una fila por contrato (clave = slug del trabajo) con los datos del cliente,
+la fecha, el fileId de Drive, los messageId de Brevo y el hash del archivo
+final en el almacén de artefactos. La escribe la última etapa del pipeline
+(ver app._etapa_indice), así una consulta de soporte o un reenvío no depende
+de buscar en Drive por nombre de archivo.
+
+Búsqueda (`buscar`):
+  - dni: exacto (solo dígitos), por ix_contratos_dni.
+  - texto: nombre, email o domicilios por FTS5 (prefijos, sin acentos). Si el
+    SQLite no trae FTS5 se cae a LIKE sobre nombre/email.
+  - desde/hasta: rango de fechas del contrato (aaaa-mm-dd), por ix_contratos_fecha.
+  - Paginación por cursor (fecha, id) descendente: cada página cuesta lo mismo
+    sin importar cuántas se saltearon.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+# ==============================
+# Config desde variables de entorno
+# ==============================
+BASE_DIR      = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR      = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "data"))
+INDICE_DB     = os.getenv("INDICE_DB", os.path.join(DATA_DIR, "indice.sqlite3"))
+INDICE_PAGINA = 50     # filas por página por defecto
+INDICE_MAX_PAGINA = 200
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contratos (
+    id                   INTEGER PRIMARY KEY,
+    slug                 TEXT NOT NULL UNIQUE,
+    nombre               TEXT NOT NULL,
+    dni                  TEXT NOT NULL,
+    email                TEXT NOT NULL,
+    ubicacion            TEXT NOT NULL,
+    ubicacion_monitoreo  TEXT NOT NULL,
+    fecha                TEXT NOT NULL,
+    creado               REAL NOT NULL,
+    actualizado          REAL NOT NULL,
+    drive_id             TEXT,
+    mensajes             TEXT NOT NULL DEFAULT '[]',
+    hash                 TEXT,
+    ext                  TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_contratos_dni ON contratos (dni, fecha);
+CREATE INDEX IF NOT EXISTS ix_contratos_fecha ON contratos (fecha, id);
+"""
+
+# Índice de texto sobre la tabla (content=): los triggers lo mantienen al día
+_SCHEMA_FTS = """
+CREATE VIRTUAL TABLE IF NOT EXISTS contratos_fts USING fts5(
+    nombre, email, ubicacion, ubicacion_monitoreo,
+    content='contratos', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS contratos_ai AFTER INSERT ON contratos BEGIN
+    INSERT INTO contratos_fts (rowid, nombre, email, ubicacion, ubicacion_monitoreo)
+    VALUES (new.id, new.nombre, new.email, new.ubicacion, new.ubicacion_monitoreo);
+END;
+CREATE TRIGGER IF NOT EXISTS contratos_ad AFTER DELETE ON contratos BEGIN
+    INSERT INTO contratos_fts (contratos_fts, rowid, nombre, email, ubicacion, ubicacion_monitoreo)
+    VALUES ('delete', old.id, old.nombre, old.email, old.ubicacion, old.ubicacion_monitoreo);
+END;
+CREATE TRIGGER IF NOT EXISTS contratos_au AFTER UPDATE OF nombre, email, ubicacion, ubicacion_monitoreo
+ON contratos BEGIN
+    INSERT INTO contratos_fts (contratos_fts, rowid, nombre, email, ubicacion, ubicacion_monitoreo)
+    VALUES ('delete', old.id, old.nombre, old.email, old.ubicacion, old.ubicacion_monitoreo);
+    INSERT INTO contratos_fts (rowid, nombre, email, ubicacion, ubicacion_monitoreo)
+    VALUES (new.id, new.nombre, new.email, new.ubicacion, new.ubicacion_monitoreo);
+END;
+"""
+
+_COLUMNAS = ("slug", "nombre", "dni", "email", "ubicacion", "ubicacion_monitoreo",
+             "fecha", "creado", "drive_id", "mensajes", "hash", "ext")
+_FECHA_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_CURSOR_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})\.(\d+)$")
+
+
+class ConsultaInvalida(ValueError):
+    """Parámetros de búsqueda mal formados (el endpoint responde 400)."""
+
+
+def _fecha_iso(fecha: str) -> str:
+    """dd/mm/aaaa (formato de los trabajos) o aaaa-mm-dd -> aaaa-mm-dd; ValueError si no es una fecha real."""
+    formato = "%Y-%m-%d" if _FECHA_RE.match(fecha or "") else "%d/%m/%Y"
+    return datetime.strptime(fecha, formato).strftime("%Y-%m-%d")
+
+
+def _consulta_fts(texto: str) -> str:
+    """Texto libre -> consulta FTS5: cada palabra como prefijo entre comillas (sin operadores)."""
+    palabras = re.findall(r"\w+", texto, flags=re.UNICODE)
+    return " ".join(f'"{p}"*' for p in palabras)
+
+
+def _hash_de(ruta: str):
+    """(hash, ext) de una ruta del almacén de artefactos (objetos/ab/<sha256>.<ext>)."""
+    if not ruta:
+        return None, None
+    digest, ext = os.path.splitext(os.path.basename(ruta))
+    return digest, ext.lower()
+
+
+class IndiceContratos:
+    def __init__(self, db_path: str = INDICE_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._conn() as c:
+            c.executescript(_SCHEMA)
+            try:
+                c.executescript(_SCHEMA_FTS)
+                self.fts = True
+            except sqlite3.OperationalError:
+                log.warning("[Indice] SQLite sin FTS5: la búsqueda por texto usa LIKE")
+                self.fts = False
+
+    # --- SQLite (una conexión por hilo) ---
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None or getattr(self._local, "pid", None) != os.getpid():
+            c = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            c.row_factory = sqlite3.Row
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = c, os.getpid()
+        return c
+
+    # --- escritura ---
+    def registrar(self, datos: dict, resultado: dict, creado: float = None):
+        """
+        Alta (o actualización, mismo slug) del contrato de un trabajo.
+          - datos: los del trabajo (slug, nombre, dni, email, ubicacion, ubicacion_monitoreo, fecha)
+          - resultado: el acumulado del pipeline (archivo, drive_id, email_cliente, email_empresa)
+        """
+        digest, ext = _hash_de(resultado.get("archivo"))
+        mensajes = [resultado[k] for k in ("email_cliente", "email_empresa") if resultado.get(k)]
+        ahora = time.time()
+        self._conn().execute(
+            "INSERT INTO contratos (slug, nombre, dni, email, ubicacion, ubicacion_monitoreo, "
+            "fecha, creado, actualizado, drive_id, mensajes, hash, ext) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(slug) DO UPDATE SET drive_id = COALESCE(excluded.drive_id, drive_id), "
+            "mensajes = CASE excluded.mensajes WHEN '[]' THEN mensajes ELSE excluded.mensajes END, "
+            "hash = COALESCE(excluded.hash, hash), ext = COALESCE(excluded.ext, ext), "
+            "actualizado = excluded.actualizado",
+            (datos["slug"], datos["nombre"], re.sub(r"\D", "", datos["dni"]),
+             datos["email"].lower(), datos["ubicacion"], datos["ubicacion_monitoreo"],
+             _fecha_iso(datos["fecha"]), creado or ahora, ahora, resultado.get("drive_id"),
+             json.dumps(mensajes), digest, ext),
+        )
+
+    def asignar_drive(self, slug: str, drive_id: str):
+        """fileId de Drive de un contrato subido después de indexarlo (barrido del spool)."""
+        self._conn().execute("UPDATE contratos SET drive_id = ?, actualizado = ? WHERE slug = ?",
+                             (drive_id, time.time(), slug))
+
+    def agregar_mensaje(self, slug: str, message_id: str):
+        """Suma el messageId de un reenvío a los del contrato."""
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute("SELECT mensajes FROM contratos WHERE slug = ?", (slug,)).fetchone()
+            if row is not None:
+                mensajes = json.loads(row["mensajes"]) + [message_id]
+                c.execute("UPDATE contratos SET mensajes = ?, actualizado = ? WHERE slug = ?",
+                          (json.dumps(mensajes), time.time(), slug))
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    # --- lectura ---
+    @staticmethod
+    def _fila(row) -> dict:
+        d = {k: row[k] for k in _COLUMNAS}
+        d["mensajes"] = json.loads(d["mensajes"])
+        return d
+
+    def obtener(self, slug: str):
+        row = self._conn().execute("SELECT * FROM contratos WHERE slug = ?", (slug,)).fetchone()
+        return self._fila(row) if row else None
+
+    def buscar(self, dni: str = None, texto: str = None, desde: str = None, hasta: str = None,
+               limite: int = INDICE_PAGINA, cursor: str = None):
+        """
+        Contratos que cumplen todos los filtros dados, del más reciente al más viejo.
+        Return: (filas, cursor de la página siguiente o None)
+        """
+        where, params = [], []
+        if dni:
+            dni = re.sub(r"\D", "", dni)
+            if not dni:
+                raise ConsultaInvalida("DNI inválido")
+            where.append("c.dni = ?")
+            params.append(dni)
+        for valor, op in ((desde, ">="), (hasta, "<=")):
+            if valor:
+                if not _FECHA_RE.match(valor):
+                    raise ConsultaInvalida(f"Fecha inválida (aaaa-mm-dd): {valor}")
+                where.append(f"c.fecha {op} ?")
+                params.append(valor)
+        desde_tabla = "contratos c"
+        if texto and texto.strip():
+            if self.fts:
+                consulta = _consulta_fts(texto)
+                if not consulta:
+                    raise ConsultaInvalida("Texto de búsqueda vacío")
+                desde_tabla = "contratos_fts f JOIN contratos c ON c.id = f.rowid"
+                where.append("contratos_fts MATCH ?")
+                params.append(consulta)
+            else:
+                where.append("(c.nombre LIKE ? OR c.email LIKE ?)")
+                params += [f"%{texto.strip()}%"] * 2
+        if cursor:
+            m = _CURSOR_RE.match(cursor)
+            if not m:
+                raise ConsultaInvalida("Cursor inválido")
+            where.append("(c.fecha < ? OR (c.fecha = ? AND c.id < ?))")
+            params += [m.group(1), m.group(1), int(m.group(2))]
+        limite = max(1, min(int(limite), INDICE_MAX_PAGINA))
+
+        sql = f"SELECT c.* FROM {desde_tabla}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY c.fecha DESC, c.id DESC LIMIT ?"
+        rows = self._conn().execute(sql, (*params, limite + 1)).fetchall()
+        siguiente = None
+        if len(rows) > limite:
+            rows = rows[:limite]
+            siguiente = f"{rows[-1]['fecha']}.{rows[-1]['id']}"
+        return [self._fila(r) for r in rows], siguiente
+
+
+_INDICE = None
+_INDICE_LOCK = threading.Lock()
+
+
+def get_indice() -> IndiceContratos:
+    global _INDICE
+    if _INDICE is None:
+        with _INDICE_LOCK:
+            if _INDICE is None:
+                _INDICE = IndiceContratos()
+    return _INDICE
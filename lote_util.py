@@ -0,0 +1,163 @@
+# lote_util.py
+"""
+Generación de contratos en lote (migraciones / renovaciones masivas).
+
+- Lee filas de un CSV o JSONL de forma perezosa (no carga el archivo entero).
+- Campos: nombre, dni, email, ubicacion, ubicacion_monitoreo, y opcionalmente
+  `firma` (data URL / base64, o ruta a una imagen si se permite) y `fecha`
+  (dd/mm/aaaa o aaaa-mm-dd; tiene que ser una fecha real).
+- Completa cada DOCX con el mismo render que /generar, con concurrencia acotada,
+  y convierte a PDF de a LOTE_TAMANO archivos por vez (pdf_util.convertir_lote).
+- Devuelve un generador de filas del manifiesto: el progreso sale a medida que
+  se procesa cada tanda.
+"""
+import os
+import re
+import csv
+import json
+import itertools
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import firma_util
+import pdf_util
+
+LOTE_TAMANO      = int(os.getenv("LOTE_TAMANO", "20"))        # DOCX por conversión a PDF
+LOTE_CONCURRENCIA = int(os.getenv("LOTE_CONCURRENCIA", "4"))  # renders en paralelo
+
+CAMPOS = ("nombre", "dni", "email", "ubicacion", "ubicacion_monitoreo")
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+class LoteInvalido(ValueError):
+    """El archivo del lote no se puede leer."""
+
+
+def leer_filas(stream, formato: str):
+    """
+    Itera las filas de un stream de texto.
+      - formato: "csv" o "jsonl"
+    """
+    if formato == "csv":
+        yield from csv.DictReader(stream)
+    elif formato == "jsonl":
+        for n, linea in enumerate(stream, 1):
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                yield json.loads(linea)
+            except ValueError:
+                raise LoteInvalido(f"Línea {n}: JSON inválido")
+    else:
+        raise LoteInvalido(f"Formato desconocido: {formato}")
+
+
+def formato_de(nombre_archivo: str) -> str:
+    return "jsonl" if nombre_archivo.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def _fecha_lote(valor: str) -> str:
+    """dd/mm/aaaa o aaaa-mm-dd -> dd/mm/aaaa (formato de los trabajos); ValueError si no es una fecha real."""
+    for formato in ("%d/%m/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(valor, formato).strftime("%d/%m/%Y")
+        except ValueError:
+            pass
+    raise ValueError(f"Fecha inválida (dd/mm/aaaa o aaaa-mm-dd): {valor}")
+
+
+def _slug_lote(n: int, datos: dict, slugify) -> str:
+    # Del DNI solo los dígitos: el valor viene del archivo y termina en una ruta
+    dni = re.sub(r"\D", "", datos["dni"])
+    return f"{n:05d}_{slugify(datos['nombre'])}_{dni}"
+
+
+class GeneradorLote:
+    """
+    - render(datos, firma_png, out_docx): el mismo que usa el pipeline de /generar
+    - slugify(str) -> str
+    - firmas_dir: si se indica, `firma` puede ser una ruta relativa a ese directorio
+    - render_pdf(datos, firma_png, out_pdf) -> bool: backend PDF directo (opcional);
+      lo que no resuelve pasa por la conversión por tandas
+    - al_generar(datos, item) -> dict | None: por cada fila ok, con el archivo final ya
+      resuelto (p. ej. para guardarlo en el almacén e indexarlo); lo que devuelve se suma al item
+    """
+
+    def __init__(self, render, slugify, out_dir: str, ancho_firma_in: float,
+                 firmas_dir: str = None, tamano: int = LOTE_TAMANO, concurrencia: int = LOTE_CONCURRENCIA,
+                 render_pdf=None, al_generar=None):
+        self.render = render
+        self.render_pdf = render_pdf
+        self.al_generar = al_generar
+        self.slugify = slugify
+        self.out_dir = out_dir
+        self.ancho_firma_in = ancho_firma_in
+        self.firmas_dir = firmas_dir
+        self.tamano = max(1, tamano)
+        self.concurrencia = max(1, concurrencia)
+        os.makedirs(out_dir, exist_ok=True)
+
+    # --- una fila ---
+    def _firma(self, valor: str):
+        valor = (valor or "").strip()
+        if not valor:
+            return None
+        if self.firmas_dir and not valor.startswith("data:") and len(valor) < 1024:
+            ruta = os.path.realpath(os.path.join(self.firmas_dir, valor))
+            if not ruta.startswith(os.path.realpath(self.firmas_dir) + os.sep):
+                raise firma_util.FirmaInvalida("Ruta de firma fuera del directorio permitido.")
+            with open(ruta, "rb") as f:
+                return firma_util.preparar_firma_bytes(f.read(), self.ancho_firma_in)
+        return firma_util.preparar_firma(valor, self.ancho_firma_in)
+
+    def _render_fila(self, n: int, fila: dict):
+        """Return: (entrada del manifiesto, datos normalizados o None si la fila falló)"""
+        if not isinstance(fila, dict):
+            # JSONL con un valor que no es objeto (lista, número, string...)
+            return {"fila": n, "nombre": "", "dni": "", "email": "", "estado": "error",
+                    "error": "La fila no es un objeto JSON"}, None
+        datos = {k: str(fila.get(k) or "").strip() for k in CAMPOS}
+        datos["email"] = datos["email"].lower()
+        item = {"fila": n, "nombre": datos["nombre"], "dni": datos["dni"], "email": datos["email"]}
+        fecha = str(fila.get("fecha") or "").strip()
+        try:
+            datos["fecha"] = _fecha_lote(fecha) if fecha else datetime.now().strftime("%d/%m/%Y")
+        except ValueError as e:
+            return dict(item, estado="error", error=str(e)), None
+
+        faltantes = [k for k in CAMPOS if not datos[k]]
+        if faltantes:
+            return dict(item, estado="error", error=f"Faltan campos: {', '.join(faltantes)}"), None
+        if not _EMAIL_RE.match(datos["email"]):
+            return dict(item, estado="error", error="Email inválido"), None
+        try:
+            firma_png = self._firma(fila.get("firma"))
+            base = os.path.join(self.out_dir, _slug_lote(n, datos, self.slugify))
+            self.render(datos, firma_png, base + ".docx")
+        except Exception as e:
+            return dict(item, estado="error", error=str(e)), None
+        pdf = None
+        if self.render_pdf is not None and self.render_pdf(datos, firma_png, base + ".pdf"):
+            pdf = base + ".pdf"
+        return dict(item, estado="ok", docx=base + ".docx", pdf=pdf), datos
+
+    # --- lote ---
+    def procesar(self, filas):
+        """Generador: una entrada del manifiesto por fila, tanda por tanda."""
+        numeradas = enumerate(filas, 1)
+        with ThreadPoolExecutor(max_workers=self.concurrencia, thread_name_prefix="lote") as ex:
+            while True:
+                tanda = list(itertools.islice(numeradas, self.tamano))
+                if not tanda:
+                    break
+                resultados = list(ex.map(lambda nf: self._render_fila(*nf), tanda))
+                docxs = [it["docx"] for it, _ in resultados if it["estado"] == "ok" and it["pdf"] is None]
+                pdfs = pdf_util.convertir_lote(docxs, self.out_dir) if docxs else {}
+                for it, datos in resultados:
+                    if it["estado"] == "ok":
+                        if it["pdf"] is None:
+                            it["pdf"] = pdfs.get(it["docx"])
+                        if self.al_generar is not None:
+                            it.update(self.al_generar(datos, it) or {})
+                    yield it
@@ -0,0 +1,472 @@
+# metricas_util.py
+"""
+Instrumentación del pipeline de contratos.
+
+- Histogramas y contadores en memoria, expuestos en formato texto de Prometheus
+  (GET /metrics). Sin METRICS_DIR (servidor de desarrollo) cada proceso expone
+  sus propias series (etiqueta `pid`). Con METRICS_DIR (Gunicorn lo fija, ver
+  gunicorn.conf.py) cada worker vuelca sus series a METRICS_DIR/<pid>.json cada
+  METRICS_FLUSH_S y el worker que atiende el scrape suma los archivos de todos:
+  /metrics devuelve lo mismo sin importar a qué worker llegue. Cuando un worker
+  sale, el master pasa su archivo a acumulado.json para que los contadores no
+  retrocedan al reciclarlo.
+- Traza por request: un id en un ContextVar que se agrega a todas las líneas de
+  log (`%(traza)s`) y viaja con el trabajo a los hilos de la cola.
+- Perfilador por muestreo opcional (PROFILE_SLOW_MS): muestrea la pila del hilo
+  mientras dura un request/trabajo y, si tardó más del umbral, guarda las pilas
+  "plegadas" (formato de flamegraph.pl / speedscope) en DATA_DIR/perfiles.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import fcntl
+import bisect
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+# ==============================
+# Config desde variables de entorno
+# ==============================
+BASE_DIR          = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR          = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "data"))
+PROFILE_SLOW_MS   = int(os.getenv("PROFILE_SLOW_MS", "0"))           # 0 = perfilador apagado
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))   # período de muestreo
+PROFILE_DIR       = os.getenv("PROFILE_DIR", os.path.join(DATA_DIR, "perfiles"))
+METRICS_DIR       = os.getenv("METRICS_DIR", "")                     # vacío = métricas por proceso
+METRICS_FLUSH_S   = float(os.getenv("METRICS_FLUSH_S", "5"))         # cada cuánto vuelca cada worker
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(traza)s] %(name)s: %(message)s"
+
+# Segundos: cubre desde el reemplazo de tags (~1 ms) hasta LibreOffice/Drive (decenas de s)
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+# ==============================
+# Métricas
+# ==============================
+def _etiquetas(nombres, valores: dict) -> tuple:
+    if set(valores) != set(nombres):
+        raise ValueError(f"Etiquetas esperadas {nombres}, recibidas {tuple(valores)}")
+    return tuple(str(valores[n]) for n in nombres)
+
+
+def _fmt_etiquetas(pares) -> str:
+    if not pares:
+        return ""
+    cuerpo = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                      for k, v in pares)
+    return "{" + cuerpo + "}"
+
+
+def _fmt_num(v) -> str:
+    return "+Inf" if v == float("inf") else repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+        REGISTRO.append(self)
+
+    def inc(self, n: float = 1, **etiquetas):
+        clave = _etiquetas(self.etiquetas, etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + n
+
+    def valor(self, **etiquetas) -> float:
+        return self._valores.get(_etiquetas(self.etiquetas, etiquetas), 0)
+
+    def _copia(self) -> dict:
+        with self._lock:
+            return dict(self._valores)
+
+    def _reiniciar(self):
+        with self._lock:
+            self._valores = {}
+
+    def _lineas(self, base, series: dict):
+        for clave, v in sorted(series.items()):
+            yield f"{self.nombre}{_fmt_etiquetas(base + list(zip(self.etiquetas, clave)))} {_fmt_num(v)}"
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # clave -> [cuentas por bucket..., suma, total]
+        self._lock = threading.Lock()
+        REGISTRO.append(self)
+
+    def observar(self, valor: float, **etiquetas):
+        clave = _etiquetas(self.etiquetas, etiquetas)
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            s = self._series.get(clave)
+            if s is None:
+                s = self._series[clave] = [0] * len(self.buckets) + [0.0, 0]
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += valor
+            s[-1] += 1
+
+    @contextmanager
+    def tiempo(self, **etiquetas):
+        """`with HIST.tiempo(etapa="pdf"):` observa la duración del bloque (también si falla)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - t0, **etiquetas)
+
+    def _copia(self) -> dict:
+        with self._lock:
+            return {k: list(v) for k, v in self._series.items()}
+
+    def _reiniciar(self):
+        with self._lock:
+            self._series = {}
+
+    def _lineas(self, base, series: dict):
+        for clave, s in sorted(series.items()):
+            pares = base + list(zip(self.etiquetas, clave))
+            acumulado = 0
+            for le, n in zip(self.buckets, s):
+                acumulado += n
+                yield f"{self.nombre}_bucket{_fmt_etiquetas(pares + [('le', _fmt_num(float(le)))])} {acumulado}"
+            yield f"{self.nombre}_bucket{_fmt_etiquetas(pares + [('le', '+Inf')])} {s[-1]}"
+            yield f"{self.nombre}_sum{_fmt_etiquetas(pares)} {_fmt_num(float(s[-2]))}"
+            yield f"{self.nombre}_count{_fmt_etiquetas(pares)} {s[-1]}"
+
+
+REGISTRO = []
+
+
+def _formatear(base, series: dict) -> str:
+    lineas = []
+    for m in REGISTRO:
+        lineas.append(f"# HELP {m.nombre} {m.ayuda}")
+        lineas.append(f"# TYPE {m.nombre} {m.tipo}")
+        lineas.extend(m._lineas(base, series.get(m.nombre, {})))
+    return "\n".join(lineas) + "\n"
+
+
+def exponer() -> str:
+    """
+    Métricas en formato de exposición de Prometheus (text/plain 0.0.4): las de
+    todos los workers sumadas si hay METRICS_DIR, si no las del proceso (con `pid`).
+    """
+    if not METRICS_DIR:
+        return _formatear([("pid", str(os.getpid()))], {m.nombre: m._copia() for m in REGISTRO})
+    guardar_proceso()   # las propias, al día; las de los demás tienen hasta METRICS_FLUSH_S
+    return _formatear([], _leer_directorio())
+
+
+# --- Agregado entre workers (METRICS_DIR) ---
+# Un archivo JSON por proceso: {métrica: [[etiquetas, valor], ...]}; el valor de
+# un histograma es la lista [cuentas por bucket..., suma, total]. Contadores e
+# histogramas se suman campo a campo. METRICS_DIR tiene que ser local a la
+# instancia (los pid se repiten entre contenedores).
+_ACUMULADO = "acumulado.json"
+_VOLCADO_PID = None
+
+
+def _sumar_series(destino: dict, origen: dict):
+    for clave, v in origen.items():
+        previo = destino.get(clave)
+        if previo is None:
+            destino[clave] = list(v) if isinstance(v, list) else v
+        elif isinstance(v, list):
+            destino[clave] = [a + b for a, b in zip(previo, v)]
+        else:
+            destino[clave] = previo + v
+
+
+def _sumar_volcado(total: dict, volcado: dict):
+    for nombre, filas in volcado.items():
+        _sumar_series(total.setdefault(nombre, {}), {tuple(clave): v for clave, v in filas})
+
+
+def _leer_volcado(ruta: str):
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _escribir_volcado(ruta: str, volcado: dict):
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(volcado, f)
+    os.replace(tmp, ruta)
+
+
+@contextmanager
+def _bloqueo(modo):
+    """Lee (LOCK_SH) o archiva (LOCK_EX): un scrape no ve a un worker dos veces ni ninguna."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, ".lock"), "a") as f:
+        fcntl.flock(f, modo)
+        yield
+
+
+def guardar_proceso():
+    """Vuelca las series de este proceso a METRICS_DIR/<pid>.json (escritura atómica)."""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    volcado = {m.nombre: [[list(k), v] for k, v in m._copia().items()] for m in REGISTRO}
+    _escribir_volcado(os.path.join(METRICS_DIR, f"{os.getpid()}.json"), volcado)
+
+
+def _leer_directorio() -> dict:
+    total = {}
+    with _bloqueo(fcntl.LOCK_SH):
+        for nombre in os.listdir(METRICS_DIR):
+            if nombre.endswith(".json"):
+                volcado = _leer_volcado(os.path.join(METRICS_DIR, nombre))
+                if volcado:
+                    _sumar_volcado(total, volcado)
+    return total
+
+
+def archivar_proceso(pid: int):
+    """(master, child_exit) Suma el último volcado del worker `pid` a acumulado.json y lo borra."""
+    if not METRICS_DIR:
+        return
+    ruta = os.path.join(METRICS_DIR, f"{pid}.json")
+    with _bloqueo(fcntl.LOCK_EX):
+        volcado = _leer_volcado(ruta)
+        if volcado:
+            acumulado = os.path.join(METRICS_DIR, _ACUMULADO)
+            total = {}
+            _sumar_volcado(total, _leer_volcado(acumulado) or {})
+            _sumar_volcado(total, volcado)
+            _escribir_volcado(acumulado, {n: [[list(k), v] for k, v in series.items()]
+                                          for n, series in total.items()})
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+def limpiar_directorio():
+    """(master, al arrancar) Borra los volcados de una corrida anterior."""
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    with _bloqueo(fcntl.LOCK_EX):
+        for nombre in os.listdir(METRICS_DIR):
+            if nombre.endswith((".json", ".tmp")):
+                os.remove(os.path.join(METRICS_DIR, nombre))
+
+
+def iniciar_volcado(intervalo: float = METRICS_FLUSH_S):
+    """
+    (worker, post_fork) Descarta lo heredado del master (si no, se sumaría una vez
+    por worker) y arranca el hilo que vuelca las series cada `intervalo` segundos.
+    """
+    global _VOLCADO_PID
+    if not METRICS_DIR or _VOLCADO_PID == os.getpid():
+        return
+    _VOLCADO_PID = os.getpid()
+    for m in REGISTRO:
+        m._reiniciar()
+
+    def bucle():
+        while True:
+            time.sleep(intervalo)
+            try:
+                guardar_proceso()
+            except OSError:
+                logging.getLogger(__name__).warning("[Metricas] No se pudo volcar a %s", METRICS_DIR,
+                                                    exc_info=True)
+
+    threading.Thread(target=bucle, name="metricas", daemon=True).start()
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- Métricas del pipeline ---
+HTTP_SEGUNDOS = Histograma(
+    "contratos_http_request_segundos", "Duración de los requests HTTP.", ("ruta", "metodo", "codigo"))
+ETAPA_SEGUNDOS = Histograma(
+    "contratos_etapa_segundos",
+    "Duración de cada paso del contrato (firma, plantilla, firmas, guardar_docx, pdf, drive_subida, email_envio).",
+    ("etapa",))
+TRABAJO_ETAPA_SEGUNDOS = Histograma(
+    "contratos_trabajo_etapa_segundos", "Duración de cada intento de etapa de la cola de trabajos.",
+    ("etapa", "resultado"))
+TRABAJOS_TOTAL = Contador(
+    "contratos_trabajos_total", "Trabajos terminados por estado final.", ("estado",))
+PDF_RESPALDO_DOCX = Contador(
+    "contratos_pdf_respaldo_docx_total", "Contratos entregados como DOCX porque falló la conversión a PDF.")
+DRIVE_FALLAS = Contador(
+    "contratos_drive_fallas_total", "Intentos de subida a Drive fallidos.")
+EMAIL_FALLAS = Contador(
+    "contratos_email_fallas_total", "Envíos de email fallidos (por destinatario).")
+ENVIOS_DUPLICADOS = Contador(
+    "contratos_envios_duplicados_total", "Envíos repetidos del formulario que devolvieron un trabajo existente.")
+ARTEFACTOS_BORRADOS = Contador(
+    "contratos_artefactos_borrados_total", "Archivos borrados del almacén de artefactos.", ("motivo",))
+ADMISION_RECHAZOS = Contador(
+    "contratos_admision_rechazos_total",
+    "Envíos rechazados por el control de admisión (tamano, ip, global, cola, cupo, almacen).", ("motivo",))
+ADMISION_EN_ESPERA = Contador(
+    "contratos_admision_en_espera_total", "Conversiones a PDF que tuvieron que esperar un lugar libre.")
+DRIVE_TOKENS = Contador(
+    "contratos_drive_tokens_total",
+    "Tokens de acceso de Drive obtenidos, por origen (google = refresco, cache = archivo compartido).",
+    ("origen",))
+DRIVE_API_SEGUNDOS = Histograma(
+    "contratos_drive_api_segundos",
+    "Duración de cada request HTTP a la API de Drive (resultado: ok, http_error, excepcion).",
+    ("resultado",))
+
+
+# ==============================
+# Traza por request
+# ==============================
+TRAZA = contextvars.ContextVar("traza", default="-")
+_TRAZA_VALIDA = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+def nueva_traza(valor: str = None) -> str:
+    """Fija la traza del contexto actual (usa la recibida si es válida, p. ej. X-Request-ID)."""
+    traza = valor if valor and _TRAZA_VALIDA.match(valor) else uuid.uuid4().hex[:16]
+    TRAZA.set(traza)
+    return traza
+
+
+def configurar_logging(nivel=logging.INFO):
+    """
+    Agrega `traza` a todos los LogRecord (de cualquier logger) y, si nadie configuró
+    el logging todavía, instala un handler con LOG_FORMAT.
+    """
+    fabrica = logging.getLogRecordFactory()
+    if getattr(fabrica, "_con_traza", False):
+        return
+
+    def _fabrica(*args, **kwargs):
+        record = fabrica(*args, **kwargs)
+        record.traza = TRAZA.get()
+        return record
+
+    _fabrica._con_traza = True
+    logging.setLogRecordFactory(_fabrica)
+    raiz = logging.getLogger()
+    if not raiz.handlers:
+        logging.basicConfig(level=nivel, format=LOG_FORMAT)
+
+
+# ==============================
+# Perfilador por muestreo
+# ==============================
+class Muestreador:
+    """
+    Un hilo que, cada PROFILE_INTERVAL_MS, toma la pila de los hilos registrados
+    (sys._current_frames) y cuenta las pilas plegadas "mod:func;mod:func;...".
+    El costo es proporcional a la cantidad de hilos perfilados, no al código.
+    """
+
+    def __init__(self, umbral_ms: int, intervalo_ms: float = PROFILE_INTERVAL_MS, salida: str = PROFILE_DIR):
+        self.umbral_ms = umbral_ms
+        self.intervalo = max(0.001, intervalo_ms / 1000.0)
+        self.salida = salida
+        self._activos = {}          # ident del hilo -> Counter de pilas
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._pid = None
+
+    def _iniciar_hilo(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._activos = {}
+            self._hilo = threading.Thread(target=self._bucle, name="perfilador", daemon=True)
+            self._hilo.start()
+
+    @staticmethod
+    def _plegar(frame) -> str:
+        pila = []
+        while frame is not None:
+            co = frame.f_code
+            pila.append(f"{os.path.basename(co.co_filename)}:{co.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(pila))
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.intervalo)
+            with self._lock:
+                if not self._activos:
+                    continue
+                frames = sys._current_frames()
+                for ident, pilas in self._activos.items():
+                    f = frames.get(ident)
+                    if f is not None:
+                        pilas[self._plegar(f)] += 1
+
+    def empezar(self):
+        self._iniciar_hilo()
+        ident = threading.get_ident()
+        with self._lock:
+            if ident in self._activos:
+                # Anidado (p. ej. trabajo inline dentro del request): lo cubre el de afuera
+                return ident, time.perf_counter(), False
+            self._activos[ident] = Counter()
+        return ident, time.perf_counter(), True
+
+    def terminar(self, token, nombre: str):
+        """Deja de muestrear el hilo; si superó el umbral, vuelca las pilas. Devuelve la ruta o None."""
+        ident, t0, propio = token
+        if not propio:
+            return None
+        ms = (time.perf_counter() - t0) * 1000
+        with self._lock:
+            pilas = self._activos.pop(ident, None)
+        if not pilas or ms < self.umbral_ms:
+            return None
+        os.makedirs(self.salida, exist_ok=True)
+        seguro = re.sub(r"[^A-Za-z0-9_-]+", "_", nombre).strip("_") or "request"
+        ruta = os.path.join(self.salida, f"{datetime.now():%Y%m%d_%H%M%S}_{seguro}_{TRAZA.get()}_{int(ms)}ms.folded")
+        with open(ruta, "w", encoding="utf-8") as f:
+            for pila, n in pilas.most_common():
+                f.write(f"{pila} {n}\n")
+        logging.getLogger(__name__).warning("[Perfil] %s tardó %d ms; pilas en %s", nombre, ms, ruta)
+        return ruta
+
+
+MUESTREADOR = Muestreador(PROFILE_SLOW_MS) if PROFILE_SLOW_MS > 0 else None
+
+
+@contextmanager
+def perfilar(nombre: str):
+    """Perfila el bloque si PROFILE_SLOW_MS está activo; si no, no hace nada."""
+    if MUESTREADOR is None:
+        yield
+        return
+    token = MUESTREADOR.empezar()
+    try:
+        yield
+    finally:
+        MUESTREADOR.terminar(token, nombre)
@@ -0,0 +1,367 @@
+# pdf_nativo_util.py
+"""
+Backend PDF nativo (sin LibreOffice) para el contrato estándar.
+
+- El layout se deriva de Contrato_Plantilla.docx una sola vez por proceso (y se
+  recalcula si cambia el mtime): tamaño de página y márgenes, párrafos con su
+  estilo resuelto (tamaño, negrita, color, alineación, espaciado, interlineado)
+  y runs agrupados por formato.
+- Lo estático queda cacheado: los párrafos sin tags guardan ya parseado su
+  markup (frags de reportlab) y la firma de la empresa se decodifica una vez.
+- Por contrato solo se arman los párrafos con `{{ tags }}` (mismo reemplazo que
+  plantilla_util) y se superponen las firmas en la tabla final.
+- Fuente: PDF_NATIVO_FUENTE (TTF regular; busca -Bold/-Italic/-BoldItalic al lado)
+  o, si no, Carlito (métricas de Calibri), Liberation Sans o DejaVu Sans; en
+  último caso Helvetica.
+"""
+import io
+import os
+import html
+import threading
+
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph as ParrafoDocx
+
+from reportlab import rl_config
+from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_LEFT, TA_RIGHT
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Flowable, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+import plantilla_util
+
+PDF_NATIVO_FUENTE = os.getenv("PDF_NATIVO_FUENTE", "")
+
+# Streams binarios: sin la extensión C, codificar imágenes en ASCII85 es lo más caro del render
+rl_config.useA85 = 0
+
+# Familias candidatas: (regular, negrita, cursiva, negrita cursiva)
+_FAMILIAS = [
+    ("/usr/share/fonts/truetype/crosextra/Carlito-Regular.ttf", "Carlito-Bold.ttf",
+     "Carlito-Italic.ttf", "Carlito-BoldItalic.ttf"),
+    ("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", "LiberationSans-Bold.ttf",
+     "LiberationSans-Italic.ttf", "LiberationSans-BoldItalic.ttf"),
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "DejaVuSans-Bold.ttf",
+     "DejaVuSans-Oblique.ttf", "DejaVuSans-BoldOblique.ttf"),
+]
+
+_ALINEACIONES = {
+    WD_ALIGN_PARAGRAPH.CENTER: TA_CENTER,
+    WD_ALIGN_PARAGRAPH.RIGHT: TA_RIGHT,
+    WD_ALIGN_PARAGRAPH.JUSTIFY: TA_JUSTIFY,
+}
+
+# Alto de una línea "simple" de Word en múltiplos del tamaño de fuente (ascender+descender+gap)
+_LINEA_SIMPLE = 1.22
+
+
+# ==============================
+# Fuentes
+# ==============================
+_FUENTE = None
+_FUENTE_LOCK = threading.Lock()
+
+
+def _variantes(regular: str, nombres=None):
+    base = os.path.dirname(regular)
+    if nombres is None:
+        raiz, ext = os.path.splitext(regular)
+        raiz = raiz[:-len("-Regular")] if raiz.endswith("-Regular") else raiz
+        return [regular] + [f"{raiz}-{s}{ext}" for s in ("Bold", "Italic", "BoldItalic")]
+    return [regular] + [os.path.join(base, n) for n in nombres]
+
+
+def fuente() -> str:
+    """Registra (una vez) la familia TTF disponible y devuelve su nombre para reportlab."""
+    global _FUENTE
+    if _FUENTE is not None:
+        return _FUENTE
+    with _FUENTE_LOCK:
+        if _FUENTE is not None:
+            return _FUENTE
+        candidatas = [_variantes(PDF_NATIVO_FUENTE)] if PDF_NATIVO_FUENTE else []
+        candidatas += [_variantes(f[0], f[1:]) for f in _FAMILIAS]
+        for regular, negrita, cursiva, ambas in candidatas:
+            if not os.path.exists(regular):
+                continue
+            nombre = os.path.splitext(os.path.basename(regular))[0]
+            rutas = {"": regular}
+            for sufijo, ruta in (("-B", negrita), ("-I", cursiva), ("-BI", ambas)):
+                # Si falta una variante se usa la más parecida disponible
+                rutas[sufijo] = ruta if os.path.exists(ruta) else (negrita if "B" in sufijo and os.path.exists(negrita) else regular)
+            for sufijo, ruta in rutas.items():
+                pdfmetrics.registerFont(TTFont(nombre + sufijo, ruta))
+            pdfmetrics.registerFontFamily(nombre, normal=nombre, bold=nombre + "-B",
+                                          italic=nombre + "-I", boldItalic=nombre + "-BI")
+            _FUENTE = nombre
+            return _FUENTE
+        _FUENTE = "Helvetica"   # Type 1 base: cubre Latin-1/WinAnsi (acentos, ñ, comillas)
+        return _FUENTE
+
+
+# ==============================
+# DOCX -> layout
+# ==============================
+def _cadena(estilo):
+    while estilo is not None:
+        yield estilo
+        estilo = estilo.base_style
+
+
+def _primero(valores, defecto=None):
+    for v in valores:
+        if v is not None:
+            return v
+    return defecto
+
+
+def _defaults(doc):
+    """Tamaño de fuente y espaciado de <w:docDefaults> (styles.xml)."""
+    raiz = doc.styles.element
+    sz = raiz.find(f"{qn('w:docDefaults')}/{qn('w:rPrDefault')}/{qn('w:rPr')}/{qn('w:sz')}")
+    spacing = raiz.find(f"{qn('w:docDefaults')}/{qn('w:pPrDefault')}/{qn('w:pPr')}/{qn('w:spacing')}")
+    tam = int(sz.get(qn("w:val"))) / 2 if sz is not None else 11.0
+    despues = int(spacing.get(qn("w:after"), 0)) / 20 if spacing is not None else 0.0
+    antes = int(spacing.get(qn("w:before"), 0)) / 20 if spacing is not None else 0.0
+    linea = 1.0
+    if spacing is not None and spacing.get(qn("w:lineRule"), "auto") == "auto" and spacing.get(qn("w:line")):
+        linea = int(spacing.get(qn("w:line"))) / 240
+    return tam, antes, despues, linea
+
+
+def _color(font):
+    try:
+        if font.color is not None and font.color.type is not None and font.color.rgb is not None:
+            return "#" + str(font.color.rgb)
+    except Exception:
+        pass
+    return None
+
+
+class _Bloque:
+    """Un párrafo del layout: estilo de reportlab + runs [(fmt, texto)]; frags si es estático."""
+
+    __slots__ = ("estilo", "runs", "frags", "vacio")
+
+    def __init__(self, estilo, runs):
+        self.estilo = estilo
+        self.runs = runs
+        self.vacio = not "".join(t for _, t in runs).strip()
+        self.frags = None
+
+
+def _markup(runs, tam_base: float) -> str:
+    partes = []
+    for (negrita, cursiva, subrayado, tam, color), texto in runs:
+        t = html.escape(texto.replace("\t", "    ")).replace("\n", "<br/>")
+        if not t:
+            continue
+        if subrayado:
+            t = f"<u>{t}</u>"
+        if cursiva:
+            t = f"<i>{t}</i>"
+        if negrita:
+            t = f"<b>{t}</b>"
+        attrs = []
+        if tam and abs(tam - tam_base) > 0.01:
+            attrs.append(f'size="{tam:g}"')
+        if color:
+            attrs.append(f'color="{color}"')
+        if attrs:
+            t = f"<font {' '.join(attrs)}>{t}</font>"
+        partes.append(t)
+    return "".join(partes)
+
+
+class _Imagen(Flowable):
+    """Imagen ya decodificada (ImageReader), escalada a un ancho fijo."""
+
+    def __init__(self, img: ImageReader, ancho: float):
+        super().__init__()
+        w, h = img.getSize()
+        self.img = img
+        self.width, self.height = ancho, ancho * h / w
+
+    def wrap(self, disponible_w, disponible_h):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.img, 0, 0, self.width, self.height, mask="auto")
+
+
+class LayoutContrato:
+    """Layout estático derivado del DOCX + armado por contrato."""
+
+    def __init__(self, path_docx: str):
+        self.path = path_docx
+        self.mtime = os.stat(path_docx).st_mtime_ns
+        doc = Document(path_docx)
+        sec = doc.sections[0]
+        self.pagina = (sec.page_width.pt, sec.page_height.pt)
+        self.margenes = (sec.left_margin.pt, sec.right_margin.pt, sec.top_margin.pt, sec.bottom_margin.pt)
+        self.ancho_util = self.pagina[0] - self.margenes[0] - self.margenes[1]
+        self.fuente = fuente()
+        self._defaults = _defaults(doc)
+        self.bloques = [self._bloque(ParrafoDocx(el, doc._body))
+                        for el in doc.element.body.iterchildren() if el.tag == qn("w:p")]
+        # Lo que no tiene tags se parsea una sola vez
+        for b in self.bloques:
+            if not b.vacio and "{{" not in "".join(t for _, t in b.runs):
+                b.frags = Paragraph(_markup(b.runs, b.estilo.fontSize), b.estilo).frags
+        self._imagenes = {}
+        self._lock = threading.Lock()
+
+    # --- resolución de estilos (párrafo -> estilo -> base -> docDefaults) ---
+    def _bloque(self, p: ParrafoDocx) -> _Bloque:
+        tam_def, antes_def, despues_def, linea_def = self._defaults
+        estilos = list(_cadena(p.style))
+        pfs = [p.paragraph_format] + [e.paragraph_format for e in estilos]
+        fuentes = [e.font for e in estilos]
+
+        tam = _primero((f.size.pt if f.size else None for f in fuentes), tam_def)
+        # Tamaño del párrafo vacío / marca de párrafo (p. ej. el título con sz en pPr/rPr)
+        rpr = p._p.pPr.find(qn("w:rPr")) if p._p.pPr is not None else None
+        if rpr is not None and rpr.find(qn("w:sz")) is not None:
+            tam = int(rpr.find(qn("w:sz")).get(qn("w:val"))) / 2
+        antes = _primero((pf.space_before.pt if pf.space_before is not None else None for pf in pfs), antes_def)
+        despues = _primero((pf.space_after.pt if pf.space_after is not None else None for pf in pfs), despues_def)
+        linea = _primero((pf.line_spacing if isinstance(pf.line_spacing, float) else None for pf in pfs), linea_def)
+        alin = _primero((pf.alignment for pf in pfs), None)
+        negrita_est = bool(_primero((f.bold for f in fuentes), False))
+        cursiva_est = bool(_primero((f.italic for f in fuentes), False))
+        color_est = _primero((_color(f) for f in fuentes), None)
+        juntar = bool(_primero((pf.keep_with_next for pf in pfs), False))
+
+        runs = []
+        for r in p.runs:
+            fmt = (
+                negrita_est if r.bold is None else r.bold,
+                cursiva_est if r.italic is None else r.italic,
+                bool(r.underline),
+                r.font.size.pt if r.font.size else None,
+                _color(r.font) or color_est,
+            )
+            if runs and runs[-1][0] == fmt:
+                runs[-1] = (fmt, runs[-1][1] + r.text)
+            else:
+                runs.append((fmt, r.text))
+
+        # El tamaño base del párrafo es el del primer run con tamaño propio (si lo hay)
+        tam_base = _primero((fmt[3] for fmt, t in runs if t.strip()), tam)
+        estilo = ParagraphStyle(
+            name=f"p{id(p._p)}",
+            fontName=self.fuente,
+            fontSize=tam_base,
+            leading=tam_base * _LINEA_SIMPLE * linea,
+            alignment=_ALINEACIONES.get(alin, TA_LEFT),
+            spaceBefore=antes,
+            spaceAfter=despues,
+            keepWithNext=juntar,
+        )
+        return _Bloque(estilo, runs)
+
+    # --- imágenes ---
+    def imagen(self, ruta: str) -> ImageReader:
+        """Imagen del disco decodificada una vez (firma de la empresa)."""
+        clave = (ruta, os.stat(ruta).st_mtime_ns)
+        img = self._imagenes.get(clave)
+        if img is None:
+            with self._lock:
+                img = self._imagenes.get(clave)
+                if img is None:
+                    with open(ruta, "rb") as f:
+                        img = self._imagenes[clave] = ImageReader(io.BytesIO(f.read()))
+        return img
+
+    # --- armado por contrato ---
+    def _parrafos(self, claves: dict):
+        out = []
+        for b in self.bloques:
+            if b.vacio:
+                out.append(Spacer(1, b.estilo.leading + b.estilo.spaceAfter))
+            elif b.frags is not None:
+                out.append(Paragraph("", b.estilo, frags=list(b.frags)))
+            else:
+                textos = plantilla_util.reemplazar_en_textos([t for _, t in b.runs], claves)
+                runs = b.runs if textos is None else [(fmt, t) for (fmt, _), t in zip(b.runs, textos)]
+                out.append(Paragraph(_markup(runs, b.estilo.fontSize), b.estilo))
+        return out
+
+    def _firma(self, img, ancho_in: float):
+        if img is None:
+            return ""
+        if not isinstance(img, ImageReader):
+            img = ImageReader(img)
+        return _Imagen(img, ancho_in * inch)
+
+    def _tabla_firmas(self, firma_cliente, firma_empresa, ancho_in: float, tam_rotulo: float):
+        rotulo = ParagraphStyle("rotulo", fontName=self.fuente, fontSize=tam_rotulo,
+                                leading=tam_rotulo * _LINEA_SIMPLE, alignment=TA_CENTER)
+        col = 3.2 * inch
+        t = Table(
+            [[self._firma(firma_cliente, ancho_in), self._firma(firma_empresa, ancho_in)],
+             [Paragraph("<b>Firma del Cliente</b>", rotulo), Paragraph("<b>Firma de la Empresa</b>", rotulo)]],
+            colWidths=[col, col], hAlign="LEFT",
+        )
+        t.setStyle(TableStyle([
+            ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ]))
+        t.keepWithNext = False
+        return t
+
+    def renderizar(self, mapping: dict, salida, firma_cliente=None, firma_empresa_path: str = None,
+                   ancho_firma_in: float = 2.8, tam_rotulo: float = 12):
+        """
+        Escribe el PDF del contrato en `salida` (ruta o stream).
+          - mapping: el mismo que usa la plantilla DOCX ("{{ nombre }}": valor, ...)
+          - firma_cliente: bytes PNG, stream o None
+        """
+        if isinstance(firma_cliente, (bytes, bytearray)):
+            firma_cliente = io.BytesIO(firma_cliente)
+        empresa = None
+        if firma_empresa_path and os.path.exists(firma_empresa_path) and os.path.getsize(firma_empresa_path) > 0:
+            empresa = self.imagen(firma_empresa_path)
+
+        izq, der, arriba, abajo = self.margenes
+        doc = SimpleDocTemplate(salida, pagesize=self.pagina, leftMargin=izq, rightMargin=der,
+                                topMargin=arriba, bottomMargin=abajo,
+                                title="Contrato Monitoreo Alarma", author="Seguridad Ituzaingó")
+        historia = self._parrafos(plantilla_util.normalizar_mapping(mapping))
+        historia.append(self._tabla_firmas(firma_cliente, empresa, ancho_firma_in, tam_rotulo))
+        doc.build(historia)
+
+
+_CACHE = {}
+_LOCK = threading.Lock()
+
+
+def get_layout(path_docx: str) -> LayoutContrato:
+    """Layout del proceso; se recalcula si cambia el mtime de la plantilla."""
+    mtime = os.stat(path_docx).st_mtime_ns
+    layout = _CACHE.get(path_docx)
+    if layout is None or layout.mtime != mtime:
+        with _LOCK:
+            layout = _CACHE.get(path_docx)
+            if layout is None or layout.mtime != mtime:
+                layout = _CACHE[path_docx] = LayoutContrato(path_docx)
+    return layout
+
+
+def renderizar_contrato(path_docx: str, mapping: dict, out_pdf: str, firma_cliente=None,
+                        firma_empresa_path: str = None, ancho_firma_in: float = 2.8, tam_rotulo: float = 12) -> bool:
+    """Atajo: layout cacheado + render a `out_pdf` (escribe a un temporal y renombra)."""
+    tmp = f"{out_pdf}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        get_layout(path_docx).renderizar(mapping, tmp, firma_cliente, firma_empresa_path,
+                                         ancho_firma_in, tam_rotulo)
+        os.replace(tmp, out_pdf)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return os.path.exists(out_pdf) and os.path.getsize(out_pdf) > 0
@@ -0,0 +1,367 @@
+# pdf_util.py
+"""
+Conversión DOCX -> PDF con LibreOffice.
+
+- Mantiene un pool de instancias LibreOffice "calientes" (PDF_POOL_SIZE), cada una
+  con su propio perfil aislado, para no pagar el arranque en frío por contrato.
+- Si el módulo `uno` está disponible, cada instancia queda escuchando en un pipe
+  local y se convierte por UNO; si no, se usa la CLI con el perfil de la instancia.
+- Cola acotada (PDF_POOL_QUEUE): si está llena se levanta ConversionOcupada en vez
+  de encolar indefinidamente.
+- El camino CLI original (un `soffice` por conversión) queda como respaldo.
+- convertir_lote(): muchos DOCX de una vez (pool UNO o una sola invocación CLI).
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+import atexit
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# ==============================
+# Config desde variables de entorno
+# ==============================
+PDF_POOL_SIZE      = int(os.getenv("PDF_POOL_SIZE", "2"))       # 0 = sin pool (solo CLI)
+PDF_POOL_QUEUE     = int(os.getenv("PDF_POOL_QUEUE", "8"))      # trabajos en espera como máximo
+PDF_QUEUE_WAIT     = float(os.getenv("PDF_QUEUE_WAIT", "30"))   # seg. esperando una instancia libre
+PDF_TIMEOUT        = int(os.getenv("PDF_TIMEOUT", "60"))        # seg. por conversión
+PDF_START_TIMEOUT  = int(os.getenv("PDF_START_TIMEOUT", "30"))  # seg. para que arranque una instancia
+PDF_PROFILE_DIR    = os.getenv("PDF_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "lo_perfiles"))
+UNO_PYTHONPATH     = os.getenv("UNO_PYTHONPATH", "/usr/lib/python3/dist-packages")
+
+SOFFICE_BINS = ("soffice", "libreoffice")
+PDF_FILTER = "writer_pdf_Export"
+
+log = logging.getLogger(__name__)
+
+
+class ConversionOcupada(Exception):
+    """El pool está saturado: la cola de conversiones está llena."""
+
+
+class ConversionError(Exception):
+    """La conversión falló en la instancia LibreOffice."""
+
+
+# ==============================
+# Helpers
+# ==============================
+def _cargar_uno():
+    """Importa `uno` (python3-uno del sistema) si está disponible."""
+    try:
+        import uno  # noqa: F401
+        return uno
+    except ImportError:
+        pass
+    # python3-uno de Debian instala en dist-packages, fuera del sys.path del Python oficial
+    if UNO_PYTHONPATH and os.path.isdir(UNO_PYTHONPATH) and UNO_PYTHONPATH not in sys.path:
+        sys.path.append(UNO_PYTHONPATH)
+        try:
+            import uno  # noqa: F401
+            return uno
+        except Exception:
+            pass
+    return None
+
+
+def _soffice_bin():
+    for b in SOFFICE_BINS:
+        path = shutil.which(b)
+        if path:
+            return path
+    return None
+
+
+def _env_lo():
+    env = os.environ.copy()
+    env.setdefault("HOME", "/tmp")
+    env.setdefault("LANG", "en_US.UTF-8")
+    return env
+
+
+def _mover_pdf_generado(out_docx: str, out_dir: str, out_pdf: str) -> bool:
+    gen_pdf = os.path.join(out_dir, os.path.splitext(os.path.basename(out_docx))[0] + ".pdf")
+    if os.path.exists(gen_pdf) and os.path.getsize(gen_pdf) > 0:
+        if os.path.abspath(gen_pdf) != os.path.abspath(out_pdf):
+            os.replace(gen_pdf, out_pdf)
+        return True
+    return False
+
+
+def convertir_cli(out_docx: str, out_pdf: str, perfil: str = None, timeout: int = 180) -> bool:
+    """
+    Camino clásico: un proceso `soffice --convert-to` por conversión.
+    - Si se pasa `perfil`, usa ese directorio como UserInstallation (aislado).
+    - Prueba 'soffice' y 'libreoffice'.
+    """
+    out_dir = os.path.dirname(out_pdf) or "."
+    extra = [f"-env:UserInstallation={Path(perfil).as_uri()}"] if perfil else []
+
+    for b in SOFFICE_BINS:
+        cmd = [b, "--headless", "--norestore", "--nolockcheck", "--nodefault", *extra,
+               "--convert-to", f"pdf:{PDF_FILTER}", "--outdir", out_dir, out_docx]
+        try:
+            subprocess.run(
+                cmd, check=True,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                timeout=timeout, env=_env_lo()
+            )
+            if _mover_pdf_generado(out_docx, out_dir, out_pdf):
+                return True
+        except Exception:
+            continue
+    return False
+
+
+# ==============================
+# Instancia LibreOffice
+# ==============================
+class _Instancia:
+    """Un LibreOffice headless con perfil propio, reutilizado entre conversiones."""
+
+    def __init__(self, idx: int, uno_mod):
+        self.idx = idx
+        self.uno = uno_mod
+        self.nombre = f"lo_{os.getpid()}_{idx}"
+        self.perfil = os.path.join(PDF_PROFILE_DIR, self.nombre)
+        self.proc = None
+        self.desktop = None
+        self.conversiones = 0
+        self.reinicios = 0
+
+    # --- ciclo de vida ---
+    def _arrancar(self):
+        binario = _soffice_bin()
+        if not binario:
+            raise ConversionError("LibreOffice no está instalado")
+        os.makedirs(self.perfil, exist_ok=True)
+        self.proc = subprocess.Popen(
+            [binario, "--headless", "--invisible", "--norestore", "--nologo",
+             "--nodefault", "--nolockcheck",
+             f"-env:UserInstallation={Path(self.perfil).as_uri()}",
+             f"--accept=pipe,name={self.nombre};urp;StarOffice.ComponentContext"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=_env_lo(),
+        )
+        local = self.uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local)
+        limite = time.monotonic() + PDF_START_TIMEOUT
+        while True:
+            try:
+                ctx = resolver.resolve(
+                    f"uno:pipe,name={self.nombre};urp;StarOffice.ComponentContext")
+                self.desktop = ctx.ServiceManager.createInstanceWithContext(
+                    "com.sun.star.frame.Desktop", ctx)
+                log.info("[PDF] Instancia %s lista (pid=%s)", self.nombre, self.proc.pid)
+                return
+            except Exception:
+                if self.proc.poll() is not None or time.monotonic() > limite:
+                    self.cerrar()
+                    raise ConversionError(f"No arrancó la instancia {self.nombre}")
+                time.sleep(0.25)
+
+    def viva(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None and self.desktop is not None
+
+    def reiniciar(self):
+        self.cerrar()
+        self.reinicios += 1
+        self._arrancar()
+
+    def cerrar(self):
+        self.desktop = None
+        if self.proc is not None:
+            try:
+                self.proc.terminate()
+                self.proc.wait(timeout=5)
+            except Exception:
+                try:
+                    self.proc.kill()
+                except Exception:
+                    pass
+            self.proc = None
+
+    def borrar_perfil(self):
+        shutil.rmtree(self.perfil, ignore_errors=True)
+
+    # --- conversión ---
+    def _prop(self, nombre, valor):
+        from com.sun.star.beans import PropertyValue
+        p = PropertyValue()
+        p.Name = nombre
+        p.Value = valor
+        return p
+
+    def _convertir_uno(self, out_docx: str, out_pdf: str):
+        if not self.viva():
+            self.reiniciar() if self.proc is not None else self._arrancar()
+
+        # Vigilante: si la conversión se cuelga, matamos el proceso y la llamada UNO falla
+        vigilante = threading.Timer(PDF_TIMEOUT, lambda p=self.proc: p.kill())
+        vigilante.start()
+        try:
+            doc = self.desktop.loadComponentFromURL(
+                self.uno.systemPathToFileUrl(os.path.abspath(out_docx)), "_blank", 0,
+                (self._prop("Hidden", True),))
+            try:
+                doc.storeToURL(
+                    self.uno.systemPathToFileUrl(os.path.abspath(out_pdf)),
+                    (self._prop("FilterName", PDF_FILTER),))
+            finally:
+                doc.close(True)
+        finally:
+            vigilante.cancel()
+
+    def convertir(self, out_docx: str, out_pdf: str) -> bool:
+        if self.uno is None:
+            ok = convertir_cli(out_docx, out_pdf, perfil=self.perfil, timeout=PDF_TIMEOUT)
+        else:
+            try:
+                self._convertir_uno(out_docx, out_pdf)
+            except Exception:
+                # La instancia pudo haberse caído: reiniciamos y reintentamos una vez
+                log.warning("[PDF] Falla en %s, reiniciando instancia", self.nombre, exc_info=True)
+                self.reiniciar()
+                self._convertir_uno(out_docx, out_pdf)
+            ok = os.path.exists(out_pdf) and os.path.getsize(out_pdf) > 0
+        if ok:
+            self.conversiones += 1
+        return ok
+
+
+# ==============================
+# Pool
+# ==============================
+class PoolConversion:
+    """
+    Pool de instancias LibreOffice con cola acotada.
+      - size: instancias (cada una con perfil aislado)
+      - max_cola: conversiones que pueden esperar una instancia libre
+    """
+
+    def __init__(self, size: int = PDF_POOL_SIZE, max_cola: int = PDF_POOL_QUEUE):
+        self.uno = _cargar_uno()
+        self.size = max(1, size)
+        self._libres = queue.Queue()
+        self._instancias = [_Instancia(i, self.uno) for i in range(self.size)]
+        for inst in self._instancias:
+            self._libres.put(inst)
+        # Cupos = en curso + en espera; si no hay cupo, rechazamos de inmediato
+        self._cupos = threading.BoundedSemaphore(self.size + max(0, max_cola))
+        log.info("[PDF] Pool de %d instancias (modo=%s)", self.size, "uno" if self.uno else "cli")
+
+    @property
+    def modo(self) -> str:
+        return "uno" if self.uno else "cli"
+
+    def convertir(self, out_docx: str, out_pdf: str, espera: float = PDF_QUEUE_WAIT) -> bool:
+        if not self._cupos.acquire(blocking=False):
+            raise ConversionOcupada("Cola de conversión llena")
+        try:
+            try:
+                inst = self._libres.get(timeout=espera)
+            except queue.Empty:
+                raise ConversionOcupada("No se liberó ninguna instancia a tiempo")
+            try:
+                return inst.convertir(out_docx, out_pdf)
+            finally:
+                self._libres.put(inst)
+        finally:
+            self._cupos.release()
+
+    def calentar(self):
+        """Arranca las instancias por adelantado (modo UNO)."""
+        if self.uno is None:
+            return
+        for inst in self._instancias:
+            if not inst.viva():
+                try:
+                    inst.reiniciar() if inst.proc is not None else inst._arrancar()
+                except Exception:
+                    log.exception("[PDF] No se pudo calentar %s", inst.nombre)
+
+    def cerrar(self):
+        for inst in self._instancias:
+            inst.cerrar()
+            inst.borrar_perfil()
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    """Pool del proceso (se crea al primer uso, así no sobrevive a un fork)."""
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = PoolConversion()
+                atexit.register(_POOL.cerrar)
+    return _POOL
+
+
+def convertir_docx_a_pdf(out_docx: str, out_pdf: str) -> bool:
+    """
+    Convierte usando el pool; si el pool no puede (sin LibreOffice, instancia rota),
+    cae al camino CLI clásico. ConversionOcupada se propaga para aplicar backpressure.
+    """
+    if PDF_POOL_SIZE > 0 and _soffice_bin():
+        try:
+            if get_pool().convertir(out_docx, out_pdf):
+                return True
+        except ConversionOcupada:
+            raise
+        except Exception:
+            log.exception("[PDF] Falló el pool, uso la CLI")
+    return convertir_cli(out_docx, out_pdf)
+
+
+def convertir_lote(docx_paths, out_dir: str, timeout_por_doc: int = PDF_TIMEOUT) -> dict:
+    """
+    Convierte varios DOCX a PDF dentro de `out_dir`. Devuelve {docx: pdf | None}.
+    - Con el pool en modo UNO: reparte los archivos entre las instancias calientes.
+    - Si no: una sola invocación de LibreOffice para todo el lote, con un perfil
+      propio de esta llamada (dos lotes a la vez no comparten el lock del perfil).
+    """
+    docx_paths = list(docx_paths)
+    pdfs = {d: os.path.join(out_dir, os.path.splitext(os.path.basename(d))[0] + ".pdf")
+            for d in docx_paths}
+    binario = _soffice_bin()
+    if not docx_paths or not binario:
+        return {d: None for d in docx_paths}
+
+    if PDF_POOL_SIZE > 0 and get_pool().uno is not None:
+        pool = get_pool()
+
+        def _uno(d):
+            try:
+                return pool.convertir(d, pdfs[d])
+            except Exception:
+                log.exception("[PDF] Falló %s en el lote", d)
+                return False
+
+        with ThreadPoolExecutor(max_workers=pool.size) as ex:
+            oks = list(ex.map(_uno, docx_paths))
+        return {d: (pdfs[d] if ok else None) for d, ok in zip(docx_paths, oks)}
+
+    os.makedirs(PDF_PROFILE_DIR, exist_ok=True)
+    perfil = tempfile.mkdtemp(prefix="lote_", dir=PDF_PROFILE_DIR)
+    cmd = [binario, "--headless", "--norestore", "--nolockcheck", "--nodefault",
+           f"-env:UserInstallation={Path(perfil).as_uri()}",
+           "--convert-to", f"pdf:{PDF_FILTER}", "--outdir", out_dir, *docx_paths]
+    try:
+        subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       timeout=timeout_por_doc * len(docx_paths), env=_env_lo())
+    except Exception:
+        log.exception("[PDF] Falló la conversión del lote")
+    finally:
+        shutil.rmtree(perfil, ignore_errors=True)
+    return {d: (pdfs[d] if os.path.exists(pdfs[d]) and os.path.getsize(pdfs[d]) > 0 else None)
+            for d in docx_paths}
@@ -0,0 +1,176 @@
+# plantilla_util.py
+"""
+Plantilla del contrato precompilada.
+
+- El DOCX se abre una sola vez por proceso y se recompila si cambia su mtime.
+- Se indexan de antemano los párrafos (cuerpo y celdas) que tienen `{{ ... }}`.
+- Los tags se reemplazan en una sola pasada por párrafo (reemplazar_en_parrafo),
+  tolerando espacios/NBSP/zero-width y tags partidos en varios runs.
+- Cada contrato sale de clonar el documento en memoria: solo se copia
+  word/document.xml; styles, theme, numbering, etc. se comparten (son de solo
+  lectura) y no se vuelven a parsear.
+- `preparar(doc)` permite agregar una sola vez contenido fijo (p. ej. la tabla
+  de firmas con la imagen de la empresa): sus partes también se comparten.
+- python-docx se importa al compilar la primera plantilla (no al importar el
+  módulo): el arranque en frío y GET / no lo necesitan.
+"""
+import os
+import re
+import copy
+import bisect
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from docx.text.paragraph import Paragraph
+
+# Caracteres que Word suele meter dentro de un tag: espacios, NBSP, zero-width, BOM
+_INVISIBLES = "\\s\u00a0\u200b\u200c\u200d\u2060\ufeff"
+_TAG_RE = re.compile(r"\{\{([^{}]{1,120})\}\}")
+_BASURA_RE = re.compile(f"[{_INVISIBLES}_]+")
+_NOMBRE_RE = re.compile(r"^[a-z0-9]+$")
+
+
+def _clave(nombre: str) -> str:
+    """
+    Nombre canónico de un tag: sin espacios/NBSP/zero-width ni guiones bajos, en minúsculas.
+    Así {{ ubicacion_monitoreo }}, {{ubicacion monitoreo}} o {{ u b i c a c i o n _monitoreo }}
+    caen en la misma clave.
+    """
+    return _BASURA_RE.sub("", nombre).lower()
+
+
+def normalizar_mapping(mapping: dict) -> dict:
+    """Acepta claves "{{ nombre }}" o "nombre" y las lleva a su forma canónica."""
+    return {_clave(k.strip().strip("{}")): v for k, v in mapping.items()}
+
+
+def reemplazar_en_textos(originales, claves: dict):
+    """
+    Núcleo de reemplazar_en_parrafo sobre una lista de textos (uno por run).
+    Devuelve la lista nueva, o None si no hay nada que reemplazar.
+    """
+    completo = "".join(originales)
+    if "{{" not in completo:
+        return None
+
+    reemplazos = []
+    for m in _TAG_RE.finditer(completo):
+        clave = _clave(m.group(1))
+        if _NOMBRE_RE.match(clave) and clave in claves:
+            reemplazos.append((m.start(), m.end(), claves[clave]))
+    if not reemplazos:
+        return None
+
+    # Offset de inicio de cada run dentro del texto completo
+    inicios, pos = [], 0
+    for t in originales:
+        inicios.append(pos)
+        pos += len(t)
+
+    textos = list(originales)
+    # De atrás hacia adelante: los offsets de los tags previos siguen siendo válidos
+    for inicio, fin, valor in reversed(reemplazos):
+        i = bisect.bisect_right(inicios, inicio) - 1
+        j = bisect.bisect_right(inicios, fin - 1) - 1
+        a, b = inicio - inicios[i], fin - inicios[j]
+        if i == j:
+            textos[i] = textos[i][:a] + valor + textos[i][b:]
+        else:
+            # El valor queda en el run donde empieza el tag (hereda su formato)
+            textos[i] = textos[i][:a] + valor
+            for k in range(i + 1, j):
+                textos[k] = ""
+            textos[j] = textos[j][b:]
+    return textos
+
+
+def reemplazar_en_parrafo(p: "Paragraph", claves: dict):
+    """
+    Reemplaza en una sola pasada los tags `{{ nombre }}` del párrafo, aunque estén
+    partidos en varios runs, conservando el formato de cada run.
+      - claves: mapping ya normalizado (ver normalizar_mapping)
+      - Los tags sin valor en `claves` quedan intactos.
+    """
+    runs = p.runs
+    originales = [r.text for r in runs]
+    textos = reemplazar_en_textos(originales, claves)
+    if textos is None:
+        return
+    for r, antes, despues in zip(runs, originales, textos):
+        if antes != despues:
+            r.text = despues
+
+
+def _parrafos_xml(doc):
+    """Todos los <w:p> del cuerpo en orden de documento (incluye celdas de tablas)."""
+    from docx.oxml.ns import qn
+    return doc.element.body.iter(qn("w:p"))
+
+
+class PlantillaCompilada:
+    """DOCX parseado una vez + índice de los párrafos con placeholders."""
+
+    def __init__(self, path: str, preparar=None):
+        from docx import Document
+
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        self.doc = Document(path)
+        if preparar is not None:
+            preparar(self.doc)
+            # El _Body cacheado apunta al XML: lxml lo copiaría aparte (sin el memo de
+            # deepcopy) y los clones editarían un árbol huérfano
+            self.doc._Document__body = None
+        self._preparar()
+
+    def _preparar(self):
+        """(Re)calcula el índice y las partes compartidas tras modificar `self.doc`."""
+        from docx.oxml.ns import qn
+
+        # Partes que no se tocan al completar un contrato: se comparten entre clones
+        principal = self.doc.part
+        self._compartidos = {
+            id(p): p for p in principal.package.iter_parts() if p is not principal
+        }
+        self.indices = [
+            i for i, p in enumerate(_parrafos_xml(self.doc))
+            if "{{" in "".join(t.text or "" for t in p.iter(qn("w:t")))
+        ]
+
+    def nuevo_documento(self):
+        """Clon independiente del documento (solo copia document.xml y sus relaciones)."""
+        return copy.deepcopy(self.doc, dict(self._compartidos))
+
+    def completar(self, mapping: dict):
+        """Devuelve un documento nuevo con los placeholders reemplazados."""
+        from docx.text.paragraph import Paragraph
+
+        claves = normalizar_mapping(mapping)
+        doc = self.nuevo_documento()
+        body = doc._body
+        parrafos = list(_parrafos_xml(doc))
+        for i in self.indices:
+            reemplazar_en_parrafo(Paragraph(parrafos[i], body), claves)
+        return doc
+
+
+_CACHE = {}
+_LOCK = threading.Lock()
+
+
+def get_plantilla(path: str, preparar=None) -> PlantillaCompilada:
+    """
+    Plantilla compilada del proceso; se invalida si cambia el mtime del archivo.
+    Cada `preparar` (función de módulo, estable) tiene su propia entrada en la caché.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    clave = (path, preparar)
+    p = _CACHE.get(clave)
+    if p is None or p.mtime != mtime:
+        with _LOCK:
+            p = _CACHE.get(clave)
+            if p is None or p.mtime != mtime:
+                p = PlantillaCompilada(path, preparar)
+                _CACHE[clave] = p
+    return p
@@ -0,0 +1,418 @@
+# trabajos_util.py
+"""
+Cola de trabajos durable (SQLite) con un pool de workers en hilos.
+
+Cada trabajo recorre una lista fija de etapas (render, pdf, drive, email...).
+- El registro se persiste antes de responder, así un reinicio no pierde contratos.
+- Cada etapa tiene sus propios reintentos con espera exponencial.
+- El resultado acumulado se guarda después de cada intento, así un trabajo
+  retomado continúa desde la etapa pendiente.
+- Un trabajo "en_proceso" cuyo lease venció (worker caído) vuelve a tomarse.
+- `crear_unico` deduplica por huella dentro de una ventana de tiempo (doble
+  envío del formulario): devuelve el trabajo existente en vez de crear otro.
+- Al terminar, se borran de `datos` las claves de `descartar` (p. ej. la firma);
+  `purgar` elimina los trabajos terminados con más de JOBS_RETENCION_H horas.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+import metricas_util
+
+# ==============================
+# Config desde variables de entorno
+# ==============================
+BASE_DIR      = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR      = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "data"))
+JOBS_DB       = os.getenv("JOBS_DB", os.path.join(DATA_DIR, "trabajos.sqlite3"))
+JOBS_WORKERS  = int(os.getenv("JOBS_WORKERS", "2"))      # 0 = ejecutar en el mismo request
+JOBS_LEASE    = int(os.getenv("JOBS_LEASE", "900"))      # seg. antes de dar por abandonado un trabajo
+JOBS_POLL     = float(os.getenv("JOBS_POLL", "2"))       # seg. entre sondeos si no hay avisos
+JOBS_RETENCION_H = float(os.getenv("JOBS_RETENCION_H", "72"))  # trabajos terminados (datos personales)
+
+PENDIENTE, EN_PROCESO, COMPLETADO, ERROR = "pendiente", "en_proceso", "completado", "error"
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id           TEXT PRIMARY KEY,
+    estado       TEXT NOT NULL,
+    etapa        TEXT,
+    progreso     INTEGER NOT NULL DEFAULT 0,
+    datos        TEXT NOT NULL,
+    resultado    TEXT NOT NULL DEFAULT '{}',
+    error        TEXT,
+    creado       REAL NOT NULL,
+    actualizado  REAL NOT NULL,
+    lease_hasta  REAL NOT NULL DEFAULT 0,
+    huella       TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_trabajos_estado ON trabajos (estado, creado);
+"""
+
+# Bases creadas antes de la columna `huella`
+_MIGRACIONES = (
+    ("huella", "ALTER TABLE trabajos ADD COLUMN huella TEXT"),
+)
+_INDICES = "CREATE INDEX IF NOT EXISTS ix_trabajos_huella ON trabajos (huella, creado);"
+
+
+class SinReintento(Exception):
+    """Falla definitiva: la etapa no se reintenta (p. ej. falta configuración)."""
+
+
+class TrabajoEnProceso(Exception):
+    """El trabajo todavía corre: su worker pisaría el resultado (reintentar más tarde)."""
+
+
+class Etapa:
+    """
+    Paso del pipeline.
+      - fn(datos, resultado) -> dict | None   (puede mutar `resultado`)
+      - reintentos: intentos extra ante una excepción
+      - obligatoria: si agota los reintentos, el trabajo termina en error;
+        si no, se registra el error y se sigue con la próxima etapa.
+    """
+
+    def __init__(self, nombre, fn, reintentos=2, espera=1.0, obligatoria=True):
+        self.nombre = nombre
+        self.fn = fn
+        self.reintentos = reintentos
+        self.espera = espera
+        self.obligatoria = obligatoria
+
+
+class ColaTrabajos:
+    def __init__(self, etapas, db_path: str = JOBS_DB, workers: int = JOBS_WORKERS, descartar=()):
+        self.etapas = list(etapas)
+        self.descartar = tuple(descartar)   # claves de `datos` que no se guardan al terminar
+        self.db_path = db_path
+        self.workers = workers
+        self._local = threading.local()
+        self._aviso = threading.Event()
+        self._parar = threading.Event()
+        self._hilos = []
+        self._pid = None
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._conn() as c:
+            c.executescript(_SCHEMA)
+            columnas = {r["name"] for r in c.execute("PRAGMA table_info(trabajos)")}
+            for col, sql in _MIGRACIONES:
+                if col not in columnas:
+                    c.execute(sql)
+            c.executescript(_INDICES)
+
+    # --- SQLite (una conexión por hilo) ---
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None or getattr(self._local, "pid", None) != os.getpid():
+            c = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            c.row_factory = sqlite3.Row
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = c, os.getpid()
+        return c
+
+    # --- API ---
+    def crear(self, datos: dict, job_id: str = None) -> str:
+        """Registra un trabajo pendiente y despierta a los workers."""
+        job_id = job_id or uuid.uuid4().hex
+        ahora = time.time()
+        self._conn().execute(
+            "INSERT INTO trabajos (id, estado, datos, creado, actualizado) VALUES (?, ?, ?, ?, ?)",
+            (job_id, PENDIENTE, json.dumps(datos, ensure_ascii=False), ahora, ahora),
+        )
+        self._despachar(job_id)
+        return job_id
+
+    def buscar_huella(self, huella: str, ventana: float):
+        """Id del trabajo más reciente con esa huella creado dentro de la ventana (seg.), o None."""
+        row = self._conn().execute(
+            "SELECT id FROM trabajos WHERE huella = ? AND creado >= ? ORDER BY creado DESC LIMIT 1",
+            (huella, time.time() - ventana)).fetchone()
+        return row["id"] if row else None
+
+    def crear_unico(self, datos: dict, huella: str, ventana: float):
+        """
+        Como `crear`, pero si ya hay un trabajo con la misma huella dentro de la
+        ventana devuelve ese. La búsqueda y el alta van en la misma transacción
+        (BEGIN IMMEDIATE), así dos workers no crean el mismo contrato dos veces.
+        Return: (job_id, nuevo: bool)
+        """
+        c = self._conn()
+        ahora = time.time()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute(
+                "SELECT id FROM trabajos WHERE huella = ? AND creado >= ? ORDER BY creado DESC LIMIT 1",
+                (huella, ahora - ventana)).fetchone()
+            if row is not None:
+                c.execute("COMMIT")
+                return row["id"], False
+            job_id = uuid.uuid4().hex
+            c.execute(
+                "INSERT INTO trabajos (id, estado, datos, creado, actualizado, huella) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, PENDIENTE, json.dumps(datos, ensure_ascii=False), ahora, ahora, huella),
+            )
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        self._despachar(job_id)
+        return job_id, True
+
+    def en_curso(self) -> int:
+        """Trabajos pendientes o en proceso (de todos los workers: la base es compartida)."""
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM trabajos WHERE estado IN (?, ?)", (PENDIENTE, EN_PROCESO)).fetchone()[0]
+
+    def _despachar(self, job_id: str):
+        if self.workers <= 0:
+            # Modo síncrono (CLI / depuración): se ejecuta en el hilo actual
+            if self._tomar(job_id):
+                self._ejecutar(job_id)
+        else:
+            self.iniciar()
+            self._aviso.set()
+
+    def obtener(self, job_id: str):
+        row = self._conn().execute("SELECT * FROM trabajos WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        t = dict(row)
+        t["datos"] = json.loads(t["datos"])
+        t["resultado"] = json.loads(t["resultado"])
+        t["total"] = len(self.etapas)
+        return t
+
+    def buscar_slug(self, slug: str):
+        """Id del trabajo más reciente con datos.slug == slug, o None."""
+        row = self._conn().execute(
+            "SELECT id FROM trabajos WHERE json_extract(datos, '$.slug') = ? ORDER BY creado DESC LIMIT 1",
+            (slug,)).fetchone()
+        return row["id"] if row else None
+
+    def resolver_etapa(self, job_id: str, etapa: str, salida: dict = None) -> dict:
+        """
+        Marca "ok" una etapa que terminó fuera del trabajo (p. ej. la subida a Drive que
+        completó el barrido del spool) y suma `salida` al resultado. Solo sobre trabajos
+        terminados: si sigue pendiente/en proceso levanta TrabajoEnProceso.
+        Devuelve el resultado actualizado.
+        """
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute("SELECT estado, resultado FROM trabajos WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                raise KeyError(job_id)
+            if row["estado"] not in (COMPLETADO, ERROR):
+                raise TrabajoEnProceso(job_id)
+            resultado = json.loads(row["resultado"])
+            resultado.update(salida or {})
+            resultado.setdefault("etapas", {})[etapa] = "ok"
+            errores = resultado.get("errores") or {}
+            errores.pop(etapa, None)
+            if not errores:
+                resultado.pop("errores", None)
+            c.execute("UPDATE trabajos SET resultado = ?, actualizado = ? WHERE id = ?",
+                      (json.dumps(resultado, ensure_ascii=False), time.time(), job_id))
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        return resultado
+
+    def recorrer(self, estado: str = COMPLETADO):
+        """Trabajos en ese estado, del más viejo al más nuevo: (id, datos, resultado, creado)."""
+        rows = self._conn().execute(
+            "SELECT id, datos, resultado, creado FROM trabajos WHERE estado = ? ORDER BY creado",
+            (estado,)).fetchall()
+        for row in rows:
+            yield row["id"], json.loads(row["datos"]), json.loads(row["resultado"]), row["creado"]
+
+    def purgar(self, retencion_h: float = JOBS_RETENCION_H) -> int:
+        """Borra los trabajos completados o con error creados hace más de `retencion_h` horas."""
+        limite = time.time() - retencion_h * 3600
+        n = 0
+        for estado in (COMPLETADO, ERROR):
+            n += self._conn().execute("DELETE FROM trabajos WHERE estado = ? AND creado < ?",
+                                      (estado, limite)).rowcount
+        if n:
+            log.info("[Trabajos] %d trabajos terminados purgados (más de %.0f h)", n, retencion_h)
+        return n
+
+    def iniciar(self):
+        """Arranca los hilos worker (una vez por proceso; tras un fork se relanzan)."""
+        if self.workers <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._parar.clear()
+            self._hilos = []
+            for i in range(self.workers):
+                h = threading.Thread(target=self._bucle, name=f"trabajos-{i}", daemon=True)
+                h.start()
+                self._hilos.append(h)
+            self._aviso.set()
+
+    def detener(self, espera: float = 30) -> bool:
+        """
+        Los hilos terminan el trabajo en curso y no toman otro (p. ej. al reciclar un
+        worker de Gunicorn). Devuelve False si alguno siguió ocupado tras `espera`
+        seg.: ese trabajo queda "en_proceso" y se retoma cuando vence su lease.
+        """
+        self._parar.set()
+        self._aviso.set()
+        limite = time.monotonic() + espera
+        for h in self._hilos:
+            h.join(max(0.0, limite - time.monotonic()))
+        return not any(h.is_alive() for h in self._hilos)
+
+    # --- Worker ---
+    def _tomar(self, job_id: str = None):
+        """Reserva un trabajo (pendiente o con lease vencido). Devuelve su id o None."""
+        c = self._conn()
+        ahora = time.time()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            if job_id:
+                row = c.execute("SELECT id FROM trabajos WHERE id = ? AND estado = ?",
+                                (job_id, PENDIENTE)).fetchone()
+            else:
+                row = c.execute(
+                    "SELECT id FROM trabajos WHERE estado = ? OR (estado = ? AND lease_hasta < ?) "
+                    "ORDER BY creado LIMIT 1",
+                    (PENDIENTE, EN_PROCESO, ahora),
+                ).fetchone()
+            if row is None:
+                c.execute("COMMIT")
+                return None
+            c.execute(
+                "UPDATE trabajos SET estado = ?, lease_hasta = ?, actualizado = ? WHERE id = ?",
+                (EN_PROCESO, ahora + JOBS_LEASE, ahora, row["id"]),
+            )
+            c.execute("COMMIT")
+            return row["id"]
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                job_id = self._tomar()
+            except Exception:
+                log.exception("[Trabajos] No se pudo tomar un trabajo")
+                job_id = None
+            if job_id is None:
+                self._aviso.wait(JOBS_POLL)
+                if not self._parar.is_set():
+                    self._aviso.clear()
+                continue
+            try:
+                self._ejecutar(job_id)
+            except Exception:
+                log.exception("[Trabajos] Error inesperado en %s", job_id)
+
+    def _guardar(self, job_id, **campos):
+        campos["actualizado"] = time.time()
+        for k in ("datos", "resultado"):
+            if k in campos:
+                campos[k] = json.dumps(campos[k], ensure_ascii=False)
+        sets = ", ".join(f"{k} = ?" for k in campos)
+        self._conn().execute(f"UPDATE trabajos SET {sets} WHERE id = ?", (*campos.values(), job_id))
+
+    def _sin_descartables(self, datos: dict) -> dict:
+        return {k: v for k, v in datos.items() if k not in self.descartar}
+
+    def _ejecutar(self, job_id: str):
+        t = self.obtener(job_id)
+        # Las líneas de log del trabajo llevan la traza del request que lo creó
+        token = metricas_util.TRAZA.set(t["datos"].get("traza") or job_id[:16])
+        try:
+            with metricas_util.perfilar(f"trabajo_{job_id[:8]}"):
+                self._ejecutar_etapas(job_id, t)
+        finally:
+            metricas_util.TRAZA.reset(token)
+
+    def _ejecutar_etapas(self, job_id: str, t: dict):
+        datos, resultado = t["datos"], t["resultado"]
+        estados = resultado.setdefault("etapas", {})
+
+        for idx, etapa in enumerate(self.etapas):
+            if estados.get(etapa.nombre) in ("ok", "error"):
+                continue  # ya resuelta en una corrida anterior
+            self._guardar(job_id, etapa=etapa.nombre, progreso=idx,
+                          lease_hasta=time.time() + JOBS_LEASE)
+            for intento in range(etapa.reintentos + 1):
+                t0 = time.perf_counter()
+                try:
+                    salida = etapa.fn(datos, resultado)
+                    if salida:
+                        resultado.update(salida)
+                    estados[etapa.nombre] = "ok"
+                    metricas_util.TRABAJO_ETAPA_SEGUNDOS.observar(
+                        time.perf_counter() - t0, etapa=etapa.nombre, resultado="ok")
+                    break
+                except Exception as e:
+                    metricas_util.TRABAJO_ETAPA_SEGUNDOS.observar(
+                        time.perf_counter() - t0, etapa=etapa.nombre, resultado="error")
+                    log.warning("[Trabajos] %s: etapa %s falló (intento %d/%d): %s",
+                                job_id, etapa.nombre, intento + 1, etapa.reintentos + 1, e)
+                    if intento < etapa.reintentos and not isinstance(e, SinReintento):
+                        self._guardar(job_id, resultado=resultado)
+                        time.sleep(etapa.espera * (2 ** intento))
+                        continue
+                    estados[etapa.nombre] = "error"
+                    resultado.setdefault("errores", {})[etapa.nombre] = str(e)
+                    break
+            self._guardar(job_id, resultado=resultado, progreso=idx + 1)
+
+            if estados[etapa.nombre] == "error" and etapa.obligatoria:
+                log.error("[Trabajos] %s terminó con error en %s", job_id, etapa.nombre)
+                self._guardar(job_id, estado=ERROR, error=resultado["errores"][etapa.nombre],
+                              datos=self._sin_descartables(datos))
+                metricas_util.TRABAJOS_TOTAL.inc(estado=ERROR)
+                return
+
+        self._guardar(job_id, estado=COMPLETADO, etapa=None, progreso=len(self.etapas),
+                      datos=self._sin_descartables(datos))
+        metricas_util.TRABAJOS_TOTAL.inc(estado=COMPLETADO)
+        log.info("[Trabajos] %s completado", job_id)
+
+
+class CacheTTL:
+    """Dict acotado (LRU) cuyas entradas vencen a los `ttl` segundos. Thread-safe."""
+
+    def __init__(self, ttl: float, maximo: int = 4096):
+        self.ttl = ttl
+        self.maximo = maximo
+        self._datos = OrderedDict()   # clave -> (valor, vence)
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return None
+            if item[1] < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return item[0]
+
+    def set(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (valor, time.monotonic() + self.ttl)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
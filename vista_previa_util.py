@@ -0,0 +1,216 @@
+# vista_previa_util.py
+"""
+Vista previa del contrato para GET /.
+
+- Convierte el DOCX a HTML (párrafos, tablas, negrita/cursiva/subrayado, alineación).
+- La página completa se renderiza una vez y se invalida si cambia el mtime/tamaño
+  de la plantilla.
+- Se guarda precomprimida (gzip y, si está instalado, brotli) con un ETag fuerte
+  por codificación; los clientes que ya la tienen reciben 304.
+- Caché en disco (PREVIEW_CACHE_DIR): el HTML del contrato por hash de la
+  plantilla y las variantes comprimidas por hash de la página. Un proceso recién
+  arrancado responde GET / sin abrir el DOCX ni importar python-docx, y sin
+  volver a comprimir con brotli.
+"""
+import os
+import gzip
+import html
+import hashlib
+import threading
+from typing import TYPE_CHECKING
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # opcional: sin brotli se sirve gzip/identity
+    brotli = None
+
+if TYPE_CHECKING:
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+BASE_DIR          = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR          = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "data"))
+PREVIEW_CACHE_DIR = os.getenv("PREVIEW_CACHE_DIR", os.path.join(DATA_DIR, "vista_previa"))
+PREVIEW_MAX_AGE   = int(os.getenv("PREVIEW_MAX_AGE", "300"))   # seg. de cache en el navegador
+
+# Por nombre del miembro de WD_ALIGN_PARAGRAPH (sin importar python-docx acá)
+_ALINEACIONES = {
+    "CENTER": "center",
+    "RIGHT": "right",
+    "JUSTIFY": "justify",
+}
+
+
+# ==============================
+# DOCX -> HTML
+# ==============================
+def _runs_a_html(p: "Paragraph") -> str:
+    """Agrupa runs consecutivos con el mismo formato (así los {{ tags }} no se cortan)."""
+    # Negrita/cursiva heredadas del estilo del párrafo (p. ej. "Heading 1")
+    base = p.style.font if p.style is not None else None
+    negrita_base = bool(base and base.bold)
+    cursiva_base = bool(base and base.italic)
+
+    grupos = []
+    for r in p.runs:
+        fmt = (
+            negrita_base if r.bold is None else r.bold,
+            cursiva_base if r.italic is None else r.italic,
+            bool(r.underline),
+        )
+        if grupos and grupos[-1][0] == fmt:
+            grupos[-1][1].append(r.text)
+        else:
+            grupos.append((fmt, [r.text]))
+
+    partes = []
+    for (negrita, cursiva, subrayado), textos in grupos:
+        t = html.escape("".join(textos)).replace("\n", "<br>")
+        if subrayado:
+            t = f"<u>{t}</u>"
+        if cursiva:
+            t = f"<em>{t}</em>"
+        if negrita:
+            t = f"<strong>{t}</strong>"
+        partes.append(t)
+    return "".join(partes).strip()
+
+
+def _parrafo_a_html(p: "Paragraph") -> str:
+    contenido = _runs_a_html(p)
+    alin = _ALINEACIONES.get(getattr(p.alignment, "name", None))
+    estilo = f' style="text-align:{alin}"' if alin else ""
+    return f"<p{estilo}>{contenido or '&nbsp;'}</p>"
+
+
+def _tabla_a_html(t: "Table") -> str:
+    filas = []
+    for row in t.rows:
+        celdas = "".join(
+            "<td>" + "".join(_parrafo_a_html(p) for p in cell.paragraphs) + "</td>"
+            for cell in row.cells
+        )
+        filas.append(f"<tr>{celdas}</tr>")
+    return '<table class="contrato-tabla">' + "".join(filas) + "</table>"
+
+
+def docx_a_html(path_docx: str) -> str:
+    """Recorre el cuerpo en orden (párrafos y tablas) y arma el HTML de la vista previa."""
+    from docx import Document
+    from docx.oxml.ns import qn
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    doc = Document(path_docx)
+    parts = []
+    for el in doc.element.body.iterchildren():
+        if el.tag == qn("w:p"):
+            parts.append(_parrafo_a_html(Paragraph(el, doc._body)))
+        elif el.tag == qn("w:tbl"):
+            parts.append(_tabla_a_html(Table(el, doc._body)))
+    return "\n".join(parts)
+
+
+# ==============================
+# Caché en disco
+# ==============================
+def _leer_cache(nombre: str):
+    try:
+        with open(os.path.join(PREVIEW_CACHE_DIR, nombre), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _guardar_cache(nombre: str, data: bytes):
+    """Escritura atómica (tmp + rename): otro worker nunca lee un archivo a medias."""
+    ruta = os.path.join(PREVIEW_CACHE_DIR, nombre)
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(PREVIEW_CACHE_DIR, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, ruta)
+    except OSError:
+        pass   # sin disco escribible la página queda solo en memoria
+
+
+def contrato_html(path_docx: str) -> str:
+    """docx_a_html con caché en disco por sha256 del DOCX (sobrevive reinicios y deploys)."""
+    with open(path_docx, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:32]
+    nombre = f"contrato_{digest}.html"
+    cacheado = _leer_cache(nombre)
+    if cacheado is not None:
+        return cacheado.decode("utf-8")
+    cuerpo = docx_a_html(path_docx)
+    _guardar_cache(nombre, cuerpo.encode("utf-8"))
+    return cuerpo
+
+
+# ==============================
+# Página cacheada
+# ==============================
+class PaginaCacheada:
+    """HTML renderizado + variantes comprimidas + ETag fuerte."""
+
+    def __init__(self, clave, cuerpo: str):
+        self.clave = clave
+        self.identity = cuerpo.encode("utf-8")
+        self.hash = hashlib.sha256(self.identity).hexdigest()[:32]
+        self.variantes = {"identity": self.identity,
+                          "gzip": self._comprimida("gz", lambda b: gzip.compress(b, 9))}
+        if brotli is not None:
+            self.variantes["br"] = self._comprimida("br", lambda b: brotli.compress(b, quality=11))
+
+    def _comprimida(self, ext: str, comprimir) -> bytes:
+        """Variante comprimida desde el disco si otro proceso ya la generó (brotli 11 es lento)."""
+        nombre = f"pagina_{self.hash}.{ext}"
+        data = _leer_cache(nombre)
+        if data is None:
+            data = comprimir(self.identity)
+            _guardar_cache(nombre, data)
+        return data
+
+    def etag(self, codificacion: str) -> str:
+        return self.hash if codificacion == "identity" else f"{self.hash}-{codificacion}"
+
+    def responder(self, request) -> Response:
+        # El contenido es el mismo en todas las codificaciones: cualquiera de los ETags vale
+        codificacion = request.accept_encodings.best_match(
+            [c for c in ("br", "gzip") if c in self.variantes], default="identity")
+        if any(request.if_none_match.contains(self.etag(c)) for c in self.variantes):
+            resp = Response(status=304)
+        else:
+            resp = Response(self.variantes[codificacion], mimetype="text/html")
+            if codificacion != "identity":
+                resp.headers["Content-Encoding"] = codificacion
+        resp.set_etag(self.etag(codificacion))
+        resp.headers["Cache-Control"] = f"public, max-age={PREVIEW_MAX_AGE}, must-revalidate"
+        resp.headers["Vary"] = "Accept-Encoding"
+        return resp
+
+
+_PAGINA = None
+_LOCK = threading.Lock()
+
+
+def _clave_plantilla(path_docx: str):
+    st = os.stat(path_docx)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def get_pagina(path_docx: str, renderizar) -> PaginaCacheada:
+    """
+    Página de la vista previa; se regenera si cambia la plantilla.
+      - renderizar(contrato_html) -> str  (arma la página completa)
+    """
+    global _PAGINA
+    clave = _clave_plantilla(path_docx)
+    if _PAGINA is None or _PAGINA.clave != clave:
+        with _LOCK:
+            if _PAGINA is None or _PAGINA.clave != clave:
+                _PAGINA = PaginaCacheada(clave, renderizar(contrato_html(path_docx)))
+    return _PAGINA